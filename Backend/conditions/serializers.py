@@ -28,6 +28,8 @@ class MedicalConditionSerializer(serializers.ModelSerializer):
     
     def get_patient_count(self, obj):
         """Get count of active patients with this condition"""
+        if hasattr(obj, 'active_patient_count'):
+            return obj.active_patient_count
         return obj.patient_cases.filter(is_active=True).count()
 
 
@@ -10,6 +10,7 @@ from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404
 from datetime import date, timedelta
 
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import MedicalCondition, PatientCondition, ConditionProgress, ConditionDocument
 from .serializers import (
     MedicalConditionSerializer, MedicalConditionListSerializer,
@@ -22,7 +23,7 @@ from .serializers import (
 
 # ==================== Medical Condition Views ====================
 
-class MedicalConditionListCreateView(generics.ListCreateAPIView):
+class MedicalConditionListCreateView(SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     List all medical conditions or create a new one
     """
@@ -59,7 +60,7 @@ class MedicalConditionDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 # ==================== Patient Condition Views ====================
 
-class PatientConditionListCreateView(generics.ListCreateAPIView):
+class PatientConditionListCreateView(SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     List all patient conditions or create a new one
     """
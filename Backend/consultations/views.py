@@ -7,6 +7,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from django.db import models
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import Consultation, VitalSigns, ConsultationDocument, ConsultationImage
 from .serializers import (
     ConsultationSerializer, ConsultationCreateSerializer, VitalSignsSerializer,
@@ -15,7 +16,7 @@ from .serializers import (
 from audit.utils import PatientAccessLoggingMixin, ACCESS_VIEW_HISTORY
 
 
-class ConsultationViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class ConsultationViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_HISTORY
     """
     ViewSet for managing consultations
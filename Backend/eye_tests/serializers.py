@@ -174,6 +174,58 @@ class PediatricEyeExamSerializer(BaseEyeTestSerializer):
         ]
 
 
+class VitreoretinalAssessmentSerializer(BaseEyeTestSerializer):
+    """
+    Serializer for Vitreoretinal Assessment
+    """
+    class Meta(BaseEyeTestSerializer.Meta):
+        model = VitreoretinalAssessment
+        fields = BaseEyeTestSerializer.Meta.fields + [
+            'right_vitreous_clear', 'left_vitreous_clear',
+            'right_vitreous_hemorrhage', 'left_vitreous_hemorrhage',
+            'right_pvd', 'left_pvd',
+            'right_retinal_detachment', 'left_retinal_detachment', 'rd_type',
+            'right_macular_hole', 'left_macular_hole',
+            'right_epiretinal_membrane', 'left_epiretinal_membrane',
+            'surgery_required', 'surgical_procedure', 'urgency'
+        ]
+
+
+class EyeCasualtyAssessmentSerializer(BaseEyeTestSerializer):
+    """
+    Serializer for Eye Casualty Assessment
+    """
+    class Meta(BaseEyeTestSerializer.Meta):
+        model = EyeCasualtyAssessment
+        fields = BaseEyeTestSerializer.Meta.fields + [
+            'injury_type', 'triage_category', 'mechanism_of_injury', 'time_of_injury',
+            'pain_level', 'vision_loss', 'diplopia', 'photophobia', 'discharge',
+            'eyelid_injury', 'conjunctival_hemorrhage', 'corneal_abrasion', 'hyphema',
+            'pupil_abnormality', 'irrigation_performed', 'foreign_body_removed',
+            'pressure_patch_applied', 'admission_required', 'surgery_required',
+            'discharge_home', 'follow_up_arranged'
+        ]
+
+
+class CornealAssessmentSerializer(BaseEyeTestSerializer):
+    """
+    Serializer for Corneal Assessment
+    """
+    class Meta(BaseEyeTestSerializer.Meta):
+        model = CornealAssessment
+        fields = BaseEyeTestSerializer.Meta.fields + [
+            'right_upper_lid_normal', 'right_lower_lid_normal',
+            'left_upper_lid_normal', 'left_lower_lid_normal', 'lid_abnormalities',
+            'right_conjunctiva_normal', 'left_conjunctiva_normal',
+            'conjunctival_injection', 'conjunctival_discharge',
+            'right_cornea_clear', 'left_cornea_clear',
+            'corneal_opacity', 'corneal_edema', 'corneal_neovascularization',
+            'fluorescein_staining_performed', 'right_staining_pattern', 'left_staining_pattern',
+            'dry_eye_present', 'keratoconus', 'corneal_dystrophy',
+            'lubricants_prescribed', 'antibiotics_prescribed', 'steroids_prescribed'
+        ]
+
+
 class OCTScanSerializer(BaseEyeTestSerializer):
     """
     Serializer for OCT Scan
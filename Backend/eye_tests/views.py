@@ -5,6 +5,7 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db import models
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import (
     VisualAcuityTest, RefractionTest, CataractAssessment, GlaucomaAssessment,
     VisualFieldTest, RetinalAssessment, DiabeticRetinopathyScreening,
@@ -20,7 +21,7 @@ from .serializers import (
 from audit.utils import PatientAccessLoggingMixin, ACCESS_VIEW_TEST_RESULTS
 
 
-class VisualAcuityTestViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class VisualAcuityTestViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing visual acuity tests
@@ -44,7 +45,7 @@ class VisualAcuityTestViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
         return queryset.order_by('-test_date')
 
 
-class RefractionTestViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class RefractionTestViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing refraction tests
@@ -68,7 +69,7 @@ class RefractionTestViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
         return queryset.order_by('-test_date')
 
 
-class CataractAssessmentViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class CataractAssessmentViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing cataract assessments
@@ -88,7 +89,7 @@ class CataractAssessmentViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet
         return queryset.order_by('-test_date')
 
 
-class GlaucomaAssessmentViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class GlaucomaAssessmentViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing glaucoma assessments
@@ -108,7 +109,7 @@ class GlaucomaAssessmentViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet
         return queryset.order_by('-test_date')
 
 
-class VisualFieldTestViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class VisualFieldTestViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing visual field tests
@@ -128,7 +129,7 @@ class VisualFieldTestViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
         return queryset.order_by('-test_date')
 
 
-class RetinalAssessmentViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class RetinalAssessmentViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing retinal assessments
@@ -148,7 +149,7 @@ class RetinalAssessmentViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet)
         return queryset.order_by('-test_date')
 
 
-class DiabeticRetinopathyScreeningViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class DiabeticRetinopathyScreeningViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing diabetic retinopathy screenings
@@ -168,7 +169,7 @@ class DiabeticRetinopathyScreeningViewSet(PatientAccessLoggingMixin, viewsets.Mo
         return queryset.order_by('-test_date')
 
 
-class OCTScanViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+class OCTScanViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     _access_type = ACCESS_VIEW_TEST_RESULTS
     """
     ViewSet for managing OCT scans
@@ -6,6 +6,7 @@ from .models import (
     Medication, Prescription, PrescriptionItem, MedicationAdministration,
     DrugAllergy, Manufacturer, MedicationCategory, MedicationRecall
 )
+from patients.identifiers import PRESCRIPTION_NUMBERS
 
 
 class ManufacturerSerializer(serializers.ModelSerializer):
@@ -116,6 +117,8 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'prescription_number', 'patient_name', 'prescribed_by_name',
                            'items', 'total_items', 'created_at', 'updated_at', 'date_prescribed']
+        # Relations read by method fields, for ?fields= queryset optimization
+        field_relations = {'total_items': ['items']}
     
     def get_total_items(self, obj):
         """Count total prescription items"""
@@ -177,17 +180,8 @@ class PrescriptionCreateSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         """Create prescription with auto-generated prescription number"""
-        import random
-        import string
-        from django.db import IntegrityError
-        
-        while True:
-            prescription_number = 'RX' + ''.join(random.choices(string.digits, k=8))
-            try:
-                validated_data['prescription_number'] = prescription_number
-                return Prescription.objects.create(**validated_data)
-            except IntegrityError:
-                continue
+        validated_data['prescription_number'] = PRESCRIPTION_NUMBERS.next()
+        return Prescription.objects.create(**validated_data)
 
 
 class MedicationRecallSerializer(serializers.ModelSerializer):
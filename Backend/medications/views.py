@@ -6,6 +6,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db import models
 from rest_framework.permissions import IsAuthenticated
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import (
     Medication, Prescription, PrescriptionItem, MedicationAdministration,
     DrugAllergy, Manufacturer, MedicationCategory, MedicationRecall
@@ -71,7 +72,7 @@ class MedicationCategoryViewSet(viewsets.ModelViewSet):
         serializer.save(created_by=self.request.user)
 
 
-class MedicationViewSet(viewsets.ModelViewSet):
+class MedicationViewSet(SparseFieldsetsMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing medications
     """
@@ -119,7 +120,7 @@ class MedicationViewSet(viewsets.ModelViewSet):
         return Response([{'value': value, 'label': label} for value, label in classes])
 
 
-class PrescriptionViewSet(viewsets.ModelViewSet):
+class PrescriptionViewSet(SparseFieldsetsMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing prescriptions
     """
@@ -135,7 +136,9 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter prescriptions based on parameters"""
-        queryset = Prescription.objects.select_related('patient', 'prescribing_doctor')
+        queryset = Prescription.objects.select_related(
+            'patient', 'prescribing_doctor'
+        ).prefetch_related('items__medication')
         
         # Filter by patient
         patient_id = self.request.query_params.get('patient', None)
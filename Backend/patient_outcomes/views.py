@@ -7,13 +7,14 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import PatientOutcomeReport
 from .serializers import PatientOutcomeReportSerializer
 
 logger = logging.getLogger(__name__)
 
 
-class PatientOutcomeReportViewSet(viewsets.ModelViewSet):
+class PatientOutcomeReportViewSet(SparseFieldsetsMixin, viewsets.ModelViewSet):
     """
     CRUD for patient outcome questionnaires.
 
@@ -2,7 +2,11 @@
 Admin configuration for patients app
 """
 from django.contrib import admin
-from .models import Patient, PatientVisit, PatientDocument, AppointmentAlert, AlertConfiguration
+from .models import (
+    Patient, PatientVisit, PatientDocument, AppointmentAlert, AppointmentAlertArchive, AlertConfiguration,
+    AlertNotification
+)
+from .alert_service import AlertService
 
 
 @admin.register(Patient)
@@ -61,7 +65,7 @@ class AppointmentAlertAdmin(admin.ModelAdmin):
     list_filter = ('alert_type', 'severity', 'status', 'trigger_time')
     search_fields = ('patient__first_name', 'patient__last_name', 'patient__patient_id', 'title', 'message')
     raw_id_fields = ('patient', 'visit', 'acknowledged_by', 'resolved_by')
-    readonly_fields = ('trigger_time', 'created_at', 'updated_at')
+    readonly_fields = ('trigger_time', 'dedup_key', 'created_at', 'updated_at')
     date_hierarchy = 'trigger_time'
     
     fieldsets = (
@@ -78,7 +82,7 @@ class AppointmentAlertAdmin(admin.ModelAdmin):
             'fields': ('action_taken', 'notes')
         }),
         ('System', {
-            'fields': ('created_at', 'updated_at'),
+            'fields': ('dedup_key', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
@@ -88,7 +92,8 @@ class AppointmentAlertAdmin(admin.ModelAdmin):
     def mark_as_acknowledged(self, request, queryset):
         """Bulk acknowledge alerts"""
         from django.utils import timezone
-        updated = queryset.filter(status='active').update(
+        updated = AlertService.bulk_transition(
+            queryset.filter(status='active'),
             status='acknowledged',
             acknowledged_at=timezone.now(),
             acknowledged_by=request.user
@@ -99,7 +104,8 @@ class AppointmentAlertAdmin(admin.ModelAdmin):
     def mark_as_resolved(self, request, queryset):
         """Bulk resolve alerts"""
         from django.utils import timezone
-        updated = queryset.filter(status__in=['active', 'acknowledged']).update(
+        updated = AlertService.bulk_transition(
+            queryset.filter(status__in=['active', 'acknowledged']),
             status='resolved',
             resolved_at=timezone.now(),
             resolved_by=request.user
@@ -110,7 +116,8 @@ class AppointmentAlertAdmin(admin.ModelAdmin):
     def mark_as_dismissed(self, request, queryset):
         """Bulk dismiss alerts"""
         from django.utils import timezone
-        updated = queryset.filter(status__in=['active', 'acknowledged']).update(
+        updated = AlertService.bulk_transition(
+            queryset.filter(status__in=['active', 'acknowledged']),
             status='dismissed',
             resolved_at=timezone.now(),
             resolved_by=request.user
@@ -119,6 +126,30 @@ class AppointmentAlertAdmin(admin.ModelAdmin):
     mark_as_dismissed.short_description = 'Dismiss selected alerts'
 
 
+@admin.register(AppointmentAlertArchive)
+class AppointmentAlertArchiveAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'alert_type', 'severity', 'status', 'trigger_time', 'resolved_at', 'archived_at')
+    list_filter = ('alert_type', 'severity', 'status')
+    search_fields = ('patient__first_name', 'patient__last_name', 'patient__patient_id', 'title')
+    raw_id_fields = ('patient', 'visit', 'acknowledged_by', 'resolved_by')
+    date_hierarchy = 'trigger_time'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AlertNotification)
+class AlertNotificationAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'alert', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('recipient__username', 'recipient__email')
+    raw_id_fields = ('alert', 'recipient')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
+
 @admin.register(AlertConfiguration)
 class AlertConfigurationAdmin(admin.ModelAdmin):
     list_display = ('id', 'is_active', 'late_threshold_minutes', 'missed_threshold_minutes', 'created_at')
@@ -130,7 +161,7 @@ class AlertConfigurationAdmin(admin.ModelAdmin):
             'fields': ('late_threshold_minutes', 'missed_threshold_minutes', 'upcoming_reminder_minutes', 'overdue_followup_days')
         }),
         ('Auto-Resolution', {
-            'fields': ('auto_resolve_on_checkin', 'auto_dismiss_after_days')
+            'fields': ('auto_resolve_on_checkin', 'auto_dismiss_after_days', 'archive_after_days')
         }),
         ('Notifications', {
             'fields': ('send_email_alerts', 'send_sms_alerts')
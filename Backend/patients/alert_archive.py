@@ -0,0 +1,111 @@
+"""
+Alert archival for PreciseOptics.
+
+Moves resolved and dismissed alerts past a configurable age from the hot
+AppointmentAlert table into AppointmentAlertArchive. Work is done in small
+batches, each in its own transaction, so an interrupted run loses at most
+one batch and simply continues where it stopped when run again.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AppointmentAlert, AppointmentAlertArchive, AppointmentAlertChange, AlertNotification
+from .alert_service import AlertService
+from . import alert_statistics
+
+TERMINAL_STATUSES = alert_statistics.TERMINAL_STATUSES
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Column names shared by AppointmentAlert and AppointmentAlertArchive
+ARCHIVED_FIELDS = [field.attname for field in AppointmentAlert._meta.concrete_fields]
+
+
+def archivable_alerts(older_than_days):
+    """Terminal alerts resolved (or last updated, if never resolved) before the cutoff"""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return AppointmentAlert.objects.filter(status__in=TERMINAL_STATUSES).filter(
+        Q(resolved_at__lt=cutoff) | Q(resolved_at__isnull=True, updated_at__lt=cutoff)
+    )
+
+
+def _delete_alerts(ids):
+    """
+    DELETE the alert rows with one statement. Model deletion would send the
+    per-row delete signals, which log 'deleted' changes and move statistics;
+    archive_batch records those itself.
+    """
+    opts = AppointmentAlert._meta
+    quote = connection.ops.quote_name
+    params = [opts.pk.get_db_prep_value(pk, connection) for pk in ids]
+    placeholders = ', '.join(['%s'] * len(params))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(opts.db_table)} WHERE {quote(opts.pk.column)} IN ({placeholders})', params
+        )
+
+
+def archive_batch(older_than_days, batch_size=DEFAULT_BATCH_SIZE):
+    """Move one batch of archivable alerts in a single transaction. Returns rows moved."""
+    with transaction.atomic():
+        rows = list(
+            archivable_alerts(older_than_days)
+            .select_for_update()
+            .order_by('resolved_at', 'id')
+            .values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        # ignore_conflicts keeps a re-run idempotent if an archive row already exists
+        AppointmentAlertArchive.objects.bulk_create(
+            [AppointmentAlertArchive(**row) for row in rows],
+            ignore_conflicts=True
+        )
+
+        ids = [row['id'] for row in rows]
+        # Queued e-mails for closed alerts would only be cancelled by the dispatcher
+        AlertNotification.objects.filter(alert_id__in=ids).delete()
+        # The change log and statistics are updated in bulk below
+        _delete_alerts(ids)
+
+        AlertService.record_changes([(row['id'], row['status']) for row in rows], 'archived')
+        alert_statistics.record_transitions(
+            ({name: row[name] for name in AppointmentAlert.BUCKET_FIELDS}, None) for row in rows
+        )
+    return len(rows)
+
+
+def archive_alerts(older_than_days, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Archive batches until nothing is left (or max_batches is reached). Returns rows moved."""
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(older_than_days, batch_size)
+        total += moved
+        batches += 1
+        if moved < batch_size:
+            break
+    return total
+
+
+def prune_change_log(older_than_days, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete change log entries older than the cutoff in batches. Feed clients
+    whose cursor predates the retained log must reload the alert list.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        sequences = list(
+            AppointmentAlertChange.objects.filter(changed_at__lt=cutoff)
+            .order_by('sequence')
+            .values_list('sequence', flat=True)[:batch_size]
+        )
+        if not sequences:
+            return total
+        AppointmentAlertChange.objects.filter(sequence__in=sequences).delete()
+        total += len(sequences)
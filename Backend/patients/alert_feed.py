@@ -0,0 +1,189 @@
+"""
+Alert change feed for PreciseOptics front-desk dashboards.
+
+Clients remember the last change sequence they have seen and ask only for
+newer entries, either by long-polling (JSON) or with an EventSource
+(Server-Sent Events). Each poll is one range scan on the change log's
+primary key instead of a full alert list query.
+
+Sequence numbers are handed out when a change is inserted, not when its
+transaction commits, so on PostgreSQL or MySQL a change can become visible
+after a higher-numbered one a client has already moved past. The feed only
+serves changes older than VISIBILITY_LAG_SECONDS, and stops at the first
+newer one, so a change is never skipped as long as the transaction that
+wrote it commits within that lag. Alerts are written in short transactions;
+a change committed later than that can be missed until the dashboard's next
+full reload.
+"""
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+
+from .models import AppointmentAlertChange
+from .serializers import AppointmentAlertListSerializer
+
+# Maximum changes returned per response / event
+MAX_CHANGES = 500
+
+# Long-poll limits (seconds)
+MAX_WAIT_SECONDS = 25
+POLL_INTERVAL_SECONDS = 1
+
+# SSE streams close after this long so clients reconnect with Last-Event-ID
+STREAM_DURATION_SECONDS = 300
+HEARTBEAT_SECONDS = 15
+
+# Changes younger than this are held back until any lower sequence numbers
+# still in open transactions have committed
+VISIBILITY_LAG_SECONDS = 2
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF content negotiation accept EventSource requests.
+    Successful responses are streamed directly; this only renders errors.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def visible_before():
+    """Changes logged before this time are safe to serve"""
+    return timezone.now() - timedelta(seconds=VISIBILITY_LAG_SECONDS)
+
+
+def latest_sequence():
+    """
+    Return the sequence a new client starts from: the last change before the
+    first one still inside the visibility lag (0 if the log is empty)
+    """
+    cutoff = visible_before()
+    # Changes inside the lag can only be among the newest few
+    tail = list(
+        AppointmentAlertChange.objects.order_by('-sequence')
+        .values_list('sequence', 'changed_at')[:MAX_CHANGES]
+    )
+    if not tail:
+        return 0
+    head = tail[-1][0] - 1
+    for sequence, changed_at in reversed(tail):
+        if changed_at >= cutoff:
+            break
+        head = sequence
+    return head
+
+
+def poll_changes(since, limit=MAX_CHANGES):
+    """
+    Return the feed payload for changes after `since`, or None if there are none.
+    The alert rows are joined in the same query for the list representation.
+    """
+    cutoff = visible_before()
+    changes = list(
+        AppointmentAlertChange.objects.filter(sequence__gt=since)
+        .select_related('alert__patient')
+        .order_by('sequence')[:limit + 1]
+    )
+    # Serve in sequence order up to the first change still inside the lag
+    for index, change in enumerate(changes):
+        if change.changed_at >= cutoff:
+            changes = changes[:index]
+            break
+    if not changes:
+        return None
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        'since': since,
+        'last_sequence': changes[-1].sequence,
+        'has_more': has_more,
+        'changes': [
+            {
+                'sequence': change.sequence,
+                'alert_id': str(change.alert_id),
+                'change_type': change.change_type,
+                'status': change.status,
+                'changed_at': change.changed_at,
+                # None once the alert itself has been deleted
+                'alert': AppointmentAlertListSerializer(change.alert).data if change.alert else None,
+            }
+            for change in changes
+        ],
+    }
+
+
+def empty_payload(since):
+    return {'since': since, 'last_sequence': since, 'has_more': False, 'changes': []}
+
+
+def wait_for_changes(since, limit=MAX_CHANGES, wait=0):
+    """Long-poll: re-check the change log until something arrives or `wait` seconds pass"""
+    deadline = time.monotonic() + wait
+    while True:
+        payload = poll_changes(since, limit)
+        remaining = deadline - time.monotonic()
+        if payload or remaining <= 0:
+            return payload or empty_payload(since)
+        time.sleep(min(POLL_INTERVAL_SECONDS, remaining))
+
+
+def _format_event(payload):
+    return (
+        f"id: {payload['last_sequence']}\n"
+        f"event: changes\n"
+        f"data: {json.dumps(payload, cls=DjangoJSONEncoder)}\n\n"
+    )
+
+
+async def _stream_async(since, limit):
+    """Hold the connection open under ASGI, pushing each batch of changes as it arrives"""
+    poll = sync_to_async(poll_changes)
+    started = last_sent = time.monotonic()
+    yield f"retry: {POLL_INTERVAL_SECONDS * 1000}\n\n"
+    while time.monotonic() - started < STREAM_DURATION_SECONDS:
+        payload = await poll(since, limit)
+        if payload:
+            since = payload['last_sequence']
+            last_sent = time.monotonic()
+            yield _format_event(payload)
+            continue
+        if time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+            last_sent = time.monotonic()
+            yield ': keep-alive\n\n'
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _stream_sync(since, limit):
+    """
+    Under WSGI a held-open stream would pin a worker thread, so send one
+    long-polled batch and close; EventSource reconnects with Last-Event-ID.
+    """
+    yield f"retry: {POLL_INTERVAL_SECONDS * 1000}\n\n"
+    payload = wait_for_changes(since, limit, MAX_WAIT_SECONDS)
+    if payload['changes']:
+        yield _format_event(payload)
+
+
+def event_stream_response(request, since, limit=MAX_CHANGES):
+    """Build an SSE response, streaming continuously only when served over ASGI"""
+    if isinstance(request, ASGIRequest):
+        stream = _stream_async(since, limit)
+    else:
+        stream = _stream_sync(since, limit)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,206 @@
+"""
+Alert e-mail notifications for PreciseOptics.
+
+Alert generation only queues AlertNotification rows (one cheap bulk INSERT),
+so scans never wait on SMTP. The dispatcher later groups due rows per
+recipient into a single digest e-mail and sends all digests over one reused
+connection from Django's configured e-mail backend, with rate limiting and
+exponential-backoff retries.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AppointmentAlert, AlertConfiguration, AlertNotification
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_RATE_PER_MINUTE = 60
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Claimed rows are hidden from other dispatchers for as long as sending the
+# batch at the configured rate may take, plus this margin
+LEASE_MINUTES = 10
+
+# Sending stops this long before the lease expires
+LEASE_SAFETY_MARGIN = timedelta(minutes=5)
+
+UPDATED_FIELDS = ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+
+SEVERITY_ORDER = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+
+
+def enqueue(alerts_with_recipients, config=None):
+    """
+    Queue notifications for newly created alerts.
+    Takes (alert, recipient) pairs; pairs without a recipient, or whose
+    recipient is inactive or has no e-mail address, are skipped. Does nothing
+    unless e-mail alerts are enabled in the (active) AlertConfiguration.
+    """
+    config = config or AlertConfiguration.get_active_config()
+    if not config.send_email_alerts:
+        return []
+
+    notifications = [
+        AlertNotification(alert=alert, recipient=recipient)
+        for alert, recipient in alerts_with_recipients
+        if recipient is not None and recipient.is_active and recipient.email
+    ]
+    return AlertNotification.objects.bulk_create(notifications, batch_size=DEFAULT_BATCH_SIZE)
+
+
+def lease_duration(batch_size=DEFAULT_BATCH_SIZE, rate_per_minute=DEFAULT_RATE_PER_MINUTE):
+    """How long a batch is leased: one digest per row at the rate limit, plus a margin"""
+    sending = batch_size / rate_per_minute if rate_per_minute else 0
+    return timedelta(minutes=LEASE_MINUTES + sending)
+
+
+def claim_due(batch_size=DEFAULT_BATCH_SIZE, lease=None):
+    """
+    Lease up to batch_size due notifications so concurrent dispatchers skip them.
+    A crashed dispatcher's rows become due again when the lease expires.
+    """
+    lease = lease or lease_duration(batch_size)
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            AlertNotification.objects.select_for_update()
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        AlertNotification.objects.filter(id__in=ids).update(
+            next_attempt_at=now + lease
+        )
+    return list(
+        AlertNotification.objects.filter(id__in=ids).select_related('alert__patient', 'recipient')
+    )
+
+
+def build_digest(recipient, notifications):
+    """One plain-text e-mail listing every alert queued for this recipient"""
+    alerts = sorted(
+        (n.alert for n in notifications),
+        key=lambda alert: (SEVERITY_ORDER.get(alert.severity, 99), alert.trigger_time)
+    )
+    count = len(alerts)
+    lines = [
+        f"Dear {recipient.get_full_name() or recipient.username},",
+        "",
+        f"The following {count} patient alert{'s' if count != 1 else ''} need your attention:",
+        "",
+    ]
+    for alert in alerts:
+        lines.extend([
+            f"[{alert.get_severity_display().upper()}] {alert.title}",
+            f"  {alert.message}",
+            f"  Triggered: {timezone.localtime(alert.trigger_time).strftime('%d %b %Y %H:%M')}",
+            "",
+        ])
+    lines.append("This is an automated message from PreciseOptics. Please review these alerts in the Alert Center.")
+
+    return EmailMessage(
+        subject=f"[PreciseOptics] {count} new patient alert{'s' if count != 1 else ''}",
+        body="\n".join(lines),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient.email],
+    )
+
+
+def _record_failure(notifications, error, now, max_attempts, stats):
+    """Back off (or give up on) notifications whose delivery failed"""
+    for notification in notifications:
+        notification.attempts += 1
+        notification.last_error = str(error)[:1000]
+        if notification.attempts >= max_attempts:
+            notification.status = 'failed'
+            stats['failed'] += 1
+        else:
+            notification.status = 'pending'
+            notification.next_attempt_at = now + timedelta(minutes=2 ** notification.attempts)
+            stats['retried'] += 1
+
+
+def _save(notifications):
+    AlertNotification.objects.bulk_update(notifications, UPDATED_FIELDS, batch_size=DEFAULT_BATCH_SIZE)
+
+
+def dispatch(batch_size=DEFAULT_BATCH_SIZE, rate_per_minute=DEFAULT_RATE_PER_MINUTE,
+             max_attempts=DEFAULT_MAX_ATTEMPTS, connection=None):
+    """
+    Send due notifications as per-recipient digests over a single connection.
+    Each digest's rows are saved as soon as it is sent, so a crash mid-run
+    never sends them again. Sending stops before the lease runs out; rows
+    not reached are released for the next run.
+    Returns counts of digests sent, notifications sent/retried/failed/cancelled.
+    """
+    stats = {'digests': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'cancelled': 0}
+    lease = lease_duration(batch_size, rate_per_minute)
+    lease_ends = time.monotonic() + (lease - LEASE_SAFETY_MARGIN).total_seconds()
+    notifications = claim_due(batch_size, lease)
+    if not notifications:
+        return stats
+
+    now = timezone.now()
+    by_recipient = defaultdict(list)
+    cancelled = []
+    for notification in notifications:
+        alert = notification.alert
+        if alert is None or alert.status not in AppointmentAlert.OPEN_STATUSES:
+            # Alert was resolved, dismissed or archived before we got to it
+            notification.status = 'cancelled'
+            cancelled.append(notification)
+            stats['cancelled'] += 1
+        else:
+            by_recipient[notification.recipient].append(notification)
+    if cancelled:
+        _save(cancelled)
+
+    min_interval = 60.0 / rate_per_minute if rate_per_minute else 0
+    connection = connection or get_connection()
+    last_sent_at = None
+    try:
+        if by_recipient:
+            try:
+                connection.open()
+            except Exception as e:
+                # Nothing can be sent this run; every leased row backs off
+                for pending in by_recipient.values():
+                    _record_failure(pending, e, now, max_attempts, stats)
+                _save([notification for pending in by_recipient.values() for notification in pending])
+                by_recipient = {}
+        recipients = list(by_recipient.items())
+        for index, (recipient, pending) in enumerate(recipients):
+            if last_sent_at is not None and min_interval:
+                wait = min_interval - (time.monotonic() - last_sent_at)
+                if wait > 0:
+                    time.sleep(wait)
+            if time.monotonic() >= lease_ends:
+                # Another dispatcher may claim these soon; make them due again now
+                released = [notification for _, rest in recipients[index:] for notification in rest]
+                for notification in released:
+                    notification.next_attempt_at = timezone.now()
+                _save(released)
+                break
+            try:
+                connection.send_messages([build_digest(recipient, pending)])
+            except Exception as e:
+                _record_failure(pending, e, now, max_attempts, stats)
+            else:
+                stats['digests'] += 1
+                for notification in pending:
+                    notification.attempts += 1
+                    notification.status = 'sent'
+                    notification.sent_at = timezone.now()
+                    notification.last_error = ''
+                    stats['sent'] += 1
+            _save(pending)
+            last_sent_at = time.monotonic()
+    finally:
+        connection.close()
+
+    return stats
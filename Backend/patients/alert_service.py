@@ -1,9 +1,11 @@
 """
 Alert Service for generating and managing appointment alerts
 """
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
-from .models import PatientVisit, AppointmentAlert, AlertConfiguration
+from .models import PatientVisit, AppointmentAlert, AppointmentAlertChange, AlertConfiguration
+from . import alert_notifications, alert_statistics
 
 
 class AlertService:
@@ -11,11 +13,56 @@ class AlertService:
     Service for generating and managing appointment alerts
     """
     
+    # Rows per IN-lookup / INSERT batch for bulk alert operations
+    BATCH_SIZE = 500
+    
     @staticmethod
     def get_config():
         """Get active alert configuration"""
         return AlertConfiguration.get_active_config()
     
+    @staticmethod
+    def record_changes(changes, change_type):
+        """
+        Append entries to the alert change log.
+        `changes` is an iterable of (alert_id, status) pairs. Single-row saves
+        are logged by the post_save signal; bulk paths call this directly.
+        """
+        AppointmentAlertChange.objects.bulk_create(
+            [
+                AppointmentAlertChange(alert_id=alert_id, change_type=change_type, status=alert_status)
+                for alert_id, alert_status in changes
+            ],
+            batch_size=AlertService.BATCH_SIZE
+        )
+    
+    @staticmethod
+    def bulk_transition(queryset, **updates):
+        """
+        Apply a status update to every alert in queryset with a single UPDATE,
+        logging one change per affected alert and moving them between
+        statistics buckets in the same transaction. Returns the number updated.
+        """
+        with transaction.atomic():
+            before_rows = list(
+                queryset.select_for_update().values('id', *AppointmentAlert.BUCKET_FIELDS)
+            )
+            if not before_rows:
+                return 0
+            alert_ids = [row.pop('id') for row in before_rows]
+            AppointmentAlert.objects.filter(id__in=alert_ids).update(**updates)
+            AlertService.record_changes(
+                [(alert_id, updates['status']) for alert_id in alert_ids],
+                'status_changed'
+            )
+            bucket_updates = {
+                name: value for name, value in updates.items() if name in AppointmentAlert.BUCKET_FIELDS
+            }
+            alert_statistics.record_transitions(
+                (row, {**row, **bucket_updates}) for row in before_rows
+            )
+        return len(alert_ids)
+    
     @staticmethod
     def generate_alerts_for_visit(visit):
         """
@@ -57,6 +104,7 @@ class AlertService:
                     message=f"Patient {visit.patient.get_full_name()} (ID: {visit.patient.patient_id}) is {int(minutes_late)} minutes late for their {visit.get_visit_type_display()} appointment scheduled at {visit.scheduled_date.strftime('%I:%M %p')}.",
                     trigger_time=now
                 )
+                alert_notifications.enqueue([(alert, visit.primary_doctor)], config)
                 created_alerts.append(alert)
         
         # Check for missed appointment
@@ -70,11 +118,12 @@ class AlertService:
             
             if not existing_missed:
                 # Auto-resolve any late alerts
-                AppointmentAlert.objects.filter(
-                    visit=visit,
-                    alert_type='late',
-                    status='active'
-                ).update(
+                AlertService.bulk_transition(
+                    AppointmentAlert.objects.filter(
+                        visit=visit,
+                        alert_type='late',
+                        status='active'
+                    ),
                     status='resolved',
                     resolved_at=now,
                     action_taken='Auto-resolved: Escalated to missed appointment'
@@ -90,6 +139,7 @@ class AlertService:
                     message=f"Patient {visit.patient.get_full_name()} (ID: {visit.patient.patient_id}) has missed their {visit.get_visit_type_display()} appointment scheduled at {visit.scheduled_date.strftime('%I:%M %p on %b %d, %Y')}. Please contact patient.",
                     trigger_time=now
                 )
+                alert_notifications.enqueue([(alert, visit.primary_doctor)], config)
                 created_alerts.append(alert)
         
         return created_alerts
@@ -107,7 +157,7 @@ class AlertService:
         scheduled_visits = PatientVisit.objects.filter(
             status='scheduled',
             scheduled_date__lte=now
-        ).select_related('patient')
+        ).select_related('patient', 'primary_doctor')
         
         stats = {
             'scanned': 0,
@@ -146,7 +196,7 @@ class AlertService:
             status='scheduled',
             scheduled_date__gte=now,
             scheduled_date__lte=reminder_window
-        ).select_related('patient')
+        ).select_related('patient', 'primary_doctor')
         
         created_alerts = []
         
@@ -172,6 +222,7 @@ class AlertService:
                     message=f"Patient {visit.patient.get_full_name()} has a {visit.get_visit_type_display()} appointment in {minutes_until} minutes at {visit.scheduled_date.strftime('%I:%M %p')}.",
                     trigger_time=now
                 )
+                alert_notifications.enqueue([(alert, visit.primary_doctor)], config)
                 created_alerts.append(alert)
         
         return created_alerts
@@ -244,13 +295,65 @@ class AlertService:
 
         return created_alerts
 
+    @staticmethod
+    def _open_dedup_keys(keys):
+        """
+        Return the subset of dedup keys that already have an open alert.
+        Looks keys up in chunks against the indexed dedup_key column rather
+        than loading every existing alert.
+        """
+        keys = list(keys)
+        chunk_size = AlertService.BATCH_SIZE
+        existing = set()
+        for start in range(0, len(keys), chunk_size):
+            existing.update(
+                AppointmentAlert.objects.filter(
+                    dedup_key__in=keys[start:start + chunk_size],
+                    status__in=AppointmentAlert.OPEN_STATUSES,
+                ).values_list('dedup_key', flat=True)
+            )
+        return existing
+
+    @staticmethod
+    def _bulk_create_deduplicated(alerts):
+        """
+        Insert generated alerts in batches, letting the database skip any row
+        whose dedup_key already belongs to an open alert (e.g. one created by a
+        concurrent scan; not on MySQL, see check_clinical_followups). Returns
+        only the alerts that were actually inserted.
+        """
+        if not alerts:
+            return []
+
+        chunk_size = AlertService.BATCH_SIZE
+        with transaction.atomic():
+            AppointmentAlert.objects.bulk_create(alerts, batch_size=chunk_size, ignore_conflicts=True)
+
+            # ignore_conflicts gives no per-row feedback; UUIDs are assigned client-side
+            # so read back which of our ids made it in.
+            ids = [alert.id for alert in alerts]
+            inserted_ids = set()
+            for start in range(0, len(ids), chunk_size):
+                inserted_ids.update(
+                    AppointmentAlert.objects.filter(
+                        id__in=ids[start:start + chunk_size]
+                    ).values_list('id', flat=True)
+                )
+            inserted = [alert for alert in alerts if alert.id in inserted_ids]
+            AlertService.record_changes([(alert.id, alert.status) for alert in inserted], 'created')
+            alert_statistics.record_transitions((None, alert.bucket_values()) for alert in inserted)
+        return inserted
+
     @staticmethod
     def check_clinical_followups():
         """
         Create AppointmentAlert records for overdue clinical follow-ups:
         eye tests, treatments, missed TreatmentFollowUp appointments,
         and consultations that requested a return visit.
-        Uses notes field as a dedup key (ref_id:TYPE:UUID) to avoid duplicates.
+        Each alert carries a dedup_key (TYPE:UUID); the partial unique
+        constraint on open alerts keeps concurrent scans from duplicating them
+        (except on MySQL, which does not enforce conditional constraints and
+        only has the pre-check against existing open alerts).
         """
         from eye_tests.models import (
             VisualAcuityTest, RefractionTest, CataractAssessment,
@@ -264,7 +367,9 @@ class AlertService:
 
         now = timezone.now()
         today = now.date()
-        created_alerts = []
+        new_alerts = []
+        # Clinician to notify for each generated alert, keyed by dedup_key
+        recipients = {}
 
         EYE_TEST_MODELS = [
             (VisualAcuityTest, 'Visual Acuity Test'),
@@ -282,29 +387,24 @@ class AlertService:
             (OCTScan, 'OCT Scan'),
         ]
 
-        # Build set of existing ref_ids to avoid N+1 existence checks
-        existing_refs = set(
-            AppointmentAlert.objects.filter(
-                alert_type='overdue_followup',
-                status__in=['active', 'acknowledged'],
-                notes__startswith='ref_id:',
-            ).values_list('notes', flat=True)
-        )
-
         # ── 1. Eye test follow-ups ─────────────────────────────────────────
         for Model, model_label in EYE_TEST_MODELS:
-            for test in Model.objects.filter(
-                follow_up_required=True,
-                follow_up_date__isnull=False,
-                follow_up_date__lte=today,
-            ).select_related('patient', 'performed_by'):
-                ref_key = f'ref_id:eye_test:{test.id}'
-                if ref_key in existing_refs:
+            tests = {
+                f'eye_test:{test.id}': test
+                for test in Model.objects.filter(
+                    follow_up_required=True,
+                    follow_up_date__isnull=False,
+                    follow_up_date__lte=today,
+                ).select_related('patient', 'performed_by')
+            }
+            existing_keys = AlertService._open_dedup_keys(tests.keys())
+            for ref_key, test in tests.items():
+                if ref_key in existing_keys:
                     continue
                 days_overdue = (today - test.follow_up_date).days
                 severity = 'critical' if days_overdue > 60 else 'high' if days_overdue > 14 else 'medium'
                 performed_by_name = test.performed_by.get_full_name() if test.performed_by else 'Unknown'
-                alert = AppointmentAlert.objects.create(
+                new_alerts.append(AppointmentAlert(
                     patient=test.patient,
                     visit=None,
                     alert_type='overdue_followup',
@@ -317,12 +417,12 @@ class AlertService:
                         f"Test performed by {performed_by_name}."
                     ),
                     trigger_time=now,
-                    notes=ref_key,
-                )
-                created_alerts.append(alert)
-                existing_refs.add(ref_key)
+                    dedup_key=ref_key,
+                ))
+                recipients[ref_key] = test.performed_by
 
         # ── 2. Treatment follow-ups ────────────────────────────────────────
+        treatments = {}
         for tr in Treatment.objects.filter(
             requires_follow_up=True,
             status='completed',
@@ -334,14 +434,16 @@ class AlertService:
                 continue
             if tr.follow_ups.filter(status='completed').exists():
                 continue
-            ref_key = f'ref_id:treatment:{tr.id}'
-            if ref_key in existing_refs:
+            treatments[f'treatment:{tr.id}'] = (tr, due_date)
+        existing_keys = AlertService._open_dedup_keys(treatments.keys())
+        for ref_key, (tr, due_date) in treatments.items():
+            if ref_key in existing_keys:
                 continue
             days_overdue = (today - due_date).days
             severity = 'critical' if days_overdue > 60 else 'high' if days_overdue > 14 else 'medium'
             type_name = tr.treatment_type.name if tr.treatment_type else 'Treatment'
             surgeon_name = tr.primary_surgeon.get_full_name() if tr.primary_surgeon else 'Unknown'
-            alert = AppointmentAlert.objects.create(
+            new_alerts.append(AppointmentAlert(
                 patient=tr.patient,
                 visit=None,
                 alert_type='overdue_followup',
@@ -354,25 +456,28 @@ class AlertService:
                     f"Surgeon: {surgeon_name}."
                 ),
                 trigger_time=now,
-                notes=ref_key,
-            )
-            created_alerts.append(alert)
-            existing_refs.add(ref_key)
+                dedup_key=ref_key,
+            ))
+            recipients[ref_key] = tr.primary_surgeon
 
         # ── 3. Missed scheduled TreatmentFollowUp appointments ────────────
-        for fu in TreatmentFollowUp.objects.filter(
-            status='scheduled',
-            scheduled_date__lt=now,
-        ).select_related('treatment__patient', 'treatment__treatment_type'):
-            ref_key = f'ref_id:followup_appt:{fu.id}'
-            if ref_key in existing_refs:
+        follow_ups = {
+            f'followup_appt:{fu.id}': fu
+            for fu in TreatmentFollowUp.objects.filter(
+                status='scheduled',
+                scheduled_date__lt=now,
+            ).select_related('treatment__patient', 'treatment__treatment_type', 'treatment__primary_surgeon')
+        }
+        existing_keys = AlertService._open_dedup_keys(follow_ups.keys())
+        for ref_key, fu in follow_ups.items():
+            if ref_key in existing_keys:
                 continue
             due_date = fu.scheduled_date.date() if hasattr(fu.scheduled_date, 'date') else fu.scheduled_date
             days_overdue = (today - due_date).days
             severity = 'critical' if days_overdue > 60 else 'high' if days_overdue > 14 else 'medium'
             tr = fu.treatment
             type_name = tr.treatment_type.name if tr.treatment_type else 'Treatment'
-            alert = AppointmentAlert.objects.create(
+            new_alerts.append(AppointmentAlert(
                 patient=tr.patient,
                 visit=None,
                 alert_type='overdue_followup',
@@ -384,27 +489,30 @@ class AlertService:
                     f"on {due_date.strftime('%d %b %Y')} ({days_overdue} days ago)."
                 ),
                 trigger_time=now,
-                notes=ref_key,
-            )
-            created_alerts.append(alert)
-            existing_refs.add(ref_key)
+                dedup_key=ref_key,
+            ))
+            recipients[ref_key] = tr.primary_surgeon
 
         # ── 4. Consultation follow-ups (no exact date — flag if >30 days) ─
         overdue_cutoff = now - timedelta(days=30)
-        for c in Consultation.objects.filter(
-            follow_up_required=True,
-            status='completed',
-            actual_end_time__isnull=False,
-            actual_end_time__lt=overdue_cutoff,
-        ).select_related('patient', 'consulting_doctor'):
-            ref_key = f'ref_id:consultation:{c.id}'
-            if ref_key in existing_refs:
+        consultations = {
+            f'consultation:{c.id}': c
+            for c in Consultation.objects.filter(
+                follow_up_required=True,
+                status='completed',
+                actual_end_time__isnull=False,
+                actual_end_time__lt=overdue_cutoff,
+            ).select_related('patient', 'consulting_doctor')
+        }
+        existing_keys = AlertService._open_dedup_keys(consultations.keys())
+        for ref_key, c in consultations.items():
+            if ref_key in existing_keys:
                 continue
             days_since = (now - c.actual_end_time).days
             severity = 'critical' if days_since > 90 else 'high' if days_since > 60 else 'medium'
             type_label = c.consultation_type.replace('_', ' ').title()
             doctor_name = c.consulting_doctor.get_full_name() if c.consulting_doctor else 'Unknown'
-            alert = AppointmentAlert.objects.create(
+            new_alerts.append(AppointmentAlert(
                 patient=c.patient,
                 visit=None,
                 alert_type='overdue_followup',
@@ -417,11 +525,12 @@ class AlertService:
                     f"Consulting doctor: {doctor_name}."
                 ),
                 trigger_time=now,
-                notes=ref_key,
-            )
-            created_alerts.append(alert)
-            existing_refs.add(ref_key)
+                dedup_key=ref_key,
+            ))
+            recipients[ref_key] = c.consulting_doctor
 
+        created_alerts = AlertService._bulk_create_deduplicated(new_alerts)
+        alert_notifications.enqueue([(alert, recipients[alert.dedup_key]) for alert in created_alerts])
         return created_alerts
 
     @staticmethod
@@ -429,11 +538,12 @@ class AlertService:
         """
         Auto-resolve active alerts for a visit when patient checks in
         """
-        updated_count = AppointmentAlert.objects.filter(
-            visit=visit,
-            status='active',
-            alert_type__in=['late', 'missed']
-        ).update(
+        updated_count = AlertService.bulk_transition(
+            AppointmentAlert.objects.filter(
+                visit=visit,
+                status='active',
+                alert_type__in=['late', 'missed']
+            ),
             status='resolved',
             resolved_at=timezone.now(),
             action_taken='Auto-resolved: Patient checked in'
@@ -500,28 +610,7 @@ class AlertService:
     @staticmethod
     def get_alert_statistics():
         """
-        Get statistics about current alerts
+        Get statistics about current alerts from the incrementally
+        maintained statistics buckets
         """
-        from django.db.models import Count, Q
-        
-        stats = AppointmentAlert.objects.aggregate(
-            total_active=Count('id', filter=Q(status='active')),
-            total_acknowledged=Count('id', filter=Q(status='acknowledged')),
-            total_resolved_today=Count('id', filter=Q(
-                status='resolved',
-                resolved_at__date=timezone.now().date()
-            )),
-            
-            # By type
-            missed_active=Count('id', filter=Q(status='active', alert_type='missed')),
-            late_active=Count('id', filter=Q(status='active', alert_type='late')),
-            overdue_followup_active=Count('id', filter=Q(status='active', alert_type='overdue_followup')),
-            
-            # By severity
-            critical_active=Count('id', filter=Q(status='active', severity='critical')),
-            high_active=Count('id', filter=Q(status='active', severity='high')),
-            medium_active=Count('id', filter=Q(status='active', severity='medium')),
-            low_active=Count('id', filter=Q(status='active', severity='low')),
-        )
-        
-        return stats
+        return alert_statistics.get_statistics()
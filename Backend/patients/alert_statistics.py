@@ -0,0 +1,156 @@
+"""
+Alert statistics projection for PreciseOptics.
+
+AlertStatisticsBucket rows hold alert counts per (status, alert_type,
+severity, day), where day is the local date the alert entered its current
+status. Every alert insert, transition or deletion applies +1/-1 deltas in
+the same transaction, so the statistics endpoint sums a handful of bucket
+rows instead of scanning the alert table.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import AppointmentAlert, AlertStatisticsBucket
+
+TERMINAL_STATUSES = ('resolved', 'dismissed')
+
+
+def bucket_day(values):
+    """Local date the alert entered its current status"""
+    moment = values['trigger_time']
+    if values['status'] in TERMINAL_STATUSES and values['resolved_at']:
+        moment = values['resolved_at']
+    elif values['status'] == 'acknowledged' and values['acknowledged_at']:
+        moment = values['acknowledged_at']
+    return timezone.localdate(moment) if timezone.is_aware(moment) else moment.date()
+
+
+def bucket_key(values):
+    """(status, alert_type, severity, day) for a dict of AppointmentAlert.BUCKET_FIELDS"""
+    return (values['status'], values['alert_type'], values['severity'], bucket_day(values))
+
+
+def apply_deltas(deltas):
+    """
+    Add each delta to its bucket, creating missing buckets first.
+    `deltas` maps bucket keys to signed counts.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        AlertStatisticsBucket.objects.bulk_create(
+            [
+                AlertStatisticsBucket(status=status, alert_type=alert_type, severity=severity, day=day)
+                for status, alert_type, severity, day in deltas
+            ],
+            ignore_conflicts=True
+        )
+        for (status, alert_type, severity, day), delta in deltas.items():
+            AlertStatisticsBucket.objects.filter(
+                status=status, alert_type=alert_type, severity=severity, day=day
+            ).update(count=F('count') + delta)
+
+
+def record_transitions(transitions):
+    """
+    Move alerts between buckets. `transitions` is an iterable of
+    (before, after) bucket-field dicts; use None for an insert or a delete.
+    """
+    deltas = Counter()
+    for before, after in transitions:
+        before_key = bucket_key(before) if before else None
+        after_key = bucket_key(after) if after else None
+        if before_key == after_key:
+            continue
+        if before_key:
+            deltas[before_key] -= 1
+        if after_key:
+            deltas[after_key] += 1
+    apply_deltas(deltas)
+
+
+def get_statistics():
+    """Alert statistics summed from the projection (same keys as the old full-table aggregate)"""
+    today = timezone.localdate()
+    active = Q(status='active')
+
+    def total(condition):
+        return Coalesce(Sum('count', filter=condition), 0)
+
+    return AlertStatisticsBucket.objects.aggregate(
+        total_active=total(active),
+        total_acknowledged=total(Q(status='acknowledged')),
+        total_resolved_today=total(Q(status='resolved', day=today)),
+
+        # By type
+        missed_active=total(active & Q(alert_type='missed')),
+        late_active=total(active & Q(alert_type='late')),
+        overdue_followup_active=total(active & Q(alert_type='overdue_followup')),
+
+        # By severity
+        critical_active=total(active & Q(severity='critical')),
+        high_active=total(active & Q(severity='high')),
+        medium_active=total(active & Q(severity='medium')),
+        low_active=total(active & Q(severity='low')),
+    )
+
+
+def compute_buckets():
+    """Recount every bucket from the alert table with a single GROUP BY"""
+    day = Case(
+        When(
+            status__in=TERMINAL_STATUSES, resolved_at__isnull=False,
+            then=TruncDate('resolved_at')
+        ),
+        When(
+            status='acknowledged', acknowledged_at__isnull=False,
+            then=TruncDate('acknowledged_at')
+        ),
+        default=TruncDate('trigger_time'),
+    )
+    rows = (
+        AppointmentAlert.objects.order_by()
+        .annotate(day=day)
+        .values('status', 'alert_type', 'severity', 'day')
+        .annotate(count=Count('id'))
+    )
+    return {
+        (row['status'], row['alert_type'], row['severity'], row['day']): row['count']
+        for row in rows
+    }
+
+
+def reconcile(dry_run=False):
+    """
+    Rebuild the projection from the alert table.
+    Returns a dict of bucket key -> (stored count, actual count) for buckets that differed.
+    """
+    with transaction.atomic():
+        stored = {
+            (b.status, b.alert_type, b.severity, b.day): b.count
+            for b in AlertStatisticsBucket.objects.select_for_update()
+        }
+        actual = compute_buckets()
+        differences = {
+            key: (stored.get(key, 0), actual.get(key, 0))
+            for key in stored.keys() | actual.keys()
+            if stored.get(key, 0) != actual.get(key, 0)
+        }
+        if not dry_run:
+            AlertStatisticsBucket.objects.all().delete()
+            AlertStatisticsBucket.objects.bulk_create(
+                [
+                    AlertStatisticsBucket(
+                        status=status, alert_type=alert_type, severity=severity, day=day, count=count
+                    )
+                    for (status, alert_type, severity, day), count in actual.items()
+                ],
+                batch_size=500
+            )
+    return differences
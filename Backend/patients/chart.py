@@ -0,0 +1,146 @@
+"""
+Aggregated patient chart for PreciseOptics.
+
+Assembles everything the patient records page shows — demographics, recent
+visits, the latest completed result of each eye test type, active
+prescriptions with their items, active conditions, active protocols and
+recent treatments — with a fixed number of queries per section, however
+many records the patient has.
+
+The chart version is computed in a single query from the newest updated_at
+and the row count of every section, so a client holding the current version
+can be answered with 304 Not Modified before any section is loaded.
+"""
+import hashlib
+
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from conditions.models import ConditionProgress, PatientCondition
+from conditions.serializers import PatientConditionListSerializer
+from eye_tests import serializers as eye_test_serializers
+from eye_tests.models import BaseEyeTest
+from medications.models import Medication, Prescription, PrescriptionItem
+from medications.serializers import PrescriptionSerializer
+from protocols.models import PatientProtocol, ProtocolStepCompletion
+from protocols.scheduling import ACTIVE_STATUSES
+from protocols.serializers import PatientProtocolListSerializer, patient_protocol_queryset
+from treatments.models import Treatment
+from treatments.serializers import TreatmentBasicSerializer
+
+from .models import Patient, PatientVisit
+from .serializers import PatientSerializer, PatientVisitSerializer
+
+RECENT_VISITS_LIMIT = 10
+RECENT_TREATMENTS_LIMIT = 10
+
+
+def _eye_test_types():
+    """[(model, serializer)] for every concrete BaseEyeTest subclass"""
+    return [
+        (model, getattr(eye_test_serializers, f'{model.__name__}Serializer'))
+        for model in BaseEyeTest.__subclasses__()
+    ]
+
+
+def _latest_eye_tests():
+    return {
+        model: model.objects.filter(status='completed').order_by('-test_date', '-created_at')
+        for model, _ in _eye_test_types()
+    }
+
+
+def _sources():
+    """{name: (queryset, path to patient)} for the rows each section is built from"""
+    sources = {
+        'patient_visits': (PatientVisit.objects.all(), 'patient'),
+        'prescriptions': (Prescription.objects.filter(status='active'), 'patient'),
+        'prescription_items': (
+            PrescriptionItem.objects.filter(prescription__status='active'), 'prescription__patient'
+        ),
+        # Medication details are rendered in the prescription items
+        'medications': (
+            Medication.objects.filter(prescriptionitem__prescription__status='active'),
+            'prescriptionitem__prescription__patient'
+        ),
+        'conditions': (PatientCondition.objects.filter(is_active=True), 'patient'),
+        # Feeds each condition's progress_count
+        'condition_progress': (
+            ConditionProgress.objects.filter(patient_condition__is_active=True), 'patient_condition__patient'
+        ),
+        'protocols': (PatientProtocol.objects.filter(status__in=ACTIVE_STATUSES), 'patient'),
+        # Feeds each protocol's completion progress
+        'protocol_step_completions': (
+            ProtocolStepCompletion.objects.filter(patient_protocol__status__in=ACTIVE_STATUSES),
+            'patient_protocol__patient'
+        ),
+        'treatments': (Treatment.objects.all(), 'patient'),
+    }
+    for model, queryset in _latest_eye_tests().items():
+        sources[model._meta.model_name] = (queryset, 'patient')
+    return sources
+
+
+def version(patient):
+    """
+    ETag of a patient's chart: a digest of the newest updated_at and row
+    count of every section, read in one query
+    """
+    annotations = {}
+    for name, (queryset, patient_path) in _sources().items():
+        rows = queryset.filter(**{patient_path: OuterRef('pk')}).order_by().values(patient_path)
+        annotations[f'{name}_updated'] = Subquery(rows.annotate(value=Max('updated_at')).values('value'))
+        annotations[f'{name}_count'] = Coalesce(
+            Subquery(rows.annotate(value=Count('pk')).values('value')), 0, output_field=IntegerField()
+        )
+    values = Patient.objects.filter(pk=patient.pk).values('updated_at', **annotations).get()
+    digest = hashlib.md5(repr(sorted(values.items())).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def build_chart(patient):
+    """The patient's chart as a JSON-ready dict"""
+    visits = (
+        patient.visits.select_related('patient', 'primary_doctor')
+        .prefetch_related('attending_staff')
+        .order_by('-scheduled_date')[:RECENT_VISITS_LIMIT]
+    )
+
+    latest = _latest_eye_tests()
+    eye_tests = {}
+    for model, serializer in _eye_test_types():
+        test = latest[model].filter(patient=patient).select_related('patient', 'performed_by').first()
+        eye_tests[model._meta.model_name] = serializer(test).data if test else None
+
+    prescriptions = (
+        Prescription.objects.filter(patient=patient, status='active')
+        .select_related('patient', 'prescribing_doctor')
+        .prefetch_related('items__medication')
+        .order_by('-date_prescribed')
+    )
+    conditions = (
+        PatientCondition.objects.filter(patient=patient, is_active=True)
+        .select_related('patient', 'condition', 'diagnosed_by')
+        .prefetch_related('progress_records')
+        .order_by('-diagnosis_date')
+    )
+    protocols = patient_protocol_queryset(
+        PatientProtocol.objects.filter(patient=patient, status__in=ACTIVE_STATUSES)
+        .select_related('protocol')
+        .order_by('-start_date')
+    )
+    treatments = (
+        Treatment.objects.filter(patient=patient)
+        .select_related('patient', 'treatment_type', 'primary_surgeon')
+        .order_by('-scheduled_date', '-created_at')[:RECENT_TREATMENTS_LIMIT]
+    )
+
+    return {
+        'patient': PatientSerializer(patient).data,
+        'recent_visits': PatientVisitSerializer(visits, many=True).data,
+        'eye_tests': eye_tests,
+        'active_prescriptions': PrescriptionSerializer(prescriptions, many=True).data,
+        'active_conditions': PatientConditionListSerializer(conditions, many=True).data,
+        'active_protocols': PatientProtocolListSerializer(protocols, many=True).data,
+        'recent_treatments': TreatmentBasicSerializer(treatments, many=True).data,
+    }
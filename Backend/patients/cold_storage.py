@@ -0,0 +1,244 @@
+"""
+Cold storage for inactive patients in PreciseOptics.
+
+Patients marked inactive with no activity (patient update or visit) for a
+configurable number of years have their clinical history moved out of the
+live tables: every row recorded against them (visits, consultations, eye
+tests, prescriptions, treatments, conditions, protocols, referrals, alerts)
+and every row those cascade to is serialized into PatientArchiveRecord rows
+and deleted, so lists, reports and their indexes only cover the working set.
+The patient row and the audit trail stay where they are; search tokens are
+dropped so archived patients leave search.
+
+The rows to move are found with Django's deletion collector, so records
+added by new apps are archived without changes here. Foreign keys that would
+be nulled by the move (a hot audit row pointing at an archived prescription)
+are recorded and restored with the rows. Work is done in batches of
+patients, each in its own transaction, so an interrupted run loses at most
+one batch and continues where it stopped when run again.
+
+Restoring saves rows the way loaddata does (raw saves that keep stored
+timestamps and skip raw-aware signal handlers). Archiving reads the
+collector's data, fast_deletes and field_updates, which are not public API
+(field_updates changed shape in Django 4.2); PatientColdStorageTest covers
+each of them so an upgrade that changes them fails there first.
+"""
+import json
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.apps import apps
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, router, transaction
+from django.db.models import Exists, Max, OuterRef, ProtectedError, QuerySet, RestrictedError
+from django.db.models.deletion import Collector
+from django.utils import timezone
+
+from . import alert_statistics, search_index
+from .alert_service import AlertService
+from .merge import patient_references
+from .models import AppointmentAlert, Patient, PatientArchive, PatientArchiveRecord, PatientSearchToken, PatientVisit
+
+DEFAULT_INACTIVE_YEARS = 8
+
+DEFAULT_BATCH_SIZE = 50
+
+# Left in the live tables so the audit trail stays complete
+KEPT_APPS = ('audit',)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class RowEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder without its millisecond rounding, so rows restore exactly"""
+
+    def default(self, o):
+        if isinstance(o, (datetime, time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _serialize(rows):
+    return json.dumps(serializers.serialize('python', rows), cls=RowEncoder)
+
+
+def cutoff(years):
+    return timezone.now() - timedelta(days=round(365.25 * years))
+
+
+def archivable_patients(years=DEFAULT_INACTIVE_YEARS):
+    """Inactive, unarchived patients with no update or visit since the cutoff"""
+    since = cutoff(years)
+    recent_visits = PatientVisit.objects.filter(patient=OuterRef('pk'), scheduled_date__gte=since)
+    # Subqueries rather than an outer join, which PostgreSQL refuses to lock
+    archived = PatientArchive.objects.filter(patient=OuterRef('pk'))
+    return Patient.objects.filter(is_active=False, updated_at__lt=since).exclude(
+        Exists(recent_visits)
+    ).exclude(Exists(archived))
+
+
+def _roots(patient):
+    """
+    Querysets of the rows recorded directly against a patient (search
+    tokens are not among them and are dropped instead)
+    """
+    for model, field in patient_references():
+        if model._meta.app_label in KEPT_APPS:
+            continue
+        yield model._base_manager.filter(**{field.attname: patient.pk})
+
+
+def _collect(patient):
+    collector = Collector(using=router.db_for_write(Patient), origin=patient)
+    for rows in _roots(patient):
+        collector.collect(rows)
+    collector.sort()
+    return collector
+
+
+def _records(collector):
+    """(model label, kind, field, data) in restore order"""
+    # The collector orders models for deletion: dependants first
+    for model, instances in reversed(collector.data.items()):
+        yield model._meta.label, 'rows', '', _serialize(instances)
+    for rows in collector.fast_deletes:
+        if rows.exists():
+            yield rows.model._meta.label, 'rows', '', _serialize(rows)
+
+    moved = {(model, obj.pk) for model, instances in collector.data.items() for obj in instances}
+    links = defaultdict(list)
+    for (field, _), batches in collector.field_updates.items():
+        for batch in batches:
+            if isinstance(batch, QuerySet):
+                pairs = batch.values_list('pk', field.attname)
+            else:
+                pairs = [(obj.pk, getattr(obj, field.attname)) for obj in batch]
+            links[field].extend(
+                [str(pk), str(target)] for pk, target in pairs if (field.model, pk) not in moved
+            )
+    for field, pairs in links.items():
+        if pairs:
+            yield field.model._meta.label, 'links', field.attname, json.dumps(pairs)
+
+
+def archive_patient(patient):
+    """
+    Move one patient's history into a PatientArchive. Raises ArchiveError if
+    a row that is not archived protects part of it.
+    """
+    try:
+        collector = _collect(patient)
+    except (ProtectedError, RestrictedError) as exc:
+        raise ArchiveError(str(exc))
+    records = list(_records(collector))
+    last_visit = patient.visits.aggregate(last=Max('scheduled_date'))['last']
+
+    archive = PatientArchive.objects.create(
+        patient=patient,
+        last_activity=max(patient.updated_at, last_visit) if last_visit else patient.updated_at,
+    )
+    PatientArchiveRecord.objects.bulk_create([
+        PatientArchiveRecord(archive=archive, position=position, model=label, kind=kind, field=field, data=data)
+        for position, (label, kind, field, data) in enumerate(records)
+    ])
+    _, deleted = collector.delete()
+    PatientSearchToken.objects.filter(patient=patient).delete()
+
+    archive.record_count = sum(deleted.values())
+    archive.save(update_fields=['record_count'])
+    return archive
+
+
+def archive_batch(years=DEFAULT_INACTIVE_YEARS, batch_size=DEFAULT_BATCH_SIZE, exclude=()):
+    """
+    Archive one batch of patients in a single transaction, leaving out the
+    patients in `exclude`. Returns ([archives], [(patient, reason)] skipped).
+    """
+    archives, skipped = [], []
+    with transaction.atomic():
+        patients = list(
+            archivable_patients(years).exclude(pk__in=exclude)
+            .select_for_update().order_by('updated_at', 'id')[:batch_size]
+        )
+        for patient in patients:
+            try:
+                with transaction.atomic():
+                    archives.append(archive_patient(patient))
+            except ArchiveError as exc:
+                skipped.append((patient, str(exc)))
+    return archives, skipped
+
+
+def archive_patients(years=DEFAULT_INACTIVE_YEARS, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    Archive batches until nothing is left (or max_batches is reached).
+    Returns (patients archived, rows moved, [(patient, reason)] skipped).
+    """
+    archived, moved, skipped = 0, 0, []
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        # Patients skipped earlier in the run are not retried
+        archives, batch_skipped = archive_batch(years, batch_size, [patient.pk for patient, _ in skipped])
+        archived += len(archives)
+        moved += sum(archive.record_count for archive in archives)
+        skipped.extend(batch_skipped)
+        batches += 1
+        if len(archives) + len(batch_skipped) < batch_size:
+            break
+    return archived, moved, skipped
+
+
+def restore_patient(archive, user=None, ip_address='127.0.0.1'):
+    """
+    Put an archived patient's history back into the live tables and delete
+    the archive. Returns rows restored per table; raises ArchiveError if a
+    row can no longer be inserted (a user it references was deleted).
+    """
+    from audit.models import AuditLog  # local import to avoid circular deps
+
+    patient = archive.patient
+    restored = {}
+    try:
+        with transaction.atomic():
+            for record in archive.records.order_by('position'):
+                model = apps.get_model(record.model)
+                if record.kind == 'links':
+                    by_target = defaultdict(list)
+                    for pk, target in json.loads(record.data):
+                        by_target[target].append(pk)
+                    for target, pks in by_target.items():
+                        model._base_manager.filter(pk__in=pks).update(**{record.field: target})
+                    continue
+
+                objects = []
+                for row in serializers.deserialize('python', json.loads(record.data)):
+                    # Many-to-many rows are archived as rows of their own
+                    row.save(save_m2m=False, force_insert=True)
+                    objects.append(row.object)
+                restored[record.model] = restored.get(record.model, 0) + len(objects)
+                if model is AppointmentAlert:
+                    # Raw saves skip the signals that keep these in step
+                    AlertService.record_changes([(alert.id, alert.status) for alert in objects], 'created')
+                    alert_statistics.record_transitions((None, alert.bucket_values()) for alert in objects)
+
+            search_index.index_patients([patient])
+            archive.delete()
+            AuditLog.objects.create(
+                user=user,
+                action='update',
+                resource_name='Patient',
+                resource_id=str(patient.pk),
+                changes={'restored': restored},
+                ip_address=ip_address,
+                description=f'Restored archived history of patient {patient.patient_id}',
+                severity='medium',
+                tags='patient-archive',
+                gdpr_relevant=True,
+                hipaa_relevant=True,
+            )
+    except IntegrityError as exc:
+        raise ArchiveError(f'Cannot restore {patient.patient_id}: {exc}')
+    return restored
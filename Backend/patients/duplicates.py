@@ -0,0 +1,196 @@
+"""
+Duplicate patient detection for PreciseOptics.
+
+Patients are only compared with the patients they share a block with, where
+the blocks are search index tokens (see patients.search_index): the NHS
+number, each normalized phone number and the date of birth + Soundex surname
+key. Checking a registration therefore reads one indexed token lookup and
+the few patients it returns, never the whole table.
+
+A pair is scored from the details that agree (and an NHS number that
+disagrees); pairs at or above the minimum score are possible duplicates. The
+batch check scores every pair within every block and joins overlapping
+pairs into clusters.
+"""
+from collections import defaultdict
+from itertools import combinations, groupby
+
+from django.db.models import Count, Q
+
+from .models import Patient, PatientSearchToken
+from .search_index import digits, normalize, patient_tokens, phone_tokens, soundex, words
+
+BLOCK_KINDS = ('nhs', 'phone', 'dob_name')
+
+# Keys that single out a person rather than a household
+STRONG_KINDS = ('nhs', 'dob_name')
+
+NHS_MATCH_SCORE = 50
+NHS_CONFLICT_SCORE = -50
+DATE_OF_BIRTH_SCORE = 20
+NAME_MATCH_SCORE = 15
+NAME_SOUNDS_LIKE_SCORE = 8
+PHONE_SCORE = 10
+POSTAL_CODE_SCORE = 5
+
+DEFAULT_MIN_SCORE = 40
+
+# Candidates scored for one registration
+MAX_CANDIDATES = 100
+
+# Larger blocks (a care home's phone number) say little about identity and
+# would make the batch check quadratic, so they are not paired
+MAX_BLOCK_SIZE = 50
+
+PROFILE_FIELDS = (
+    'pk', 'first_name', 'last_name', 'date_of_birth', 'phone_number',
+    'alternate_phone', 'nhs_number', 'postal_code',
+)
+
+BATCH_SIZE = 1000
+
+
+def _profile(patient):
+    return {
+        'first_name': ''.join(words(patient.first_name)),
+        'last_name': ''.join(words(patient.last_name)),
+        'date_of_birth': patient.date_of_birth,
+        'phones': phone_tokens(patient.phone_number) | phone_tokens(patient.alternate_phone),
+        'nhs': digits(patient.nhs_number),
+        'postal_code': normalize(patient.postal_code).replace(' ', ''),
+    }
+
+
+def _name_score(first, second, field, reasons):
+    if not first or not second:
+        return 0
+    if first == second:
+        reasons.append(field)
+        return NAME_MATCH_SCORE
+    if soundex(first) == soundex(second):
+        reasons.append(f'{field}_sounds_like')
+        return NAME_SOUNDS_LIKE_SCORE
+    return 0
+
+
+def score(first, second):
+    """(score, reasons) for a pair of patients"""
+    first, second = _profile(first), _profile(second)
+    reasons = []
+    total = 0
+    if first['nhs'] and second['nhs']:
+        if first['nhs'] == second['nhs']:
+            total += NHS_MATCH_SCORE
+            reasons.append('nhs_number')
+        else:
+            total += NHS_CONFLICT_SCORE
+            reasons.append('nhs_number_differs')
+    if first['date_of_birth'] and first['date_of_birth'] == second['date_of_birth']:
+        total += DATE_OF_BIRTH_SCORE
+        reasons.append('date_of_birth')
+    total += _name_score(first['last_name'], second['last_name'], 'last_name', reasons)
+    total += _name_score(first['first_name'], second['first_name'], 'first_name', reasons)
+    if first['phones'] & second['phones']:
+        total += PHONE_SCORE
+        reasons.append('phone_number')
+    if first['postal_code'] and first['postal_code'] == second['postal_code']:
+        total += POSTAL_CODE_SCORE
+        reasons.append('postal_code')
+    return total, reasons
+
+
+def possible_duplicates(patient, min_score=DEFAULT_MIN_SCORE):
+    """
+    [(patient, score, reasons)] best first for existing patients that may be
+    the same person as `patient`, which may be unsaved (a registration form)
+    """
+    keys = [(kind, token) for kind, token in patient_tokens(patient) if kind in BLOCK_KINDS]
+    if not keys:
+        return []
+    in_block = Q(pk__in=[])
+    for kind, token in keys:
+        in_block |= Q(kind=kind, token=token)
+    # Patients matching the NHS number or date of birth + surname, then those
+    # sharing the most keys, come first, so a large shared-phone block cannot
+    # crowd them out of the candidates
+    candidate_ids = (
+        PatientSearchToken.objects.filter(in_block)
+        .exclude(patient_id=patient.pk)
+        .order_by().values('patient_id')
+        .annotate(strong=Count('id', filter=Q(kind__in=STRONG_KINDS)), hits=Count('id'))
+        .order_by('-strong', '-hits', 'patient_id')
+        .values_list('patient_id', flat=True)[:MAX_CANDIDATES]
+    )
+
+    matches = []
+    for candidate in Patient.objects.filter(pk__in=list(candidate_ids)):
+        total, reasons = score(patient, candidate)
+        if total >= min_score:
+            matches.append((candidate, total, reasons))
+    matches.sort(key=lambda match: (-match[1], match[0].patient_id))
+    return matches
+
+
+def candidate_pairs():
+    """Set of (pk, pk) pairs of patients sharing at least one block"""
+    pairs = set()
+    for kind in BLOCK_KINDS:
+        shared = (
+            PatientSearchToken.objects.filter(kind=kind).order_by()
+            .values('token').annotate(size=Count('id'))
+            .filter(size__gt=1, size__lte=MAX_BLOCK_SIZE).values('token')
+        )
+        members = (
+            PatientSearchToken.objects.filter(kind=kind, token__in=shared)
+            .order_by('token').values_list('token', 'patient_id')
+        )
+        for _, block in groupby(members.iterator(chunk_size=BATCH_SIZE), key=lambda row: row[0]):
+            patient_ids = sorted(patient_id for _, patient_id in block)
+            pairs.update(combinations(patient_ids, 2))
+    return pairs
+
+
+def find_clusters(min_score=DEFAULT_MIN_SCORE):
+    """
+    Groups of patients linked by pairs scoring at least `min_score`, largest
+    first: [{'patients': [Patient], 'pairs': [(pk, pk, score, reasons)]}]
+    """
+    pairs = candidate_pairs()
+    patient_ids = sorted({patient_id for pair in pairs for patient_id in pair})
+    patients = {}
+    for start in range(0, len(patient_ids), BATCH_SIZE):
+        patients.update(
+            Patient.objects.only(*PROFILE_FIELDS, 'patient_id')
+            .in_bulk(patient_ids[start:start + BATCH_SIZE])
+        )
+
+    parent = {}
+
+    def root(patient_id):
+        while parent.get(patient_id, patient_id) != patient_id:
+            patient_id = parent[patient_id]
+        return patient_id
+
+    matched = []
+    for first, second in sorted(pairs):
+        total, reasons = score(patients[first], patients[second])
+        if total >= min_score:
+            matched.append((first, second, total, reasons))
+            parent[root(second)] = root(first)
+
+    clusters = defaultdict(lambda: {'patients': set(), 'pairs': []})
+    for first, second, total, reasons in matched:
+        cluster = clusters[root(first)]
+        cluster['patients'].update((first, second))
+        cluster['pairs'].append((first, second, total, reasons))
+
+    result = [
+        {
+            'patients': sorted((patients[patient_id] for patient_id in cluster['patients']),
+                               key=lambda patient: patient.patient_id),
+            'pairs': cluster['pairs'],
+        }
+        for cluster in clusters.values()
+    ]
+    result.sort(key=lambda cluster: (-len(cluster['patients']), cluster['patients'][0].patient_id))
+    return result
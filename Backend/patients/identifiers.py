@@ -0,0 +1,96 @@
+"""
+Collision-free identifier allocation for PreciseOptics.
+
+Patient IDs (PAT000123) and prescription numbers (RX00000123) are issued
+from an IdentifierSequence counter row per prefix using hi/lo allocation:
+each process reserves a block of values with one locked UPDATE and then
+hands them out from memory, so issuing an identifier is normally an
+in-memory step and two processes never receive the same value. Values in a
+reserved block that are already used by older, randomly generated
+identifiers are skipped with one lookup per block.
+
+A block reserved inside a caller's transaction would be returned to the
+counter if that transaction rolled back, so in that case only the values
+actually requested are reserved and nothing is kept for later. Bulk imports
+should take() their identifiers before opening their transactions.
+"""
+import os
+import threading
+
+from django.apps import apps
+from django.db import connection, transaction
+
+from .models import IdentifierSequence
+
+DEFAULT_BLOCK_SIZE = 100
+
+# Values checked against existing identifiers per query
+LOOKUP_CHUNK_SIZE = 500
+
+
+class IdentifierAllocator:
+    """Issues '<prefix><zero-padded number>' identifiers for `model.field`"""
+
+    def __init__(self, prefix, width, model, field, block_size=DEFAULT_BLOCK_SIZE):
+        self.prefix = prefix
+        self.width = width
+        self.model = model
+        self.field = field
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._available = []
+        # A forked worker must not hand out its parent's block
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """Forget the reserved block; its unused values are skipped"""
+        self._lock = threading.Lock()
+        self._available = []
+
+    def format(self, value):
+        return f'{self.prefix}{value:0{self.width}d}'
+
+    def _taken(self, identifiers):
+        model = apps.get_model(self.model)
+        taken = set()
+        for start in range(0, len(identifiers), LOOKUP_CHUNK_SIZE):
+            chunk = identifiers[start:start + LOOKUP_CHUNK_SIZE]
+            taken.update(
+                model.objects.filter(**{f'{self.field}__in': chunk}).values_list(self.field, flat=True)
+            )
+        return taken
+
+    def _reserve(self, size):
+        """Advance the counter by `size` and return the free identifiers in the reserved range"""
+        with transaction.atomic():
+            sequence, _ = IdentifierSequence.objects.select_for_update().get_or_create(prefix=self.prefix)
+            start = sequence.next_value
+            sequence.next_value = start + size
+            sequence.save(update_fields=['next_value', 'updated_at'])
+        identifiers = [self.format(value) for value in range(start, start + size)]
+        taken = self._taken(identifiers)
+        return [identifier for identifier in identifiers if identifier not in taken]
+
+    def take(self, count):
+        """`count` new identifiers in ascending order"""
+        issued = []
+        with self._lock:
+            while len(issued) < count:
+                if not self._available:
+                    needed = count - len(issued)
+                    if connection.in_atomic_block:
+                        # Could be rolled back with the caller's transaction: keep nothing
+                        issued.extend(self._reserve(needed))
+                        continue
+                    self._available = self._reserve(max(needed, self.block_size))
+                used = self._available[:count - len(issued)]
+                del self._available[:len(used)]
+                issued.extend(used)
+        return issued
+
+    def next(self):
+        return self.take(1)[0]
+
+
+PATIENT_IDS = IdentifierAllocator('PAT', 6, 'patients.Patient', 'patient_id')
+PRESCRIPTION_NUMBERS = IdentifierAllocator('RX', 8, 'medications.Prescription', 'prescription_number')
@@ -0,0 +1,206 @@
+"""
+Streaming bulk patient import for PreciseOptics.
+
+Reads CSV (with a header row) or newline-delimited JSON one row at a time
+and processes it in chunks: each row is validated with the registration
+rules (PatientImportRowSerializer), NHS number uniqueness is checked with
+one query per chunk, patient IDs are reserved up front, and the valid rows
+are inserted with bulk_create together with their search tokens, the
+rejected rows and the import's progress in a single transaction. Rows are
+never held in memory beyond the current chunk.
+
+Because progress is committed with each chunk, an interrupted import is
+resumed by running it again: the rows already committed are skipped. A run
+claims its import with a conditional UPDATE, so two runs of the same import
+never stream it side by side; an import left 'running' by a killed worker
+can be claimed again once it has made no progress for STALE_AFTER.
+"""
+import csv
+import json
+import os
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import search_index
+from .identifiers import PATIENT_IDS
+from .models import Patient, PatientImport, PatientImportError
+from .serializers import PatientImportRowSerializer
+
+DEFAULT_CHUNK_SIZE = 500
+MAX_CHUNK_SIZE = 5000
+
+# Largest file the upload endpoint imports within the request; bigger files
+# go through the import_patients command so they cannot hit a worker timeout
+MAX_REQUEST_ROWS = 5000
+
+# A run commits (and bumps updated_at) with every chunk; a 'running' import
+# quiet for this long is taken to have lost its worker
+STALE_AFTER = timedelta(minutes=15)
+
+FORMAT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+
+class ImportInProgress(Exception):
+    pass
+
+
+def detect_format(name):
+    """Input format from a file name; ValueError for unknown extensions"""
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in FORMAT_EXTENSIONS:
+        raise ValueError(f'Cannot tell the format of {name}; use .csv, .ndjson or .jsonl')
+    return FORMAT_EXTENSIONS[extension]
+
+
+def read_rows(stream, source_format):
+    """
+    Yield (row number, fields, parse errors) for each data row of a text
+    stream. Empty values are left out so model defaults apply.
+    """
+    if source_format == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            fields = {
+                key.strip(): value.strip() for key, value in row.items()
+                if key and isinstance(value, str) and value.strip()
+            }
+            yield number, fields, None
+        return
+
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield number, None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'non_field_errors': ['Expected a JSON object.']}
+            continue
+        yield number, {key: value for key, value in row.items() if value not in ('', None)}, None
+
+
+def _validate(chunk):
+    """Split a chunk into ([(row number, validated data)], [(row number, errors)])"""
+    valid, rejected = [], []
+    for number, fields, errors in chunk:
+        if errors:
+            rejected.append((number, errors))
+            continue
+        serializer = PatientImportRowSerializer(data=fields)
+        if serializer.is_valid():
+            valid.append((number, serializer.validated_data))
+        else:
+            rejected.append((number, serializer.errors))
+
+    # NHS numbers must be unique across the table and within the import
+    nhs_numbers = [data['nhs_number'] for _, data in valid if data.get('nhs_number')]
+    taken = set(
+        Patient.objects.filter(nhs_number__in=nhs_numbers).values_list('nhs_number', flat=True)
+    ) if nhs_numbers else set()
+    unique = []
+    for number, data in valid:
+        nhs_number = data.get('nhs_number')
+        if nhs_number and nhs_number in taken:
+            rejected.append((number, {'nhs_number': ['patient with this nhs number already exists.']}))
+            continue
+        if nhs_number:
+            taken.add(nhs_number)
+        unique.append((number, data))
+    return unique, rejected
+
+
+def _commit_chunk(patient_import, row_count, valid, rejected, patient_ids):
+    patients = [
+        Patient(patient_id=patient_id, registered_by_id=patient_import.started_by_id, **data)
+        for patient_id, (_, data) in zip(patient_ids, valid)
+    ]
+    with transaction.atomic():
+        Patient.objects.bulk_create(patients)
+        search_index.index_patients(patients)
+        PatientImportError.objects.bulk_create([
+            PatientImportError(patient_import=patient_import, row_number=number, errors=errors)
+            for number, errors in rejected
+        ])
+        patient_import.rows_committed += row_count
+        patient_import.created_count += len(patients)
+        patient_import.error_count += len(rejected)
+        patient_import.save(update_fields=['rows_committed', 'created_count', 'error_count', 'updated_at'])
+
+
+def _finish(patient_import, status, reason=''):
+    patient_import.status = status
+    patient_import.failure_reason = reason
+    if status == 'completed':
+        patient_import.completed_at = timezone.now()
+    patient_import.save(update_fields=['status', 'failure_reason', 'completed_at', 'updated_at'])
+
+
+def count_rows(stream, source_format):
+    return sum(1 for _ in read_rows(stream, source_format))
+
+
+def claim(patient_import):
+    """
+    Mark an import running and reload its progress; raises ImportInProgress
+    if another run holds it
+    """
+    now = timezone.now()
+    claimed = PatientImport.objects.filter(pk=patient_import.pk).filter(
+        ~Q(status='running') | Q(updated_at__lt=now - STALE_AFTER)
+    ).update(status='running', updated_at=now)
+    if not claimed:
+        raise ImportInProgress(f'Import {patient_import.pk} is already running')
+    patient_import.refresh_from_db()
+
+
+def run(patient_import, stream):
+    """
+    Import the rows of a text stream, skipping those already committed.
+    Raises ImportInProgress if the import is already running.
+    """
+    claim(patient_import)
+    rows = islice(read_rows(stream, patient_import.source_format), patient_import.rows_committed, None)
+    try:
+        while True:
+            chunk = list(islice(rows, patient_import.chunk_size))
+            if not chunk:
+                break
+            valid, rejected = _validate(chunk)
+            # Reserved before the transaction so the allocator can keep its block
+            patient_ids = PATIENT_IDS.take(len(valid))
+            _commit_chunk(patient_import, len(chunk), valid, rejected, patient_ids)
+    except KeyboardInterrupt:
+        _finish(patient_import, 'interrupted')
+        raise
+    except Exception as exc:
+        _finish(patient_import, 'failed', str(exc))
+        raise
+    _finish(patient_import, 'completed')
+    return patient_import
+
+
+def run_file(patient_import):
+    """Import (or resume importing) the file a PatientImport points at"""
+    with open(patient_import.source, encoding='utf-8-sig', newline='') as stream:
+        return run(patient_import, stream)
+
+
+def write_error_report(patient_import, stream):
+    """Write one CSV line per rejected row and field: row, field, message"""
+    writer = csv.writer(stream)
+    writer.writerow(['row', 'field', 'message'])
+    for error in patient_import.errors.iterator():
+        for field, messages in error.errors.items():
+            for message in messages if isinstance(messages, list) else [messages]:
+                writer.writerow([error.row_number, field, message])
@@ -0,0 +1,74 @@
+"""
+Management command to move old resolved/dismissed alerts into the archive table.
+Run this on a schedule (e.g. nightly via cron) in production. Safe to interrupt
+and re-run: each batch commits on its own.
+
+Usage:
+  python manage.py archive_alerts                       # Use archive_after_days from the active config
+  python manage.py archive_alerts --older-than-days 30
+  python manage.py archive_alerts --batch-size 500 --max-batches 20
+  python manage.py archive_alerts --dry-run
+"""
+from django.core.management.base import BaseCommand
+from patients import alert_archive
+from patients.alert_service import AlertService
+
+
+class Command(BaseCommand):
+    help = 'Archive resolved and dismissed appointment alerts and prune the alert change log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            help='Archive alerts resolved more than this many days ago (default: active configuration)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=alert_archive.DEFAULT_BATCH_SIZE,
+            help=f'Alerts moved per transaction (default: {alert_archive.DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Stop after this many batches (default: run until done)'
+        )
+        parser.add_argument(
+            '--change-log-days',
+            type=int,
+            default=30,
+            help='Delete alert change log entries older than this many days (0 = keep all, default: 30)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many alerts would be archived'
+        )
+
+    def handle(self, *args, **options):
+        older_than_days = options['older_than_days']
+        if older_than_days is None:
+            older_than_days = AlertService.get_config().archive_after_days
+        if older_than_days <= 0:
+            self.stdout.write(self.style.WARNING('Alert archiving is disabled (archive_after_days = 0).'))
+            return
+
+        if options['dry_run']:
+            count = alert_archive.archivable_alerts(older_than_days).count()
+            self.stdout.write(f'🗄️  {count} alert(s) older than {older_than_days} days would be archived.')
+            return
+
+        self.stdout.write(f'🗄️  Archiving alerts resolved more than {older_than_days} days ago...')
+        moved = alert_archive.archive_alerts(
+            older_than_days,
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'  Archived {moved} alert(s)'))
+
+        if options['change_log_days'] > 0:
+            pruned = alert_archive.prune_change_log(options['change_log_days'], options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'  Pruned {pruned} change log entries'))
+
+        self.stdout.write(self.style.SUCCESS('✅ Alert archiving complete.'))
@@ -0,0 +1,80 @@
+"""
+Management command to move the clinical history of long-inactive patients
+into cold storage (PatientArchive), or to restore an archived patient.
+Run this on a schedule (e.g. monthly via cron) in production. Safe to
+interrupt and re-run: each batch of patients commits on its own.
+
+Usage:
+  python manage.py archive_patients                     # inactive for 8 years
+  python manage.py archive_patients --years 10
+  python manage.py archive_patients --batch-size 20 --max-batches 50
+  python manage.py archive_patients --dry-run
+  python manage.py archive_patients --restore PAT000123
+"""
+from django.core.management.base import BaseCommand, CommandError
+from patients import cold_storage
+from patients.models import PatientArchive
+
+
+class Command(BaseCommand):
+    help = 'Move the history of long-inactive patients into cold storage, or restore one'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years',
+            type=int,
+            default=cold_storage.DEFAULT_INACTIVE_YEARS,
+            help=f'Archive inactive patients with no activity for this many years '
+                 f'(default: {cold_storage.DEFAULT_INACTIVE_YEARS})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=cold_storage.DEFAULT_BATCH_SIZE,
+            help=f'Patients archived per transaction (default: {cold_storage.DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Stop after this many batches (default: run until done)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many patients would be archived'
+        )
+        parser.add_argument('--restore', metavar='PATIENT_ID', help='Restore this archived patient instead')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            try:
+                archive = PatientArchive.objects.select_related('patient').get(
+                    patient__patient_id=options['restore']
+                )
+            except PatientArchive.DoesNotExist:
+                raise CommandError(f"{options['restore']} is not archived")
+            try:
+                restored = cold_storage.restore_patient(archive)
+            except cold_storage.ArchiveError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Restored {sum(restored.values())} row(s) for {options['restore']}."
+            ))
+            return
+
+        if options['years'] < 1:
+            raise CommandError('--years must be at least 1')
+        if options['dry_run']:
+            count = cold_storage.archivable_patients(options['years']).count()
+            self.stdout.write(f"🗄️  {count} patient(s) inactive for {options['years']} years would be archived.")
+            return
+
+        self.stdout.write(f"🗄️  Archiving patients inactive for {options['years']} years...")
+        archived, moved, skipped = cold_storage.archive_patients(
+            options['years'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        for patient, reason in skipped:
+            self.stdout.write(self.style.WARNING(f'⚠️ {patient.patient_id} skipped: {reason}'))
+        self.stdout.write(self.style.SUCCESS(f'✅ Archived {archived} patient(s), {moved} row(s) moved.'))
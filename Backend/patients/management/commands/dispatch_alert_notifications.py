@@ -0,0 +1,53 @@
+"""
+Management command to send queued alert e-mail notifications.
+Alert generation only queues notifications; run this frequently (e.g. every
+minute via cron) to deliver them as one digest e-mail per recipient.
+
+Usage:
+  python manage.py dispatch_alert_notifications
+  python manage.py dispatch_alert_notifications --batch-size 200 --rate-per-minute 30
+"""
+from django.core.management.base import BaseCommand
+from patients import alert_notifications
+
+
+class Command(BaseCommand):
+    help = 'Send queued alert notifications as per-recipient digest e-mails'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=alert_notifications.DEFAULT_BATCH_SIZE,
+            help='Maximum notifications to claim in this run'
+        )
+        parser.add_argument(
+            '--rate-per-minute',
+            type=int,
+            default=alert_notifications.DEFAULT_RATE_PER_MINUTE,
+            help='Maximum digest e-mails sent per minute (0 = unlimited)'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=alert_notifications.DEFAULT_MAX_ATTEMPTS,
+            help='Give up on a notification after this many failed attempts'
+        )
+
+    def handle(self, *args, **options):
+        stats = alert_notifications.dispatch(
+            batch_size=options['batch_size'],
+            rate_per_minute=options['rate_per_minute'],
+            max_attempts=options['max_attempts'],
+        )
+
+        self.stdout.write(
+            f"  Sent {stats['sent']} notification(s) in {stats['digests']} digest(s), "
+            f"{stats['cancelled']} cancelled"
+        )
+        if stats['retried'] or stats['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  {stats['retried']} will be retried, {stats['failed']} failed permanently."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Alert notifications dispatched.'))
@@ -0,0 +1,60 @@
+"""
+Management command to find clusters of possibly duplicate patients.
+Pairs are only compared within the same blocking keys as the registration
+check (NHS number, phone number, date of birth + surname sound), so the whole
+table can be checked in one pass.
+
+Usage:
+  python manage.py find_duplicate_patients
+  python manage.py find_duplicate_patients --min-score 60
+  python manage.py find_duplicate_patients --output duplicates.csv
+"""
+import csv
+
+from django.core.management.base import BaseCommand
+from patients import duplicates
+
+
+class Command(BaseCommand):
+    help = 'Find clusters of possibly duplicate patient records'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-score',
+            type=int,
+            default=duplicates.DEFAULT_MIN_SCORE,
+            help=f'Minimum pair score to link two patients (default: {duplicates.DEFAULT_MIN_SCORE})'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the clusters to this CSV file (cluster, patient_id, name, date_of_birth)'
+        )
+
+    def handle(self, *args, **options):
+        clusters = duplicates.find_clusters(min_score=options['min_score'])
+        if not clusters:
+            self.stdout.write(self.style.SUCCESS('✅ No possible duplicate patients found.'))
+            return
+
+        for number, cluster in enumerate(clusters, start=1):
+            self.stdout.write(f'Cluster {number}:')
+            for patient in cluster['patients']:
+                self.stdout.write(
+                    f'  {patient.patient_id}  {patient.first_name} {patient.last_name}  {patient.date_of_birth}'
+                )
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as stream:
+                writer = csv.writer(stream)
+                writer.writerow(['cluster', 'patient_id', 'name', 'date_of_birth'])
+                for number, cluster in enumerate(clusters, start=1):
+                    for patient in cluster['patients']:
+                        writer.writerow([
+                            number, patient.patient_id,
+                            f'{patient.first_name} {patient.last_name}', patient.date_of_birth
+                        ])
+
+        patient_count = sum(len(cluster['patients']) for cluster in clusters)
+        self.stdout.write(self.style.WARNING(
+            f'⚠️ {len(clusters)} cluster(s) covering {patient_count} patient(s) may be duplicates.'
+        ))
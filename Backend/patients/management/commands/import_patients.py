@@ -0,0 +1,85 @@
+"""
+Management command to bulk import patients from a CSV or NDJSON file.
+Rows are validated with the registration rules and inserted in chunks;
+rejected rows are written to an error report. An interrupted import is
+resumed from its last committed chunk with --resume.
+
+Usage:
+  python manage.py import_patients clinic_patients.csv
+  python manage.py import_patients clinic_patients.ndjson --chunk-size 1000
+  python manage.py import_patients --resume <import id>
+  python manage.py import_patients clinic_patients.csv --errors rejected.csv
+"""
+from django.core.management.base import BaseCommand, CommandError
+from patients import importer
+from patients.models import PatientImport
+
+
+class Command(BaseCommand):
+    help = 'Bulk import patients from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='CSV (with header row) or NDJSON file')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ndjson'],
+            help='Input format (default: from the file extension)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=importer.DEFAULT_CHUNK_SIZE,
+            help=f'Rows per transaction (default: {importer.DEFAULT_CHUNK_SIZE})'
+        )
+        parser.add_argument('--resume', metavar='IMPORT_ID', help='Continue an interrupted or failed import')
+        parser.add_argument('--errors', help='Error report path (default: <source>.errors.csv)')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                patient_import = PatientImport.objects.get(pk=options['resume'])
+            except (PatientImport.DoesNotExist, ValueError):
+                raise CommandError(f"No import with id {options['resume']}")
+            if patient_import.status == 'completed':
+                self.stdout.write(self.style.WARNING('⚠️ That import has already completed.'))
+                return
+            self.stdout.write(f'Resuming after row {patient_import.rows_committed} of {patient_import.source}')
+        else:
+            if not options['source']:
+                raise CommandError('Give a source file or --resume <import id>')
+            if not 1 <= options['chunk_size'] <= importer.MAX_CHUNK_SIZE:
+                raise CommandError(f'--chunk-size must be between 1 and {importer.MAX_CHUNK_SIZE}')
+            try:
+                source_format = options['format'] or importer.detect_format(options['source'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            patient_import = PatientImport.objects.create(
+                source=options['source'],
+                source_format=source_format,
+                chunk_size=options['chunk_size'],
+            )
+
+        try:
+            importer.run_file(patient_import)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ Interrupted after row {patient_import.rows_committed}. '
+                f'Resume with: python manage.py import_patients --resume {patient_import.pk}'
+            ))
+            return
+        except OSError as exc:
+            raise CommandError(f'Cannot read {patient_import.source}: {exc}')
+        except importer.ImportInProgress as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Imported {patient_import.created_count} patient(s) from '
+            f'{patient_import.rows_committed} row(s) (import {patient_import.pk}).'
+        ))
+        if patient_import.error_count:
+            report = options['errors'] or f'{patient_import.source}.errors.csv'
+            with open(report, 'w', newline='') as stream:
+                importer.write_error_report(patient_import, stream)
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ {patient_import.error_count} row(s) rejected; see {report}'
+            ))
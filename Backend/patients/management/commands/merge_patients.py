@@ -0,0 +1,53 @@
+"""
+Management command to merge a duplicate patient record into another.
+Everything recorded against the duplicate is moved to the surviving patient
+and the duplicate is deactivated. Use --dry-run first to see the row counts.
+
+Usage:
+  python manage.py merge_patients PAT000123 PAT004567 --dry-run
+  python manage.py merge_patients PAT000123 PAT004567    # keep PAT000123
+"""
+from django.core.management.base import BaseCommand, CommandError
+from patients.merge import merge_patients
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Merge a duplicate patient record into the surviving record'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survivor', help='Patient ID of the record to keep')
+        parser.add_argument('duplicate', help='Patient ID of the record to merge away')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many rows would be moved'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            survivor = Patient.objects.get(patient_id=options['survivor'])
+            duplicate = Patient.objects.get(patient_id=options['duplicate'])
+        except Patient.DoesNotExist as exc:
+            raise CommandError(str(exc))
+        if survivor.pk == duplicate.pk:
+            raise CommandError('A patient cannot be merged into itself')
+
+        try:
+            report = merge_patients(survivor, duplicate, dry_run=options['dry_run'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        verb = 'would move' if options['dry_run'] else 'moved'
+        for table, rows in sorted(report['moved'].items()):
+            self.stdout.write(f'  {table}: {verb} {rows} row(s)')
+        for table, rows in sorted(report['conflicts'].items()):
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ {table}: {rows} row(s) already recorded on {survivor.patient_id}, left on {duplicate.patient_id}'
+            ))
+
+        if options['dry_run']:
+            self.stdout.write('Dry run: nothing was changed.')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ Merged {duplicate.patient_id} into {survivor.patient_id}.'
+            ))
@@ -0,0 +1,28 @@
+"""
+Management command to rebuild the patient search index.
+Tokens are refreshed whenever a patient is saved; run this after loading
+fixtures, after bulk updates or manual SQL changes to patients, or after
+changing the tokenization rules.
+
+Usage:
+  python manage.py rebuild_patient_search_index
+  python manage.py rebuild_patient_search_index --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+from patients import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild PatientSearchToken rows for every patient'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=search_index.DEFAULT_BATCH_SIZE,
+            help=f'Patients indexed per transaction (default: {search_index.DEFAULT_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        indexed = search_index.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✅ Indexed {indexed} patient(s) for search.'))
@@ -0,0 +1,42 @@
+"""
+Management command to rebuild the alert statistics projection.
+The buckets are maintained incrementally; run this after loading fixtures,
+after manual SQL changes to alerts, or periodically (e.g. nightly) as a check.
+
+Usage:
+  python manage.py reconcile_alert_statistics            # Rebuild buckets
+  python manage.py reconcile_alert_statistics --dry-run  # Report drift only
+"""
+from django.core.management.base import BaseCommand
+from patients import alert_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recount alert statistics buckets from the AppointmentAlert table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report differences without changing the buckets'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        differences = alert_statistics.reconcile(dry_run=dry_run)
+
+        for (status, alert_type, severity, day), (stored, actual) in sorted(differences.items()):
+            self.stdout.write(
+                f'  {day} {status}/{alert_type}/{severity}: stored {stored}, actual {actual}'
+            )
+
+        if not differences:
+            self.stdout.write(self.style.SUCCESS('✅ Alert statistics are in sync.'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️  {len(differences)} bucket(s) out of sync (dry run, nothing changed).'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ Rebuilt alert statistics; corrected {len(differences)} bucket(s).'
+            ))
@@ -0,0 +1,124 @@
+"""
+Patient record merging for PreciseOptics.
+
+Every foreign key to Patient is discovered from the app registry, so records
+added by new apps are merged without changes here. Each table is repointed
+from the duplicate to the surviving patient with one UPDATE, all in one
+transaction, followed by an AuditLog entry.
+
+Rows whose move would break a unique constraint (the same drug allergy or
+the same condition diagnosed on the same day recorded on both patients) stay
+with the duplicate and are reported as conflicts for manual review. The
+duplicate is kept, deactivated and removed from search, so nothing that
+could not be moved is lost. Search tokens are derived from the patient's own
+details and are dropped rather than moved.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Exists, OuterRef, UniqueConstraint
+from django.utils import timezone
+
+from . import schedule
+from .models import Patient, PatientArchive, PatientSearchToken
+
+# Rebuilt from the surviving patient's details instead of moved
+DERIVED_MODELS = ('patients.PatientSearchToken',)
+
+# Archived patients are refused, so there is never an archive to move
+UNMOVED_MODELS = DERIVED_MODELS + ('patients.PatientArchive',)
+
+
+def patient_references():
+    """[(model, field)] for every foreign key to Patient"""
+    references = []
+    for model in apps.get_models(include_auto_created=True):
+        if model._meta.label in UNMOVED_MODELS or model._meta.proxy or not model._meta.managed:
+            continue
+        for field in model._meta.concrete_fields:
+            if field.is_relation and field.related_model is Patient:
+                references.append((model, field))
+    return references
+
+
+def _unique_sets(model, field):
+    """Field name groups that must stay unique and include `field`"""
+    groups = [tuple(group) for group in model._meta.unique_together]
+    groups.extend(
+        tuple(constraint.fields) for constraint in model._meta.constraints
+        if isinstance(constraint, UniqueConstraint) and constraint.fields
+    )
+    if field.unique:
+        groups.append((field.name,))
+    return [group for group in groups if field.name in group]
+
+
+def _movable_rows(model, field, duplicate, survivor):
+    """The duplicate's rows that can be repointed without a unique conflict"""
+    rows = model._base_manager.filter(**{field.attname: duplicate.pk})
+    for group in _unique_sets(model, field):
+        clash = model._base_manager.filter(
+            **{field.attname: survivor.pk},
+            **{name: OuterRef(name) for name in group if name != field.name}
+        )
+        rows = rows.exclude(Exists(clash))
+    return rows
+
+
+def merge_patients(survivor, duplicate, user=None, ip_address='127.0.0.1', dry_run=False):
+    """
+    Move everything recorded against `duplicate` to `survivor`. Returns
+    {'moved': {table: rows}, 'conflicts': {table: rows}}; with dry_run
+    nothing is changed and the counts are what a merge would do.
+    """
+    from audit.models import AuditLog  # local import to avoid circular deps
+
+    if survivor.pk == duplicate.pk:
+        raise ValueError('A patient cannot be merged into itself')
+    if PatientArchive.objects.filter(patient__in=[survivor, duplicate]).exists():
+        raise ValueError('Restore archived patients before merging them')
+
+    moved, conflicts = {}, {}
+    with transaction.atomic():
+        # Hold both records so nothing is added to the duplicate mid-merge
+        list(Patient.objects.select_for_update().filter(pk__in=[survivor.pk, duplicate.pk]))
+
+        for model, field in patient_references():
+            label = model._meta.label
+            rows = _movable_rows(model, field, duplicate, survivor)
+            if dry_run:
+                count = rows.count()
+                left = model._base_manager.filter(**{field.attname: duplicate.pk}).count() - count
+            else:
+                count = rows.update(**{field.attname: survivor.pk})
+                left = model._base_manager.filter(**{field.attname: duplicate.pk}).count()
+            if count:
+                moved[label] = moved.get(label, 0) + count
+            if left:
+                conflicts[label] = conflicts.get(label, 0) + left
+
+        report = {'moved': moved, 'conflicts': conflicts}
+        if dry_run:
+            return report
+
+        # update() rather than save() so the search index signal does not re-add the tokens
+        Patient.objects.filter(pk=duplicate.pk).update(is_active=False, updated_at=timezone.now())
+        PatientSearchToken.objects.filter(patient=duplicate).delete()
+        # The moved visits are cached under the duplicate's name
+        schedule.forget_patient(survivor.pk)
+
+        AuditLog.objects.create(
+            user=user,
+            action='update',
+            resource_name='Patient',
+            resource_id=str(survivor.pk),
+            changes={'merged_patient': duplicate.patient_id, **report},
+            old_values={'patient_id': duplicate.patient_id, 'id': str(duplicate.pk)},
+            new_values={'patient_id': survivor.patient_id, 'id': str(survivor.pk)},
+            ip_address=ip_address,
+            description=f'Merged patient {duplicate.patient_id} into {survivor.patient_id}',
+            severity='high',
+            tags='patient-merge',
+            gdpr_relevant=True,
+            hipaa_relevant=True,
+        )
+    return report
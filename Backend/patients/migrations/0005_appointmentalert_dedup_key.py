@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+REF_PREFIX = 'ref_id:'
+OPEN_STATUSES = ['active', 'acknowledged']
+
+
+def populate_dedup_keys(apps, schema_editor):
+    """
+    Copy the legacy notes-based dedup key (ref_id:TYPE:UUID) into dedup_key.
+    Where several open alerts share a key only the most recent one keeps it,
+    so the partial unique constraint added below can be created.
+    """
+    AppointmentAlert = apps.get_model('patients', 'AppointmentAlert')
+    seen_open_keys = set()
+    batch = []
+
+    alerts = AppointmentAlert.objects.filter(
+        notes__startswith=REF_PREFIX,
+    ).only('id', 'status', 'notes').order_by('-created_at')
+
+    for alert in alerts.iterator(chunk_size=2000):
+        key = alert.notes[len(REF_PREFIX):].strip()[:100]
+        if not key:
+            continue
+        if alert.status in OPEN_STATUSES:
+            if key in seen_open_keys:
+                continue
+            seen_open_keys.add(key)
+        alert.dedup_key = key
+        batch.append(alert)
+        if len(batch) >= 2000:
+            AppointmentAlert.objects.bulk_update(batch, ['dedup_key'])
+            batch = []
+
+    if batch:
+        AppointmentAlert.objects.bulk_update(batch, ['dedup_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_alter_patientdocument_file'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointmentalert',
+            name='dedup_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Source record key (e.g. eye_test:<uuid>) used to avoid duplicate generated alerts', max_length=100, null=True),
+        ),
+        migrations.RunPython(populate_dedup_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointmentalert',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['active', 'acknowledged'])), fields=('dedup_key',), name='unique_open_alert_dedup_key'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_appointmentalert_dedup_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentAlertChange',
+            fields=[
+                ('sequence', models.BigAutoField(primary_key=True, serialize=False)),
+                ('change_type', models.CharField(choices=[('created', 'Created'), ('status_changed', 'Status Changed'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=20)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('acknowledged', 'Acknowledged'), ('resolved', 'Resolved'), ('dismissed', 'Dismissed')], max_length=15)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+                ('alert', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='patients.appointmentalert')),
+            ],
+            options={
+                'verbose_name': 'Appointment Alert Change',
+                'verbose_name_plural': 'Appointment Alert Changes',
+                'ordering': ['sequence'],
+            },
+        ),
+    ]
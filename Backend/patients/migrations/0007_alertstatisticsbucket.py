@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:58
+
+from django.db import migrations, models
+from django.db.models import Case, Count, When
+from django.db.models.functions import TruncDate
+
+
+def populate_buckets(apps, schema_editor):
+    """Seed the statistics projection from the existing alerts"""
+    AppointmentAlert = apps.get_model('patients', 'AppointmentAlert')
+    AlertStatisticsBucket = apps.get_model('patients', 'AlertStatisticsBucket')
+
+    day = Case(
+        When(status__in=['resolved', 'dismissed'], resolved_at__isnull=False, then=TruncDate('resolved_at')),
+        When(status='acknowledged', acknowledged_at__isnull=False, then=TruncDate('acknowledged_at')),
+        default=TruncDate('trigger_time'),
+    )
+    rows = (
+        AppointmentAlert.objects.order_by()
+        .annotate(day=day)
+        .values('status', 'alert_type', 'severity', 'day')
+        .annotate(count=Count('id'))
+    )
+    AlertStatisticsBucket.objects.bulk_create(
+        [AlertStatisticsBucket(**row) for row in rows],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_appointmentalertchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertStatisticsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('active', 'Active'), ('acknowledged', 'Acknowledged'), ('resolved', 'Resolved'), ('dismissed', 'Dismissed')], max_length=15)),
+                ('alert_type', models.CharField(choices=[('missed', 'Missed Appointment'), ('late', 'Late Arrival'), ('upcoming', 'Upcoming Appointment'), ('overdue_followup', 'Overdue Follow-up')], max_length=20)),
+                ('severity', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('critical', 'Critical')], max_length=10)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Alert Statistics Bucket',
+                'verbose_name_plural': 'Alert Statistics Buckets',
+                'constraints': [models.UniqueConstraint(fields=('status', 'alert_type', 'severity', 'day'), name='unique_alert_statistics_bucket')],
+            },
+        ),
+        migrations.RunPython(populate_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_alertstatisticsbucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentAlertArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('alert_type', models.CharField(choices=[('missed', 'Missed Appointment'), ('late', 'Late Arrival'), ('upcoming', 'Upcoming Appointment'), ('overdue_followup', 'Overdue Follow-up')], max_length=20)),
+                ('severity', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('critical', 'Critical')], max_length=10)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('acknowledged', 'Acknowledged'), ('resolved', 'Resolved'), ('dismissed', 'Dismissed')], max_length=15)),
+                ('title', models.CharField(max_length=200)),
+                ('message', models.TextField()),
+                ('trigger_time', models.DateTimeField()),
+                ('acknowledged_at', models.DateTimeField(blank=True, null=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('action_taken', models.TextField(blank=True)),
+                ('notes', models.TextField(blank=True)),
+                ('dedup_key', models.CharField(blank=True, max_length=100, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archived Appointment Alert',
+                'verbose_name_plural': 'Archived Appointment Alerts',
+                'ordering': ['-trigger_time'],
+            },
+        ),
+        migrations.AddField(
+            model_name='alertconfiguration',
+            name='archive_after_days',
+            field=models.IntegerField(default=90, help_text='Days after resolution/dismissal to move alerts to the archive (0 = never)'),
+        ),
+        migrations.AlterField(
+            model_name='appointmentalertchange',
+            name='change_type',
+            field=models.CharField(choices=[('created', 'Created'), ('status_changed', 'Status Changed'), ('updated', 'Updated'), ('deleted', 'Deleted'), ('archived', 'Archived')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentalert',
+            index=models.Index(fields=['status', 'resolved_at'], name='patients_ap_status_f53f46_idx'),
+        ),
+        migrations.AddField(
+            model_name='appointmentalertarchive',
+            name='acknowledged_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='appointmentalertarchive',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_alerts', to='patients.patient'),
+        ),
+        migrations.AddField(
+            model_name='appointmentalertarchive',
+            name='resolved_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='appointmentalertarchive',
+            name='visit',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_alerts', to='patients.patientvisit'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentalertarchive',
+            index=models.Index(fields=['patient', '-trigger_time'], name='patients_ap_patient_d1445d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentalertarchive',
+            index=models.Index(fields=['trigger_time'], name='patients_ap_trigger_4a9f63_idx'),
+        ),
+    ]
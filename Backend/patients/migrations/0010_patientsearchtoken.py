@@ -0,0 +1,104 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:25
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The tokenizer of patients.search_index as it stood when the index was
+# added, so this migration does not change when that module does
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return text.encode('ascii', 'ignore').decode().lower()
+
+
+def digits(text):
+    return re.sub(r'\D', '', text or '')
+
+
+def soundex(word):
+    word = re.sub(r'[^a-z]', '', word)
+    if not word:
+        return ''
+    code = word[0]
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+        if char not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def patient_tokens(patient):
+    tokens = set()
+    for part in re.findall(r'[a-z0-9]+', normalize(f'{patient.first_name} {patient.middle_name} {patient.last_name}')):
+        tokens.add(('name', part))
+        if not part.isdigit():
+            tokens.add(('phonetic', soundex(part)))
+    for number in (patient.phone_number, patient.alternate_phone):
+        number = digits(number)
+        if number:
+            tokens.add(('phone', number))
+            if number.startswith('44'):
+                tokens.add(('phone', '0' + number[2:]))
+    if digits(patient.nhs_number):
+        tokens.add(('nhs', digits(patient.nhs_number)))
+    if patient.patient_id:
+        tokens.add(('patient_id', normalize(patient.patient_id).replace(' ', '')))
+    return {(kind, token[:100]) for kind, token in tokens}
+
+
+def index_existing_patients(apps, schema_editor):
+    """Tokenize existing patients"""
+    Patient = apps.get_model('patients', 'Patient')
+    PatientSearchToken = apps.get_model('patients', 'PatientSearchToken')
+    tokens = []
+    for patient in Patient.objects.iterator(chunk_size=1000):
+        tokens.extend(
+            PatientSearchToken(patient_id=patient.pk, kind=kind, token=token)
+            for kind, token in patient_tokens(patient)
+        )
+        if len(tokens) >= 5000:
+            PatientSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    PatientSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_alertnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('name', 'Name part'), ('phonetic', 'Phonetic key'), ('phone', 'Phone number'), ('nhs', 'NHS number'), ('patient_id', 'Patient ID')], max_length=10)),
+                ('token', models.CharField(max_length=100)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='patients.patient')),
+            ],
+            options={
+                'verbose_name': 'Patient Search Token',
+                'verbose_name_plural': 'Patient Search Tokens',
+                'indexes': [models.Index(fields=['kind', 'token'], name='patients_pa_kind_8e3ecd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'kind', 'token'), name='unique_patient_search_token')],
+            },
+        ),
+        migrations.RunPython(index_existing_patients, migrations.RunPython.noop),
+    ]
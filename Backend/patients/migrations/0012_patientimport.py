@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:41
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_identifiersequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientImport',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('source', models.CharField(help_text='Path of the input file', max_length=500)),
+                ('source_format', models.CharField(choices=[('csv', 'CSV'), ('ndjson', 'Newline-delimited JSON')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('interrupted', 'Interrupted'), ('failed', 'Failed'), ('completed', 'Completed')], default='pending', max_length=20)),
+                ('chunk_size', models.PositiveIntegerField(default=500)),
+                ('rows_committed', models.PositiveIntegerField(default=0, help_text='Input rows processed by committed chunks')),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('failure_reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('started_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Patient Import',
+                'verbose_name_plural': 'Patient Imports',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientImportError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_number', models.PositiveIntegerField(help_text='1-based data row, excluding any header')),
+                ('errors', models.JSONField(default=dict)),
+                ('patient_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='patients.patientimport')),
+            ],
+            options={
+                'verbose_name': 'Patient Import Error',
+                'verbose_name_plural': 'Patient Import Errors',
+                'ordering': ['row_number'],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:44
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Soundex as in patients.search_index when the key was added, so this
+# migration does not change when that module does
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def soundex(word):
+    word = re.sub(r'[^a-z]', '', word)
+    if not word:
+        return ''
+    code = word[0]
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+        if char not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def birth_key(patient):
+    """'<iso date of birth>:<Soundex of the surname>', or None"""
+    surname = unicodedata.normalize('NFKD', patient.last_name or '').encode('ascii', 'ignore').decode().lower()
+    surname = soundex(''.join(re.findall(r'[a-z0-9]+', surname)))
+    if patient.date_of_birth and surname:
+        return f'{patient.date_of_birth.isoformat()}:{surname}'[:100]
+    return None
+
+
+def index_existing_birth_keys(apps, schema_editor):
+    """Add the date of birth + surname keys of existing patients"""
+    Patient = apps.get_model('patients', 'Patient')
+    PatientSearchToken = apps.get_model('patients', 'PatientSearchToken')
+    tokens = []
+    for patient in Patient.objects.only('pk', 'last_name', 'date_of_birth').iterator(chunk_size=1000):
+        key = birth_key(patient)
+        if key:
+            tokens.append(PatientSearchToken(patient_id=patient.pk, kind='dob_name', token=key))
+        if len(tokens) >= 5000:
+            PatientSearchToken.objects.bulk_create(tokens, ignore_conflicts=True)
+            tokens = []
+    PatientSearchToken.objects.bulk_create(tokens, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0012_patientimport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patientsearchtoken',
+            name='kind',
+            field=models.CharField(choices=[('name', 'Name part'), ('phonetic', 'Phonetic key'), ('phone', 'Phone number'), ('nhs', 'NHS number'), ('patient_id', 'Patient ID'), ('dob_name', 'Date of birth and surname key')], max_length=10),
+        ),
+        migrations.RunPython(index_existing_birth_keys, migrations.RunPython.noop),
+    ]
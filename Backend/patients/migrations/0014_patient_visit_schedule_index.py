@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0013_dob_name_search_tokens'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patientvisit',
+            index=models.Index(fields=['scheduled_date', 'status', 'primary_doctor'], name='patients_pa_schedul_770502_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:00
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0014_patient_visit_schedule_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientArchive',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('last_activity', models.DateTimeField(help_text='Latest patient update or visit when archived')),
+                ('record_count', models.PositiveIntegerField(default=0, help_text='Rows moved out of the live tables')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='archive', to='patients.patient')),
+            ],
+            options={
+                'verbose_name': 'Patient Archive',
+                'verbose_name_plural': 'Patient Archives',
+                'ordering': ['-archived_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientArchiveRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(help_text='Restore order within the archive')),
+                ('model', models.CharField(help_text='app_label.ModelName', max_length=100)),
+                ('kind', models.CharField(choices=[('rows', 'Rows'), ('links', 'Links')], default='rows', max_length=10)),
+                ('field', models.CharField(blank=True, help_text='Foreign key column reset on restore (links)', max_length=100)),
+                ('data', models.TextField(help_text='Serialized rows, or [row id, target id] pairs for links')),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='records', to='patients.patientarchive')),
+            ],
+            options={
+                'verbose_name': 'Patient Archive Record',
+                'verbose_name_plural': 'Patient Archive Records',
+                'ordering': ['archive', 'position'],
+            },
+        ),
+    ]
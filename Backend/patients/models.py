@@ -1,8 +1,9 @@
 """
 Patient models for PreciseOptics Eye Hospital Management System
 """
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from accounts.models import CustomUser
 from precise_optics.file_validators import validate_document_extension, validate_file_size
 import uuid
@@ -108,6 +109,160 @@ class Patient(models.Model):
         return today.year - self.date_of_birth.year - ((today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day))
 
 
+class PatientSearchToken(models.Model):
+    """
+    Normalized search token for a patient, maintained by patients.search_index.
+    Prefix lookups are range scans on the (kind, token) index.
+    """
+    KIND_CHOICES = (
+        ('name', 'Name part'),
+        ('phonetic', 'Phonetic key'),
+        ('phone', 'Phone number'),
+        ('nhs', 'NHS number'),
+        ('patient_id', 'Patient ID'),
+        ('dob_name', 'Date of birth and surname key'),
+    )
+    
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='search_tokens')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    token = models.CharField(max_length=100)
+    
+    class Meta:
+        verbose_name = "Patient Search Token"
+        verbose_name_plural = "Patient Search Tokens"
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'kind', 'token'], name='unique_patient_search_token'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'token']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind}:{self.token} ({self.patient_id})"
+
+
+class IdentifierSequence(models.Model):
+    """
+    Counter row per identifier prefix (PAT, RX, ...). patients.identifiers
+    reserves blocks of values from it, so the row is touched once per block
+    rather than once per identifier.
+    """
+    prefix = models.CharField(max_length=10, primary_key=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Identifier Sequence"
+        verbose_name_plural = "Identifier Sequences"
+    
+    def __str__(self):
+        return f"{self.prefix} (next {self.next_value})"
+
+
+class PatientImport(models.Model):
+    """
+    Bulk patient import run by patients.importer. rows_committed is advanced
+    in the same transaction as each chunk's inserts, so an interrupted import
+    resumes after the last committed chunk.
+    """
+    FORMAT_CHOICES = (
+        ('csv', 'CSV'),
+        ('ndjson', 'Newline-delimited JSON'),
+    )
+    
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('interrupted', 'Interrupted'),
+        ('failed', 'Failed'),
+        ('completed', 'Completed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    source = models.CharField(max_length=500, help_text="Path of the input file")
+    source_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    chunk_size = models.PositiveIntegerField(default=500)
+    
+    rows_committed = models.PositiveIntegerField(default=0, help_text="Input rows processed by committed chunks")
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    failure_reason = models.TextField(blank=True)
+    
+    started_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Patient Import"
+        verbose_name_plural = "Patient Imports"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.source} ({self.get_status_display()})"
+
+
+class PatientImportError(models.Model):
+    """Rejected input row of a PatientImport, with its validation errors"""
+    patient_import = models.ForeignKey(PatientImport, on_delete=models.CASCADE, related_name='errors')
+    row_number = models.PositiveIntegerField(help_text="1-based data row, excluding any header")
+    errors = models.JSONField(default=dict)
+    
+    class Meta:
+        verbose_name = "Patient Import Error"
+        verbose_name_plural = "Patient Import Errors"
+        ordering = ['row_number']
+    
+    def __str__(self):
+        return f"Row {self.row_number} of {self.patient_import_id}"
+
+
+class PatientArchive(models.Model):
+    """
+    Cold storage for an inactive patient's clinical history, written by
+    patients.cold_storage. The patient row itself stays (audit records point
+    at it); everything recorded against it is moved into PatientArchiveRecord
+    rows until the archive is restored.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient = models.OneToOneField(Patient, on_delete=models.PROTECT, related_name='archive')
+    last_activity = models.DateTimeField(help_text="Latest patient update or visit when archived")
+    record_count = models.PositiveIntegerField(default=0, help_text="Rows moved out of the live tables")
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Patient Archive"
+        verbose_name_plural = "Patient Archives"
+        ordering = ['-archived_at']
+    
+    def __str__(self):
+        return f"Archive of {self.patient_id}"
+
+
+class PatientArchiveRecord(models.Model):
+    """Rows of one table held in a PatientArchive, in restore order"""
+    KIND_CHOICES = (
+        ('rows', 'Rows'),
+        ('links', 'Links'),
+    )
+    
+    archive = models.ForeignKey(PatientArchive, on_delete=models.CASCADE, related_name='records')
+    position = models.PositiveIntegerField(help_text="Restore order within the archive")
+    model = models.CharField(max_length=100, help_text="app_label.ModelName")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='rows')
+    field = models.CharField(max_length=100, blank=True, help_text="Foreign key column reset on restore (links)")
+    data = models.TextField(help_text="Serialized rows, or [row id, target id] pairs for links")
+    
+    class Meta:
+        verbose_name = "Patient Archive Record"
+        verbose_name_plural = "Patient Archive Records"
+        ordering = ['archive', 'position']
+    
+    def __str__(self):
+        return f"{self.model} ({self.get_kind_display()}) in {self.archive_id}"
+
+
 class PatientVisit(models.Model):
     """
     Track patient visits to the hospital
@@ -171,6 +326,10 @@ class PatientVisit(models.Model):
         verbose_name = "Patient Visit"
         verbose_name_plural = "Patient Visits"
         ordering = ['-scheduled_date']
+        indexes = [
+            # Day schedules: a scheduled_date range, optionally by status and doctor
+            models.Index(fields=['scheduled_date', 'status', 'primary_doctor']),
+        ]
     
     def __str__(self):
         return f"{self.patient.get_full_name()} - {self.get_visit_type_display()} ({self.scheduled_date.date()})"
@@ -239,6 +398,9 @@ class AppointmentAlert(models.Model):
         ('dismissed', 'Dismissed'),
     )
     
+    # Statuses in which an alert still needs attention
+    OPEN_STATUSES = ('active', 'acknowledged')
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='alerts')
     visit = models.ForeignKey(PatientVisit, on_delete=models.CASCADE, related_name='alerts', null=True, blank=True)
@@ -275,6 +437,15 @@ class AppointmentAlert(models.Model):
     action_taken = models.TextField(blank=True, help_text="Actions taken to resolve the alert")
     notes = models.TextField(blank=True)
     
+    # Deduplication
+    dedup_key = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Source record key (e.g. eye_test:<uuid>) used to avoid duplicate generated alerts"
+    )
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -287,10 +458,209 @@ class AppointmentAlert(models.Model):
             models.Index(fields=['status', 'alert_type']),
             models.Index(fields=['trigger_time']),
             models.Index(fields=['-created_at']),
+            models.Index(fields=['status', 'resolved_at']),
+        ]
+        constraints = [
+            # Only one open alert per source record; closed alerts keep their key for history.
+            # MySQL has no partial indexes and ignores this constraint, so there
+            # dedup relies on the _open_dedup_keys pre-check, which concurrent
+            # scans can race past.
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['active', 'acknowledged']),
+                name='unique_open_alert_dedup_key',
+            ),
         ]
     
+    # Fields that decide which statistics bucket an alert is counted in
+    BUCKET_FIELDS = ('status', 'alert_type', 'severity', 'trigger_time', 'acknowledged_at', 'resolved_at')
+    
     def __str__(self):
         return f"{self.get_alert_type_display()} - {self.patient.get_full_name()} ({self.status})"
+    
+    def save(self, *args, **kwargs):
+        # Keep the change log and statistics (written by post_save) in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def bucket_values(self):
+        """Current values of the statistics bucket fields"""
+        return {name: getattr(self, name) for name in self.BUCKET_FIELDS}
+
+
+class AppointmentAlertChange(models.Model):
+    """
+    Append-only change log for appointment alerts.
+    The auto-incrementing sequence lets dashboards fetch only the alerts
+    that changed since the last sequence number they saw.
+    """
+    CHANGE_TYPES = (
+        ('created', 'Created'),
+        ('status_changed', 'Status Changed'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+        ('archived', 'Archived'),
+    )
+    
+    sequence = models.BigAutoField(primary_key=True)
+    # No database constraint: the log must outlive deleted alerts
+    alert = models.ForeignKey(
+        AppointmentAlert,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+'
+    )
+    change_type = models.CharField(max_length=20, choices=CHANGE_TYPES)
+    status = models.CharField(max_length=15, choices=AppointmentAlert.ALERT_STATUS)
+    changed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Appointment Alert Change"
+        verbose_name_plural = "Appointment Alert Changes"
+        ordering = ['sequence']
+    
+    def __str__(self):
+        return f"#{self.sequence} {self.get_change_type_display()} - {self.alert_id}"
+
+
+class AppointmentAlertArchive(models.Model):
+    """
+    Resolved and dismissed alerts moved out of the hot AppointmentAlert table
+    by the archive_alerts command. Rows keep their original id and timestamps
+    and are read-only.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='archived_alerts')
+    visit = models.ForeignKey(
+        PatientVisit,
+        on_delete=models.SET_NULL,
+        related_name='archived_alerts',
+        null=True,
+        blank=True
+    )
+    
+    # Alert Details
+    alert_type = models.CharField(max_length=20, choices=AppointmentAlert.ALERT_TYPES)
+    severity = models.CharField(max_length=10, choices=AppointmentAlert.ALERT_SEVERITY)
+    status = models.CharField(max_length=15, choices=AppointmentAlert.ALERT_STATUS)
+    
+    # Message
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    
+    # Timing
+    trigger_time = models.DateTimeField()
+    acknowledged_at = models.DateTimeField(null=True, blank=True)
+    acknowledged_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    resolved_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    
+    # Action tracking
+    action_taken = models.TextField(blank=True)
+    notes = models.TextField(blank=True)
+    dedup_key = models.CharField(max_length=100, null=True, blank=True)
+    
+    # Original timestamps
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Archived Appointment Alert"
+        verbose_name_plural = "Archived Appointment Alerts"
+        ordering = ['-trigger_time']
+        indexes = [
+            models.Index(fields=['patient', '-trigger_time']),
+            models.Index(fields=['trigger_time']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_alert_type_display()} - {self.patient_id} ({self.status}, archived)"
+
+
+class AlertNotification(models.Model):
+    """
+    Outbox of alert e-mails waiting to be sent to the responsible clinician.
+    Rows are queued when alerts are generated and delivered in per-recipient
+    digests by the dispatch_alert_notifications command.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    )
+    
+    # No database constraint so alerts can be archived with raw deletes
+    alert = models.ForeignKey(
+        AppointmentAlert,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='notifications'
+    )
+    recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='alert_notifications')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    
+    # Delivery tracking
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Alert Notification"
+        verbose_name_plural = "Alert Notifications"
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.recipient} - {self.alert_id} ({self.status})"
+
+
+class AlertStatisticsBucket(models.Model):
+    """
+    Incrementally maintained alert counts per (status, alert_type, severity, day).
+    `day` is the local date the alert entered its current status. Kept in step
+    with AppointmentAlert by the alert service and signals; rebuilt by the
+    reconcile_alert_statistics command.
+    """
+    status = models.CharField(max_length=15, choices=AppointmentAlert.ALERT_STATUS)
+    alert_type = models.CharField(max_length=20, choices=AppointmentAlert.ALERT_TYPES)
+    severity = models.CharField(max_length=10, choices=AppointmentAlert.ALERT_SEVERITY)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Alert Statistics Bucket"
+        verbose_name_plural = "Alert Statistics Buckets"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['status', 'alert_type', 'severity', 'day'],
+                name='unique_alert_statistics_bucket',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.status}/{self.alert_type}/{self.severity}: {self.count}"
 
 
 class AlertConfiguration(models.Model):
@@ -326,6 +696,10 @@ class AlertConfiguration(models.Model):
         default=7,
         help_text="Days after which to auto-dismiss unresolved alerts (0 = never)"
     )
+    archive_after_days = models.IntegerField(
+        default=90,
+        help_text="Days after resolution/dismissal to move alerts to the archive (0 = never)"
+    )
     
     # Notification settings
     send_email_alerts = models.BooleanField(default=False)
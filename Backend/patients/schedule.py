@@ -0,0 +1,174 @@
+"""
+Cached day schedules for PreciseOptics.
+
+A day's schedule (every visit on that local date, earliest first, as shown
+on the reception and clinic screens) is cached per date, both for the whole
+clinic and per primary doctor. Days that are not cached are loaded with one
+scheduled_date range query over the (scheduled_date, status, primary_doctor)
+index, however many days are asked for.
+
+Visit saves and deletions patch the cached days they touch once their
+transaction commits: the visit is removed from the day (and doctor) it was
+on and inserted into the one it is on now, so creating, rescheduling,
+checking in or completing a visit never forces a reload. Each cached day
+carries an ETag so screens that poll can be answered with 304 Not Modified.
+Patient detail changes and merges drop the days holding that patient's
+visits, since the cached entries include their name.
+
+The patches are applied to the configured cache, so every worker sees them
+only when that cache is shared (Redis or Memcached). With the per-process
+LocMemCache of development settings, other processes keep serving their own
+copy of a day until it expires after CACHE_TIMEOUT.
+"""
+import hashlib
+import json
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PatientVisit
+
+CACHE_KEY = 'patients:schedule'
+
+# Bounds how long an entry can lag behind a write made outside the model's
+# save() and delete() (queryset updates) or lost to a concurrent patch
+CACHE_TIMEOUT = 5 * 60
+
+MAX_RANGE_DAYS = 31
+
+
+def cache_key(day, doctor_id=None):
+    """Key of a day's schedule, for the whole clinic or one doctor (by UUID)"""
+    return f'{CACHE_KEY}:{day.isoformat()}:{doctor_id or "all"}'
+
+
+def visit_day(scheduled_date):
+    """Local date a visit is scheduled on, matching scheduled_date__date"""
+    return timezone.localdate(scheduled_date) if timezone.is_aware(scheduled_date) else scheduled_date.date()
+
+
+def day_bounds(first, last):
+    """[start, end) datetimes covering the local dates first..last"""
+    start = timezone.make_aware(datetime.combine(first, time.min))
+    end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min))
+    return start, end
+
+
+def entry(visit):
+    """Schedule row for a visit (patient and primary_doctor loaded)"""
+    scheduled = visit.scheduled_date
+    return {
+        'id': str(visit.id),
+        'patient_name': visit.patient.get_full_name(),
+        'patient_id': visit.patient.patient_id,
+        'scheduled_at': scheduled.astimezone(dt_timezone.utc).isoformat(),
+        'scheduled_time': timezone.localtime(scheduled).strftime('%H:%M'),
+        'visit_type': visit.get_visit_type_display(),
+        'status': visit.get_status_display(),
+        'doctor': visit.primary_doctor.get_full_name() if visit.primary_doctor else 'Not assigned'
+    }
+
+
+def _pack(visits):
+    """Cached form of a day: its entries in order and their ETag"""
+    visits.sort(key=lambda visit: (visit['scheduled_at'], visit['id']))
+    digest = hashlib.md5(json.dumps(visits, sort_keys=True).encode()).hexdigest()
+    return {'etag': f'"{digest}"', 'visits': visits}
+
+
+def _load(first, last, doctor_id=None):
+    """{day: [entries]} for every local date first..last, in one query"""
+    start, end = day_bounds(first, last)
+    queryset = PatientVisit.objects.filter(scheduled_date__gte=start, scheduled_date__lt=end)
+    if doctor_id:
+        queryset = queryset.filter(primary_doctor_id=doctor_id)
+    days = {first + timedelta(days=offset): [] for offset in range((last - first).days + 1)}
+    for visit in queryset.select_related('patient', 'primary_doctor').order_by('scheduled_date', 'id'):
+        days[visit_day(visit.scheduled_date)].append(entry(visit))
+    return days
+
+
+def get_days(first, last, doctor_id=None):
+    """{day: {'etag', 'visits'}} for the local dates first..last, oldest first"""
+    days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+    keys = {day: cache_key(day, doctor_id) for day in days}
+    cached = cache.get_many(keys.values())
+
+    missing = [day for day in days if keys[day] not in cached]
+    if missing:
+        loaded = {
+            day: _pack(visits)
+            for day, visits in _load(missing[0], missing[-1], doctor_id).items() if day in missing
+        }
+        cache.set_many({keys[day]: schedule for day, schedule in loaded.items()}, CACHE_TIMEOUT)
+        cached.update((keys[day], schedule) for day, schedule in loaded.items())
+    return {day: cached[keys[day]] for day in days}
+
+
+def get_day(day, doctor_id=None):
+    return get_days(day, day, doctor_id)[day]
+
+
+def range_etag(schedules):
+    """ETag for several days, from their own ETags"""
+    digest = hashlib.md5(''.join(schedule['etag'] for schedule in schedules).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def _patch(places, visit_id, build_entry=None):
+    """
+    Remove a visit from the cached days at `places` ({key: add}) and, where
+    add is set, insert the entry `build_entry` returns; uncached days are
+    left to be loaded on their next read
+    """
+    new_entry = None
+    for key, add in places.items():
+        schedule = cache.get(key)
+        if schedule is None:
+            continue
+        visits = [visit for visit in schedule['visits'] if visit['id'] != visit_id]
+        if add:
+            new_entry = new_entry or build_entry()
+            visits.append(new_entry)
+        cache.set(key, _pack(visits), CACHE_TIMEOUT)
+
+
+def _keys(day, doctor_id):
+    keys = [cache_key(day)]
+    if doctor_id:
+        keys.append(cache_key(day, doctor_id))
+    return keys
+
+
+def visit_saved(visit, before=None):
+    """
+    Patch the cached days after a visit save commits; `before` is the
+    stored (scheduled_date, primary_doctor_id) for an existing visit
+    """
+    def apply():
+        places = {}
+        if before:
+            places.update((key, False) for key in _keys(visit_day(before[0]), before[1]))
+        places.update((key, True) for key in _keys(visit_day(visit.scheduled_date), visit.primary_doctor_id))
+        _patch(places, str(visit.pk), lambda: entry(visit))
+
+    transaction.on_commit(apply)
+
+
+def visit_deleted(visit):
+    """Drop a deleted visit from its cached days once the deletion commits"""
+    places = dict.fromkeys(_keys(visit_day(visit.scheduled_date), visit.primary_doctor_id), False)
+    visit_id = str(visit.pk)
+    transaction.on_commit(lambda: _patch(places, visit_id))
+
+
+def forget_patient(patient_pk):
+    """Drop the cached days holding a patient's visits once the transaction commits"""
+    def apply():
+        places = PatientVisit.objects.filter(patient_id=patient_pk).values_list('scheduled_date', 'primary_doctor_id')
+        keys = {key for scheduled_date, doctor_id in places for key in _keys(visit_day(scheduled_date), doctor_id)}
+        cache.delete_many(keys)
+
+    transaction.on_commit(apply)
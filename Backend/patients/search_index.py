@@ -0,0 +1,230 @@
+"""
+Patient search index for PreciseOptics.
+
+Each patient's searchable fields are broken into normalized tokens stored in
+PatientSearchToken: lower-cased ASCII name parts with their Soundex keys,
+digits-only phone numbers (with the UK national form of +44 numbers), the NHS
+number and the patient ID. A search term matches tokens that start with it,
+found with a range condition (token >= term AND token < next prefix) that
+both SQLite and PostgreSQL answer from the (kind, token) index, plus exact
+phonetic matches for misspelt names. Every term must match; patients are
+ranked by how well each term matched.
+
+A date of birth + Soundex surname key is stored as well. It is not searched;
+together with the phone and NHS tokens it is a blocking key for duplicate
+detection (see patients.duplicates).
+
+Tokens are refreshed when a patient is saved (see signals) and can be rebuilt
+in bulk with the rebuild_patient_search_index command.
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Q, Value, When
+
+from .models import Patient, PatientSearchToken
+
+IDENTIFIER_KINDS = ('patient_id', 'nhs', 'phone')
+
+# Score of a term by how it matched; a patient's rank is the sum over terms
+EXACT_IDENTIFIER_SCORE = 10
+IDENTIFIER_PREFIX_SCORE = 5
+EXACT_NAME_SCORE = 3
+NAME_PREFIX_SCORE = 2
+PHONETIC_SCORE = 1
+
+# Shortest term that is matched phonetically
+MIN_PHONETIC_LENGTH = 3
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_TERMS = 6
+
+DEFAULT_BATCH_SIZE = 1000
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def normalize(text):
+    """Lower-case ASCII with accents removed"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return text.encode('ascii', 'ignore').decode().lower()
+
+
+def words(text):
+    return re.findall(r'[a-z0-9]+', normalize(text))
+
+
+def digits(text):
+    return re.sub(r'\D', '', text or '')
+
+
+def soundex(word):
+    """American Soundex code of an alphabetic word, e.g. 'robert' -> 'r163'"""
+    word = re.sub(r'[^a-z]', '', word)
+    if not word:
+        return ''
+    code = word[0]
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+        if char not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def phone_tokens(number):
+    number = digits(number)
+    if not number:
+        return set()
+    tokens = {number}
+    if number.startswith('44'):
+        tokens.add('0' + number[2:])
+    return tokens
+
+
+def patient_tokens(patient):
+    """Set of (kind, token) pairs for a patient (or any object with its fields)"""
+    tokens = set()
+    for part in words(f'{patient.first_name} {patient.middle_name} {patient.last_name}'):
+        tokens.add(('name', part))
+        if not part.isdigit():
+            tokens.add(('phonetic', soundex(part)))
+    for number in (patient.phone_number, patient.alternate_phone):
+        tokens.update(('phone', token) for token in phone_tokens(number))
+    if digits(patient.nhs_number):
+        tokens.add(('nhs', digits(patient.nhs_number)))
+    if patient.patient_id:
+        tokens.add(('patient_id', normalize(patient.patient_id).replace(' ', '')))
+    surname = soundex(''.join(words(patient.last_name)))
+    if patient.date_of_birth and surname:
+        tokens.add(('dob_name', f'{patient.date_of_birth.isoformat()}:{surname}'))
+    return {(kind, token[:100]) for kind, token in tokens}
+
+
+def index_patients(patients):
+    """Bring the stored tokens of the given patients in line with their fields"""
+    patients = list(patients)
+    if not patients:
+        return
+    stored = {}
+    for patient_id, kind, token in PatientSearchToken.objects.filter(
+        patient_id__in=[patient.pk for patient in patients]
+    ).values_list('patient_id', 'kind', 'token'):
+        stored.setdefault(patient_id, set()).add((kind, token))
+
+    stale, missing = Q(pk__in=[]), []
+    for patient in patients:
+        wanted = patient_tokens(patient)
+        current = stored.get(patient.pk, set())
+        for kind, token in current - wanted:
+            stale |= Q(patient_id=patient.pk, kind=kind, token=token)
+        missing.extend(
+            PatientSearchToken(patient_id=patient.pk, kind=kind, token=token)
+            for kind, token in wanted - current
+        )
+
+    with transaction.atomic():
+        PatientSearchToken.objects.filter(stale).delete()
+        PatientSearchToken.objects.bulk_create(missing, batch_size=DEFAULT_BATCH_SIZE)
+
+
+def rebuild(batch_size=DEFAULT_BATCH_SIZE):
+    """Re-index every patient in primary key batches. Returns the number indexed."""
+    total = 0
+    last_pk = None
+    while True:
+        batch = Patient.objects.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch.only(
+            'pk', 'first_name', 'middle_name', 'last_name', 'date_of_birth',
+            'phone_number', 'alternate_phone', 'nhs_number', 'patient_id'
+        )[:batch_size])
+        if not batch:
+            return total
+        index_patients(batch)
+        total += len(batch)
+        last_pk = batch[-1].pk
+
+
+def _prefix_q(term, kinds):
+    """token starts with term, as an index range: term <= token < term with last char bumped"""
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    return Q(kind__in=kinds, token__gte=term, token__lt=upper)
+
+
+def _term_score(term):
+    """(match condition, score expression) for one normalized search term"""
+    kinds = IDENTIFIER_KINDS if term.isdigit() else ('name', 'patient_id')
+    if not term.isdigit() and any(char.isdigit() for char in term):
+        kinds = ('patient_id',)
+
+    match = _prefix_q(term, kinds)
+    whens = [
+        When(Q(kind__in=IDENTIFIER_KINDS, token=term), then=Value(EXACT_IDENTIFIER_SCORE)),
+        When(Q(kind__in=IDENTIFIER_KINDS) & match, then=Value(IDENTIFIER_PREFIX_SCORE)),
+        When(Q(kind='name', token=term), then=Value(EXACT_NAME_SCORE)),
+        When(Q(kind='name') & match, then=Value(NAME_PREFIX_SCORE)),
+    ]
+    if term.isalpha() and len(term) >= MIN_PHONETIC_LENGTH:
+        phonetic = Q(kind='phonetic', token=soundex(term))
+        match |= phonetic
+        whens.append(When(phonetic, then=Value(PHONETIC_SCORE)))
+    return match, Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def search_terms(query):
+    """Normalized terms of a search box query; phone numbers keep their digits together"""
+    query = re.sub(r'(?<=\d)[\s\-()]+(?=\d)', '', query or '')
+    terms = []
+    for term in words(query):
+        if term.isdigit() and term.startswith('44') and len(term) > 10:
+            term = '0' + term[2:]
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def _matches(terms):
+    """Per-patient token rows annotated with one score per term and their total"""
+    any_match = Q(pk__in=[])
+    scores = {}
+    for index, term in enumerate(terms):
+        match, score = _term_score(term)
+        any_match |= match
+        scores[f'term_{index}'] = Max(score)
+    return (
+        PatientSearchToken.objects.filter(any_match)
+        .values('patient_id')
+        .annotate(**scores)
+        .filter(**{f'{name}__gt': 0 for name in scores})
+        .annotate(score=sum((F(name) for name in scores), Value(0)))
+    )
+
+
+def ranked_patient_ids(query, limit=DEFAULT_LIMIT):
+    """[(patient pk, score)] best first for patients matching every term of the query"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    rows = _matches(terms).order_by('-score', 'patient_id')[:limit]
+    return [(row['patient_id'], row['score']) for row in rows]
+
+
+def matching_patient_ids(query):
+    """Subquery of the pks of patients matching every term, for filtering querysets"""
+    terms = search_terms(query)
+    if not terms:
+        return PatientSearchToken.objects.none().values('patient_id')
+    return _matches(terms).values('patient_id')
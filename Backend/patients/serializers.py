@@ -2,7 +2,11 @@
 Serializers for PreciseOptics Eye Hospital Management System - Patients
 """
 from rest_framework import serializers
-from .models import Patient, PatientVisit, PatientDocument, AppointmentAlert, AlertConfiguration
+from .models import (
+    Patient, PatientVisit, PatientDocument, AppointmentAlert, AppointmentAlertArchive, AlertConfiguration,
+    PatientImport, PatientArchive
+)
+from .identifiers import PATIENT_IDS
 from precise_optics.file_validators import validate_document_extension, validate_file_size
 
 
@@ -79,19 +83,50 @@ class PatientCreateSerializer(serializers.ModelSerializer):
         """
         Create a new patient with auto-generated patient_id
         """
-        # Generate unique patient ID
-        import random
-        import string
-        from django.db import IntegrityError
-        
-        while True:
-            patient_id = 'PAT' + ''.join(random.choices(string.digits, k=6))
-            try:
-                validated_data['patient_id'] = patient_id
-                return Patient.objects.create(**validated_data)
-            except IntegrityError:
-                # Patient ID already exists, try again
-                continue
+        validated_data['patient_id'] = PATIENT_IDS.next()
+        return Patient.objects.create(**validated_data)
+
+
+class PatientImportRowSerializer(PatientCreateSerializer):
+    """
+    Validates one row of a bulk import with the registration rules.
+    NHS number uniqueness is checked once per chunk by patients.importer
+    instead of with a query per row.
+    """
+    class Meta(PatientCreateSerializer.Meta):
+        extra_kwargs = {'nhs_number': {'validators': []}}
+
+
+class PatientImportSerializer(serializers.ModelSerializer):
+    """
+    Serializer for PatientImport model
+    """
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = PatientImport
+        fields = [
+            'id', 'source_format', 'status', 'status_display', 'chunk_size',
+            'rows_committed', 'created_count', 'error_count', 'failure_reason',
+            'started_by', 'created_at', 'updated_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+
+class PatientArchiveSerializer(serializers.ModelSerializer):
+    """
+    Serializer for PatientArchive model
+    """
+    patient_id = serializers.CharField(source='patient.patient_id', read_only=True)
+    patient_name = serializers.CharField(source='patient.get_full_name', read_only=True)
+    
+    class Meta:
+        model = PatientArchive
+        fields = [
+            'id', 'patient', 'patient_id', 'patient_name', 'last_activity',
+            'record_count', 'archived_at'
+        ]
+        read_only_fields = fields
 
 
 class PatientDocumentSerializer(serializers.ModelSerializer):
@@ -218,6 +253,29 @@ class AppointmentAlertCreateSerializer(serializers.ModelSerializer):
         return AppointmentAlert.objects.create(**validated_data)
 
 
+class AppointmentAlertArchiveSerializer(serializers.ModelSerializer):
+    """
+    Read-only serializer for archived alerts
+    """
+    patient_name = serializers.CharField(source='patient.get_full_name', read_only=True)
+    patient_id_display = serializers.CharField(source='patient.patient_id', read_only=True)
+    acknowledged_by_name = serializers.CharField(source='acknowledged_by.get_full_name', read_only=True)
+    resolved_by_name = serializers.CharField(source='resolved_by.get_full_name', read_only=True)
+    
+    class Meta:
+        model = AppointmentAlertArchive
+        fields = [
+            'id', 'patient', 'patient_name', 'patient_id_display', 'visit',
+            'alert_type', 'severity', 'status', 'title', 'message',
+            'trigger_time',
+            'acknowledged_at', 'acknowledged_by', 'acknowledged_by_name',
+            'resolved_at', 'resolved_by', 'resolved_by_name',
+            'action_taken', 'notes',
+            'created_at', 'updated_at', 'archived_at'
+        ]
+        read_only_fields = fields
+
+
 class AlertConfigurationSerializer(serializers.ModelSerializer):
     """
     Serializer for AlertConfiguration model
@@ -229,7 +287,7 @@ class AlertConfigurationSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'late_threshold_minutes', 'missed_threshold_minutes',
             'upcoming_reminder_minutes', 'overdue_followup_days',
-            'auto_resolve_on_checkin', 'auto_dismiss_after_days',
+            'auto_resolve_on_checkin', 'auto_dismiss_after_days', 'archive_after_days',
             'send_email_alerts', 'send_sms_alerts',
             'is_active', 'created_at', 'updated_at',
             'created_by', 'created_by_name'
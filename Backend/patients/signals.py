@@ -0,0 +1,97 @@
+"""
+Signal receivers for the patients app
+"""
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import AppointmentAlert, Patient, PatientVisit
+from .alert_service import AlertService
+from . import alert_statistics, schedule, search_index
+
+
+def _persisted_bucket_values(instance):
+    """Bucket field values currently stored for this alert (locks the row)"""
+    return AppointmentAlert.objects.select_for_update().filter(
+        pk=instance.pk
+    ).values(*AppointmentAlert.BUCKET_FIELDS).first()
+
+
+@receiver(pre_save, sender=AppointmentAlert)
+def capture_alert_before_save(sender, instance, raw=False, **kwargs):
+    """Read the stored row so post_save can diff status and statistics buckets"""
+    instance._persisted_values = None
+    if not raw and not instance._state.adding:
+        instance._persisted_values = _persisted_bucket_values(instance)
+
+
+@receiver(post_save, sender=AppointmentAlert)
+def log_alert_save(sender, instance, created, raw=False, **kwargs):
+    """Record single-row alert saves in the change log and statistics projection"""
+    if raw:
+        # Fixture loading; run reconcile_alert_statistics afterwards
+        return
+    
+    before = instance._persisted_values
+    if created or before is None:
+        change_type = 'created'
+    elif before['status'] != instance.status:
+        change_type = 'status_changed'
+    else:
+        change_type = 'updated'
+    
+    AlertService.record_changes([(instance.id, instance.status)], change_type)
+    alert_statistics.record_transitions([(before, instance.bucket_values())])
+
+
+@receiver(pre_delete, sender=AppointmentAlert)
+def remove_alert_from_statistics(sender, instance, **kwargs):
+    """Decrement the alert's bucket while its row still exists"""
+    before = _persisted_bucket_values(instance)
+    if before:
+        alert_statistics.record_transitions([(before, None)])
+
+
+@receiver(post_delete, sender=AppointmentAlert)
+def log_alert_delete(sender, instance, **kwargs):
+    """Record alert deletions so feed clients can drop them"""
+    AlertService.record_changes([(instance.id, instance.status)], 'deleted')
+
+
+@receiver(post_save, sender=Patient)
+def index_patient_for_search(sender, instance, raw=False, **kwargs):
+    """Keep the patient's search tokens in line with their details"""
+    if raw:
+        # Fixture loading; run rebuild_patient_search_index afterwards
+        return
+    search_index.index_patients([instance])
+
+
+@receiver(post_save, sender=Patient)
+def forget_patient_schedule(sender, instance, created, raw=False, **kwargs):
+    """Cached day schedules show the patient's name; drop the days with their visits"""
+    if raw or created:
+        return
+    schedule.forget_patient(instance.pk)
+
+
+@receiver(pre_save, sender=PatientVisit)
+def capture_visit_before_save(sender, instance, raw=False, **kwargs):
+    """Read the stored day and doctor so the visit can be moved in the cached schedules"""
+    instance._schedule_before = None
+    if not raw and not instance._state.adding:
+        instance._schedule_before = PatientVisit.objects.filter(
+            pk=instance.pk
+        ).values_list('scheduled_date', 'primary_doctor_id').first()
+
+
+@receiver(post_save, sender=PatientVisit)
+def update_cached_schedule(sender, instance, raw=False, **kwargs):
+    """Patch the cached day schedules the visit was and is on"""
+    if raw:
+        return
+    schedule.visit_saved(instance, instance._schedule_before)
+
+
+@receiver(post_delete, sender=PatientVisit)
+def remove_visit_from_schedule(sender, instance, **kwargs):
+    """Drop a deleted visit from the cached day schedules"""
+    schedule.visit_deleted(instance)
@@ -1,3 +1,1270 @@
-from django.test import TestCase
+"""
+Tests for patients app
+"""
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from datetime import date, datetime, time, timedelta
+from audit.models import AuditLog, MedicationAudit, PatientAccessLog
+from conditions.models import ConditionProgress, MedicalCondition, PatientCondition
+from eye_tests.models import GlaucomaAssessment, VisualAcuityTest
+from medications.models import Medication, Prescription
+from medications.serializers import PrescriptionSerializer
+from patient_outcomes.models import PatientOutcomeReport
+from precise_optics import fieldsets
+from protocols import scheduling
+from protocols.models import PatientProtocol, ProtocolStep, TreatmentProtocol
+from .models import (
+    Patient, PatientVisit, AppointmentAlert, AppointmentAlertArchive, AppointmentAlertChange, AlertConfiguration,
+    AlertNotification, PatientSearchToken, IdentifierSequence, PatientImport, PatientArchive
+)
+from .alert_service import AlertService
+from .identifiers import IdentifierAllocator
+from . import (
+    alert_archive, alert_feed, alert_notifications, alert_statistics, cold_storage, duplicates, importer, merge,
+    schedule, search_index, timeline
+)
 
-# Create your tests here.
+User = get_user_model()
+
+
+def create_test_patient(user, patient_id='PAT000001', **overrides):
+    """Helper to create a test patient with all required fields."""
+    data = {
+        'patient_id': patient_id,
+        'first_name': 'John',
+        'last_name': 'Doe',
+        'date_of_birth': date(1960, 5, 1),
+        'gender': 'M',
+        'phone_number': '+447700900000',
+        'address_line_1': '1 High Street',
+        'city': 'London',
+        'state': 'Greater London',
+        'postal_code': 'SW1A 1AA',
+        'emergency_contact_name': 'Jane Doe',
+        'emergency_contact_phone': '+447700900001',
+        'emergency_contact_relationship': 'Spouse',
+        'registered_by': user,
+    }
+    data.update(overrides)
+    return Patient.objects.create(**data)
+
+
+def create_test_alert(patient, **overrides):
+    """Helper to create an active missed-appointment alert."""
+    data = {
+        'patient': patient,
+        'alert_type': 'missed',
+        'severity': 'high',
+        'title': 'Missed Appointment',
+        'message': 'Patient did not attend',
+        'trigger_time': timezone.now(),
+    }
+    data.update(overrides)
+    return AppointmentAlert.objects.create(**data)
+
+
+class AlertTestCase(TestCase):
+    """Authenticated client and a patient to raise alerts against"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.patient = create_test_patient(self.user)
+
+    def create_alert(self, **overrides):
+        return create_test_alert(self.patient, **overrides)
+
+
+class ClinicalFollowupDedupTest(TestCase):
+    """Test dedup_key handling for generated clinical follow-up alerts"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.patient = create_test_patient(self.user)
+        self.test = VisualAcuityTest.objects.create(
+            patient=self.patient,
+            performed_by=self.user,
+            test_date=timezone.now() - timedelta(days=40),
+            status='completed',
+            follow_up_required=True,
+            follow_up_date=date.today() - timedelta(days=20),
+        )
+        self.ref_key = f'eye_test:{self.test.id}'
+
+    def test_followup_alert_carries_dedup_key(self):
+        alerts = AlertService.check_clinical_followups()
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0].dedup_key, self.ref_key)
+        self.assertEqual(alerts[0].severity, 'high')
+        self.assertEqual(alerts[0].notes, '')
+
+    def test_repeat_scan_does_not_duplicate(self):
+        AlertService.check_clinical_followups()
+        second_run = AlertService.check_clinical_followups()
+        self.assertEqual(second_run, [])
+        self.assertEqual(AppointmentAlert.objects.filter(dedup_key=self.ref_key).count(), 1)
+
+    def test_closed_alert_allows_new_alert(self):
+        alert = AlertService.check_clinical_followups()[0]
+        AlertService.resolve_alert(alert.id, self.user, notes='Phoned patient')
+        alerts = AlertService.check_clinical_followups()
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(AppointmentAlert.objects.filter(dedup_key=self.ref_key).count(), 2)
+
+    def test_bulk_insert_skips_concurrently_created_alert(self):
+        # Simulate another scanner inserting the same open alert first
+        AppointmentAlert.objects.create(
+            patient=self.patient,
+            alert_type='overdue_followup',
+            title='Existing',
+            message='Created by another scan',
+            trigger_time=timezone.now(),
+            dedup_key=self.ref_key,
+        )
+        duplicate = AppointmentAlert(
+            patient=self.patient,
+            alert_type='overdue_followup',
+            title='Duplicate',
+            message='Should be skipped',
+            trigger_time=timezone.now(),
+            dedup_key=self.ref_key,
+        )
+        inserted = AlertService._bulk_create_deduplicated([duplicate])
+        self.assertEqual(inserted, [])
+        self.assertEqual(AppointmentAlert.objects.filter(dedup_key=self.ref_key).count(), 1)
+
+
+class AlertChangeFeedTest(AlertTestCase):
+    """Test the alert change log and /alerts/changes/ feed"""
+
+    def settle(self):
+        """Age the logged changes past the feed's visibility lag"""
+        AppointmentAlertChange.objects.update(
+            changed_at=timezone.now() - timedelta(seconds=alert_feed.VISIBILITY_LAG_SECONDS + 1)
+        )
+
+    def test_bootstrap_returns_head_sequence(self):
+        self.create_alert()
+        self.settle()
+        response = self.client.get('/api/alerts/changes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['changes'], [])
+        self.assertEqual(response.data['last_sequence'], AppointmentAlertChange.objects.get().sequence)
+
+    def test_returns_only_changes_after_since(self):
+        first = self.create_alert()
+        self.settle()
+        head = self.client.get('/api/alerts/changes/').data['last_sequence']
+        AlertService.acknowledge_alert(first.id, self.user)
+        second = self.create_alert(alert_type='late', severity='medium')
+        self.settle()
+
+        response = self.client.get('/api/alerts/changes/', {'since': head})
+        changes = response.data['changes']
+        self.assertEqual(
+            [(c['alert_id'], c['change_type'], c['status']) for c in changes],
+            [(str(first.id), 'status_changed', 'acknowledged'), (str(second.id), 'created', 'active')]
+        )
+        self.assertEqual(response.data['last_sequence'], changes[-1]['sequence'])
+        self.assertEqual(changes[1]['alert']['alert_type'], 'late')
+
+    def test_bulk_transition_logs_each_alert(self):
+        alerts = [self.create_alert(), self.create_alert()]
+        head = AppointmentAlertChange.objects.order_by('-sequence').first().sequence
+        updated = AlertService.bulk_transition(
+            AppointmentAlert.objects.filter(status='active'),
+            status='resolved',
+        )
+        self.assertEqual(updated, 2)
+        logged = AppointmentAlertChange.objects.filter(sequence__gt=head)
+        self.assertEqual({c.alert_id for c in logged}, {a.id for a in alerts})
+        self.assertTrue(all(c.status == 'resolved' for c in logged))
+
+    def test_deleted_alert_reported_without_payload(self):
+        alert = self.create_alert()
+        head = AppointmentAlertChange.objects.order_by('-sequence').first().sequence
+        alert.delete()
+        self.settle()
+        response = self.client.get('/api/alerts/changes/', {'since': head})
+        change = response.data['changes'][0]
+        self.assertEqual(change['change_type'], 'deleted')
+        self.assertIsNone(change['alert'])
+
+    def test_limit_sets_has_more(self):
+        for _ in range(3):
+            self.create_alert()
+        self.settle()
+        response = self.client.get('/api/alerts/changes/', {'since': 0, 'limit': 2})
+        self.assertEqual(len(response.data['changes']), 2)
+        self.assertTrue(response.data['has_more'])
+
+    def test_invalid_since_rejected(self):
+        response = self.client.get('/api/alerts/changes/', {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_changes_inside_the_lag_are_held_back(self):
+        first = self.create_alert()
+        self.settle()
+        self.create_alert()
+        third = self.create_alert()
+        # A later change that is already old must not be served past the held-back one
+        AppointmentAlertChange.objects.filter(alert=third).update(changed_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(alert_feed.latest_sequence(), AppointmentAlertChange.objects.get(alert=first).sequence)
+        response = self.client.get('/api/alerts/changes/', {'since': 0})
+        self.assertEqual([c['alert_id'] for c in response.data['changes']], [str(first.id)])
+        self.assertFalse(response.data['has_more'])
+
+        self.settle()
+        response = self.client.get('/api/alerts/changes/', {'since': 0})
+        self.assertEqual(len(response.data['changes']), 3)
+
+    def test_event_stream_response(self):
+        self.create_alert()
+        self.settle()
+        response = self.client.get(
+            '/api/alerts/changes/', {'since': 0}, HTTP_ACCEPT='text/event-stream'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: changes', body)
+
+
+class AlertStatisticsProjectionTest(AlertTestCase):
+    """Test incrementally maintained alert statistics buckets"""
+
+    def test_statistics_follow_alert_lifecycle(self):
+        first = self.create_alert()
+        second = self.create_alert(alert_type='late', severity='medium')
+        self.create_alert(severity='critical')
+        AlertService.acknowledge_alert(first.id, self.user)
+        AlertService.resolve_alert(second.id, self.user, action_taken='Patient arrived')
+
+        response = self.client.get('/api/alerts/statistics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_active'], 1)
+        self.assertEqual(response.data['total_acknowledged'], 1)
+        self.assertEqual(response.data['total_resolved_today'], 1)
+        self.assertEqual(response.data['critical_active'], 1)
+        self.assertEqual(response.data['late_active'], 0)
+
+    def test_bulk_transition_moves_buckets(self):
+        for _ in range(3):
+            self.create_alert()
+        AlertService.bulk_transition(
+            AppointmentAlert.objects.filter(status='active'),
+            status='dismissed',
+            resolved_at=timezone.now(),
+        )
+        stats = AlertService.get_alert_statistics()
+        self.assertEqual(stats['total_active'], 0)
+        self.assertEqual(stats['missed_active'], 0)
+
+    def test_reconcile_matches_incremental_counts(self):
+        old = self.create_alert(trigger_time=timezone.now() - timedelta(days=3))
+        self.create_alert(alert_type='upcoming', severity='low')
+        AlertService.dismiss_alert(old.id, self.user, reason='Duplicate')
+        old.delete()
+        self.assertEqual(alert_statistics.reconcile(dry_run=True), {})
+
+    def test_reconcile_repairs_drift(self):
+        self.create_alert()
+        # Bypass signals to simulate out-of-band changes
+        AppointmentAlert.objects.update(status='resolved', resolved_at=timezone.now())
+        self.assertEqual(AlertService.get_alert_statistics()['total_active'], 1)
+        differences = alert_statistics.reconcile()
+        self.assertEqual(len(differences), 2)
+        self.assertEqual(AlertService.get_alert_statistics()['total_active'], 0)
+        self.assertEqual(AlertService.get_alert_statistics()['total_resolved_today'], 1)
+
+
+class AlertArchiveTest(AlertTestCase):
+    """Test archival of old resolved and dismissed alerts"""
+
+    def create_alert(self, alert_status='active', resolved_days_ago=None):
+        overrides = {'status': alert_status, 'trigger_time': timezone.now() - timedelta(days=200)}
+        if resolved_days_ago is not None:
+            overrides.update(
+                resolved_at=timezone.now() - timedelta(days=resolved_days_ago), resolved_by=self.user
+            )
+        return create_test_alert(self.patient, **overrides)
+
+    def test_only_old_terminal_alerts_are_archived(self):
+        old_resolved = self.create_alert('resolved', resolved_days_ago=120)
+        old_dismissed = self.create_alert('dismissed', resolved_days_ago=100)
+        recent_resolved = self.create_alert('resolved', resolved_days_ago=5)
+        still_active = self.create_alert('active')
+
+        moved = alert_archive.archive_alerts(older_than_days=90, batch_size=1)
+        self.assertEqual(moved, 2)
+        self.assertEqual(
+            set(AppointmentAlert.objects.values_list('id', flat=True)),
+            {recent_resolved.id, still_active.id}
+        )
+        archived = AppointmentAlertArchive.objects.get(id=old_resolved.id)
+        self.assertEqual(archived.resolved_by, self.user)
+        self.assertEqual(archived.created_at, old_resolved.created_at)
+        self.assertTrue(AppointmentAlertArchive.objects.filter(id=old_dismissed.id).exists())
+
+    def test_archiving_keeps_statistics_and_feed_consistent(self):
+        alert = self.create_alert('resolved', resolved_days_ago=120)
+        alert_archive.archive_alerts(older_than_days=90)
+        self.assertEqual(alert_statistics.reconcile(dry_run=True), {})
+        change = AppointmentAlertChange.objects.order_by('-sequence').first()
+        self.assertEqual((change.alert_id, change.change_type), (alert.id, 'archived'))
+
+    def test_max_batches_allows_resuming(self):
+        for _ in range(3):
+            self.create_alert('resolved', resolved_days_ago=120)
+        self.assertEqual(alert_archive.archive_alerts(90, batch_size=2, max_batches=1), 2)
+        self.assertEqual(alert_archive.archive_alerts(90, batch_size=2), 1)
+        self.assertEqual(AppointmentAlertArchive.objects.count(), 3)
+
+    def test_archive_endpoint_is_read_only(self):
+        alert = self.create_alert('resolved', resolved_days_ago=120)
+        alert_archive.archive_alerts(older_than_days=90)
+        response = self.client.get('/api/alerts-archive/', {'patient': str(self.patient.id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], str(alert.id))
+        response = self.client.delete(f'/api/alerts-archive/{alert.id}/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class FailingEmailBackend:
+    """E-mail connection whose sends always fail"""
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP unavailable')
+
+
+class UnreachableEmailBackend(FailingEmailBackend):
+    """E-mail connection that cannot be opened"""
+
+    def open(self):
+        raise ConnectionError('SMTP server unreachable')
+
+
+class CrashingEmailBackend(FailingEmailBackend):
+    """E-mail connection that sends one message, then the process dies"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_messages(self, messages):
+        if self.sent:
+            raise SystemExit('worker killed')
+        self.sent.extend(messages)
+        return len(messages)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class AlertNotificationTest(AlertTestCase):
+    """Test the alert notification outbox and digest dispatcher"""
+
+    def setUp(self):
+        super().setUp()
+        self.config = AlertConfiguration.objects.create(is_active=True, send_email_alerts=True)
+        self.test = VisualAcuityTest.objects.create(
+            patient=self.patient,
+            performed_by=self.user,
+            test_date=timezone.now() - timedelta(days=40),
+            status='completed',
+            follow_up_required=True,
+            follow_up_date=date.today() - timedelta(days=20),
+        )
+
+    def test_generated_alerts_are_queued_not_sent(self):
+        created = AlertService.check_clinical_followups()
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(mail.outbox), 0)
+        notification = AlertNotification.objects.get()
+        self.assertEqual((notification.alert_id, notification.recipient), (created[0].id, self.user))
+
+    def test_nothing_is_queued_when_email_alerts_are_disabled(self):
+        self.config.send_email_alerts = False
+        self.config.save()
+        AlertService.check_clinical_followups()
+        self.assertFalse(AlertNotification.objects.exists())
+
+    def test_dispatch_sends_one_digest_per_recipient(self):
+        alerts = [self.create_alert(title=f'Alert {i}') for i in range(3)]
+        alert_notifications.enqueue([(alert, self.user) for alert in alerts], self.config)
+
+        stats = alert_notifications.dispatch(rate_per_minute=0)
+        self.assertEqual((stats['digests'], stats['sent']), (1, 3))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['doctor@test.com'])
+        self.assertIn('3 new patient alerts', mail.outbox[0].subject)
+        self.assertEqual(AlertNotification.objects.filter(status='sent').count(), 3)
+
+        # Sent notifications are not picked up again
+        self.assertEqual(alert_notifications.dispatch(rate_per_minute=0)['sent'], 0)
+
+    def test_notifications_for_closed_alerts_are_cancelled(self):
+        alert = self.create_alert()
+        alert_notifications.enqueue([(alert, self.user)], self.config)
+        alert.status = 'resolved'
+        alert.save()
+
+        stats = alert_notifications.dispatch(rate_per_minute=0)
+        self.assertEqual(stats['cancelled'], 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_failed_sends_are_retried_with_backoff(self):
+        alert = self.create_alert()
+        alert_notifications.enqueue([(alert, self.user)], self.config)
+
+        stats = alert_notifications.dispatch(rate_per_minute=0, max_attempts=2, connection=FailingEmailBackend())
+        self.assertEqual(stats['retried'], 1)
+        notification = AlertNotification.objects.get()
+        self.assertEqual((notification.status, notification.attempts), ('pending', 1))
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+
+        notification.next_attempt_at = timezone.now()
+        notification.save()
+        stats = alert_notifications.dispatch(rate_per_minute=0, max_attempts=2, connection=FailingEmailBackend())
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(AlertNotification.objects.get().status, 'failed')
+
+    def test_sent_digests_are_saved_before_the_next_send(self):
+        other = User.objects.create_user(username='nurse', email='nurse@test.com', password='testpass123')
+        alert = self.create_alert()
+        alert_notifications.enqueue([(alert, self.user), (alert, other)], self.config)
+
+        backend = CrashingEmailBackend()
+        with self.assertRaises(SystemExit):
+            alert_notifications.dispatch(rate_per_minute=0, connection=backend)
+        sent = AlertNotification.objects.get(status='sent')
+        self.assertEqual(backend.sent[0].to, [sent.recipient.email])
+        self.assertEqual(AlertNotification.objects.filter(status='pending').count(), 1)
+
+    def test_lease_covers_a_rate_limited_batch(self):
+        lease = alert_notifications.lease_duration(batch_size=500, rate_per_minute=30)
+        self.assertGreater(lease, timedelta(minutes=500 / 30) + alert_notifications.LEASE_SAFETY_MARGIN)
+
+    def test_unreachable_server_backs_off_every_leased_notification(self):
+        other = User.objects.create_user(username='nurse', email='nurse@test.com', password='testpass123')
+        alert = self.create_alert()
+        alert_notifications.enqueue([(alert, self.user), (alert, other)], self.config)
+
+        stats = alert_notifications.dispatch(rate_per_minute=0, connection=UnreachableEmailBackend())
+        self.assertEqual((stats['digests'], stats['retried']), (0, 2))
+        for notification in AlertNotification.objects.all():
+            self.assertEqual((notification.status, notification.attempts), ('pending', 1))
+            self.assertEqual(notification.last_error, 'SMTP server unreachable')
+            self.assertGreater(notification.next_attempt_at, timezone.now() + timedelta(minutes=1))
+
+
+class PatientSearchIndexTest(TestCase):
+    """Test the tokenized patient search index"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testreception',
+            email='reception@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.smith = create_test_patient(
+            self.user, 'PAT000001', first_name='Zoë', last_name='Smith',
+            phone_number='+447700900123', nhs_number='943 476 5919'
+        )
+        self.smyth = create_test_patient(self.user, 'PAT000002', first_name='Anna', last_name='Smyth')
+        self.jones = create_test_patient(self.user, 'PAT000003', first_name='Robert', last_name='Jones')
+
+    def search(self, query):
+        response = self.client.get('/api/patients/search/', {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result['patient_id'] for result in response.data['results']]
+
+    def test_tokens_are_normalized(self):
+        tokens = search_index.patient_tokens(self.smith)
+        self.assertIn(('name', 'zoe'), tokens)
+        self.assertIn(('phonetic', 's530'), tokens)
+        self.assertIn(('phone', '07700900123'), tokens)
+        self.assertIn(('nhs', '9434765919'), tokens)
+        self.assertIn(('patient_id', 'pat000001'), tokens)
+
+    def test_prefix_phonetic_and_identifier_search(self):
+        # Exact name ranks above the sound-alike spelling
+        self.assertEqual(self.search('smith'), ['PAT000001', 'PAT000002'])
+        self.assertEqual(sorted(self.search('sm')), ['PAT000001', 'PAT000002'])
+        self.assertEqual(self.search('zoe smi'), ['PAT000001'])
+        self.assertEqual(self.search('07700 900123'), ['PAT000001'])
+        self.assertEqual(self.search('943 476'), ['PAT000001'])
+        self.assertEqual(self.search('PAT000003'), ['PAT000003'])
+        self.assertEqual(self.search(''), [])
+
+    def test_tokens_follow_patient_updates(self):
+        self.jones.last_name = 'Brown'
+        self.jones.save()
+        self.assertEqual(self.search('jones'), [])
+        self.assertEqual(self.search('brown'), ['PAT000003'])
+
+        response = self.client.get('/api/patients/', {'search': 'rob'})
+        results = response.data['results'] if 'results' in response.data else response.data
+        self.assertEqual([p['patient_id'] for p in results], ['PAT000003'])
+
+    def test_rebuild_restores_missing_tokens(self):
+        PatientSearchToken.objects.all().delete()
+        self.assertEqual(search_index.rebuild(batch_size=2), 3)
+        self.assertEqual(self.search('anna'), ['PAT000002'])
+
+
+class SparseFieldsetsTest(TestCase):
+    """Test ?fields / ?omit pruning and the queryset optimization it drives"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testreception',
+            email='reception@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        for index in range(3):
+            patient = create_test_patient(self.user, f'PAT00000{index}')
+            PatientVisit.objects.create(
+                patient=patient, visit_type='consultation',
+                scheduled_date=timezone.now(), chief_complaint='Blurred vision'
+            )
+
+    def list_patients(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/patients/', params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results'], len(queries)
+
+    def test_fields_and_omit(self):
+        results, _ = self.list_patients({'fields': 'patient_id,full_name'})
+        self.assertEqual(set(results[0]), {'patient_id', 'full_name'})
+
+        results, _ = self.list_patients({'omit': 'allergies,medical_history'})
+        self.assertNotIn('allergies', results[0])
+        self.assertIn('patient_id', results[0])
+
+    def test_sparse_request_drops_unused_prefetches(self):
+        _, full_queries = self.list_patients()
+        _, sparse_queries = self.list_patients({'fields': 'id,full_name'})
+        # The default queryset prefetches visits, which no requested field uses
+        self.assertLess(sparse_queries, full_queries)
+
+    def test_method_fields_keep_the_views_joins(self):
+        for patient in Patient.objects.all():
+            PatientOutcomeReport.objects.create(
+                patient=patient, completed_by=self.user, report_date=date.today(),
+                vision_quality_score=7, pain_discomfort_score=2, light_sensitivity_score=3,
+                daily_activities_score=8, reading_ability_score=6, treatment_satisfaction='satisfied'
+            )
+
+        def count_queries(params=None):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/patient-outcomes/', params or {})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        full_queries = count_queries()
+        # patient_name and completed_by_name read relations the view joins
+        self.assertEqual(count_queries({'fields': 'id,patient_name'}), full_queries)
+        self.assertEqual(count_queries({'fields': 'id,completed_by_name'}), full_queries)
+
+    def test_nested_fields_drive_relations(self):
+        serializer = PrescriptionSerializer(many=True)
+        fieldsets.prune(serializer.child, fieldsets._tree(['id', 'items.medication_name']))
+        self.assertEqual(set(serializer.child.fields), {'id', 'items'})
+        self.assertEqual(set(serializer.child.fields['items'].child.fields), {'medication_name'})
+
+        select, prefetch = fieldsets.relations(serializer.child, Prescription)
+        self.assertEqual(select, set())
+        self.assertEqual(prefetch, {'items', 'items__medication'})
+
+        serializer = PrescriptionSerializer()
+        fieldsets.prune(serializer, fieldsets._tree(['patient_name', 'total_items']))
+        select, prefetch = fieldsets.relations(serializer, Prescription)
+        self.assertEqual((select, prefetch), ({'patient'}, {'items'}))
+
+
+class PatientChartTest(TestCase):
+    """Test the aggregated patient chart endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.patient = create_test_patient(self.user)
+        self.url = f'/api/patients/{self.patient.pk}/chart/'
+
+    def add_records(self):
+        PatientVisit.objects.create(
+            patient=self.patient, visit_type='consultation',
+            scheduled_date=timezone.now(), chief_complaint='Blurred vision'
+        )
+        VisualAcuityTest.objects.create(
+            patient=self.patient, performed_by=self.user,
+            test_date=timezone.now(), status='completed', right_eye_unaided='6/9'
+        )
+        GlaucomaAssessment.objects.create(
+            patient=self.patient, performed_by=self.user,
+            test_date=timezone.now(), status='completed'
+        )
+
+    def get_chart(self, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, **headers)
+        return response, len(queries)
+
+    def test_chart_sections_in_bounded_queries(self):
+        self.add_records()
+        response, queries = self.get_chart()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['patient']['patient_id'], 'PAT000001')
+        self.assertEqual(len(response.data['recent_visits']), 1)
+        self.assertEqual(response.data['eye_tests']['visualacuitytest']['right_eye_unaided'], '6/9')
+        self.assertIsNone(response.data['eye_tests']['octscan'])
+        self.assertEqual(response.data['active_prescriptions'], [])
+
+        # More records do not mean more queries
+        self.add_records()
+        _, more_queries = self.get_chart()
+        self.assertEqual(more_queries, queries)
+
+    def test_etag_and_access_log(self):
+        response, _ = self.get_chart()
+        etag = response['ETag']
+
+        response, _ = self.get_chart(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(
+            PatientAccessLog.objects.filter(patient=self.patient, access_type='view_medical_history').count(), 2
+        )
+
+        self.add_records()
+        response, _ = self.get_chart(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_completing_a_protocol_step_changes_etag(self):
+        condition = MedicalCondition.objects.create(code='DRY', name='Dry eye', category='other')
+        protocol = TreatmentProtocol.objects.create(
+            name='Dry Eye', code='DRY-001', protocol_type='fixed_interval', condition=condition,
+            description='Dry eye reviews.', indications='Dry eye.', requires_consent=False, created_by=self.user
+        )
+        for number in range(1, 5):
+            ProtocolStep.objects.create(
+                protocol=protocol, step_number=number, step_type='follow_up', title=f'Review {number}',
+                description='Review', timing_days=7 * (number - 1), timing_window_after=2
+            )
+        patient_protocol = PatientProtocol.objects.create(
+            patient=self.patient, protocol=protocol, start_date=date.today() - timedelta(days=30),
+            assigned_by=self.user, assignment_reason='Dry eye'
+        )
+        scheduling.schedule_patient_protocol(patient_protocol)
+        step = patient_protocol.step_completions.order_by('scheduled_date').first()
+
+        response, _ = self.get_chart()
+        etag = response['ETag']
+        self.assertEqual(response.data['active_protocols'][0]['completion_progress']['completed'], 0)
+
+        response = self.client.post(
+            f'/api/protocols/patient-protocols/{patient_protocol.pk}/complete-step/{step.pk}/',
+            {'completed_date': step.scheduled_date.isoformat()}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.get_chart(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['active_protocols'][0]['completion_progress']['completed'], 1)
+
+
+class IdentifierAllocatorTest(TransactionTestCase):
+    """Test hi/lo identifier allocation (outside a test transaction, as in production)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testreception',
+            email='reception@test.com',
+            password='testpass123'
+        )
+        self.allocator = IdentifierAllocator('TST', 3, 'patients.Patient', 'patient_id', block_size=5)
+
+    def test_block_is_issued_from_memory(self):
+        self.assertEqual(self.allocator.next(), 'TST001')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.allocator.take(4), ['TST002', 'TST003', 'TST004', 'TST005'])
+        self.assertEqual(self.allocator.next(), 'TST006')
+        self.assertEqual(IdentifierSequence.objects.get(prefix='TST').next_value, 11)
+
+    def test_existing_identifiers_are_skipped(self):
+        create_test_patient(self.user, 'TST002')
+        self.assertEqual(self.allocator.take(5), ['TST001', 'TST003', 'TST004', 'TST005', 'TST006'])
+
+    def test_nothing_is_kept_from_a_rolled_back_reservation(self):
+        try:
+            with transaction.atomic():
+                self.assertEqual(self.allocator.next(), 'TST001')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # The counter was rolled back and no block is cached, so the value is reissued once
+        self.assertEqual(self.allocator.take(2), ['TST001', 'TST002'])
+        self.assertEqual(IdentifierSequence.objects.get(prefix='TST').next_value, 6)
+
+
+PATIENT_CSV_HEADER = (
+    'first_name,last_name,date_of_birth,gender,phone_number,address_line_1,city,state,'
+    'postal_code,emergency_contact_name,emergency_contact_phone,emergency_contact_relationship,nhs_number\n'
+)
+
+
+def patient_csv_row(first_name, nhs_number='', date_of_birth='1970-01-01'):
+    return (
+        f'{first_name},Import,{date_of_birth},F,07700900555,2 Mill Lane,Leeds,West Yorkshire,'
+        f'LS1 1AA,Sam Import,07700900556,Sibling,{nhs_number}\n'
+    )
+
+
+class PatientImportTest(TestCase):
+    """Test the streaming bulk patient import"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testadmin',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write_source(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def test_command_imports_valid_rows_and_reports_errors(self):
+        source = self.write_source('clinic.csv', PATIENT_CSV_HEADER + ''.join([
+            patient_csv_row('Ada', '1111111111'),
+            patient_csv_row('Bea', '1111111111'),
+            patient_csv_row('Cal', date_of_birth='not-a-date'),
+            patient_csv_row('Dot'),
+        ]))
+        call_command('import_patients', source, '--chunk-size', '3', stdout=io.StringIO())
+
+        patient_import = PatientImport.objects.get()
+        self.assertEqual(patient_import.status, 'completed')
+        self.assertEqual(
+            (patient_import.rows_committed, patient_import.created_count, patient_import.error_count), (4, 2, 2)
+        )
+        self.assertEqual(
+            sorted(Patient.objects.filter(last_name='Import').values_list('first_name', flat=True)), ['Ada', 'Dot']
+        )
+        self.assertTrue(Patient.objects.get(first_name='Ada').patient_id.startswith('PAT'))
+        self.assertTrue(PatientSearchToken.objects.filter(kind='name', token='ada').exists())
+
+        with open(f'{source}.errors.csv') as stream:
+            report = stream.read().splitlines()
+        self.assertEqual(report[0], 'row,field,message')
+        self.assertTrue(report[1].startswith('2,nhs_number,'))
+        self.assertTrue(report[2].startswith('3,date_of_birth,'))
+
+    def test_resume_skips_committed_rows(self):
+        rows = [
+            {'first_name': name, 'last_name': 'Import', 'date_of_birth': '1970-01-01', 'gender': 'M',
+             'phone_number': '07700900555', 'address_line_1': '2 Mill Lane', 'city': 'Leeds',
+             'state': 'West Yorkshire', 'postal_code': 'LS1 1AA', 'emergency_contact_name': 'Sam Import',
+             'emergency_contact_phone': '07700900556', 'emergency_contact_relationship': 'Sibling'}
+            for name in ('Ada', 'Bea', 'Cal')
+        ]
+        source = self.write_source('clinic.ndjson', '\n'.join(json.dumps(row) for row in rows))
+        patient_import = PatientImport.objects.create(
+            source=source, source_format='ndjson', chunk_size=2, status='interrupted', rows_committed=2
+        )
+        importer.run_file(patient_import)
+
+        self.assertEqual(list(Patient.objects.values_list('first_name', flat=True)), ['Cal'])
+        self.assertEqual((patient_import.status, patient_import.rows_committed), ('completed', 3))
+
+    def test_running_import_cannot_be_resumed_twice(self):
+        source = self.write_source('clinic.csv', PATIENT_CSV_HEADER + patient_csv_row('Ada'))
+        patient_import = PatientImport.objects.create(source=source, source_format='csv', status='running')
+
+        response = self.client.post(f'/api/patient-imports/{patient_import.pk}/resume/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Patient.objects.exists())
+
+        # A run that stopped committing long ago has lost its worker
+        PatientImport.objects.filter(pk=patient_import.pk).update(
+            updated_at=timezone.now() - importer.STALE_AFTER - timedelta(minutes=1)
+        )
+        response = self.client.post(f'/api/patient-imports/{patient_import.pk}/resume/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(Patient.objects.count(), 1)
+
+    def test_upload_endpoint_limits_rows(self):
+        content = PATIENT_CSV_HEADER + patient_csv_row('Ada') * (importer.MAX_REQUEST_ROWS + 1)
+        upload = SimpleUploadedFile('clinic.csv', content.encode())
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            response = self.client.post('/api/patient-imports/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PatientImport.objects.exists())
+
+    def test_upload_endpoint(self):
+        upload = SimpleUploadedFile('clinic.csv', (PATIENT_CSV_HEADER + patient_csv_row('Ada')).encode())
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            response = self.client.post('/api/patient-imports/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created_count'], 1)
+        self.assertEqual(Patient.objects.get().registered_by, self.user)
+
+        response = self.client.get(f"/api/patient-imports/{response.data['id']}/errors/")
+        self.assertEqual(response.content.decode().strip(), 'row,field,message')
+
+
+class DuplicatePatientDetectionTest(TestCase):
+    """Test blocking-key duplicate detection"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testreception',
+            email='reception@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.smith = create_test_patient(
+            self.user, 'PAT000001', first_name='Jonathan', last_name='Smith',
+            date_of_birth=date(1980, 2, 3), phone_number='+447700900111', nhs_number='9434765919'
+        )
+        # Same person registered again with misspelt names
+        self.smyth = create_test_patient(
+            self.user, 'PAT000002', first_name='Jonathon', last_name='Smyth',
+            date_of_birth=date(1980, 2, 3), phone_number='07700900999'
+        )
+        # Shares a household phone only
+        self.jones = create_test_patient(
+            self.user, 'PAT000003', first_name='Mary', last_name='Jones',
+            date_of_birth=date(1952, 7, 9), phone_number='07700900111'
+        )
+
+    def test_registration_check_scores_blocked_candidates(self):
+        response = self.client.get('/api/patients/possible-duplicates/', {
+            'first_name': 'Jonathan', 'last_name': 'Smith',
+            'date_of_birth': '1980-02-03', 'phone_number': '07700 900111',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['patient_id'] for p in response.data['results']], ['PAT000001'])
+        self.assertEqual(
+            response.data['results'][0]['match_reasons'],
+            ['date_of_birth', 'last_name', 'first_name', 'phone_number']
+        )
+
+        response = self.client.get('/api/patients/possible-duplicates/', {'date_of_birth': '03/02/1980'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_existing_patient_check_uses_two_queries(self):
+        with self.assertNumQueries(2):
+            matches = duplicates.possible_duplicates(self.smyth)
+        self.assertEqual([(patient.patient_id, score) for patient, score, _ in matches], [('PAT000001', 41)])
+
+    def test_shared_phone_block_does_not_crowd_out_strong_matches(self):
+        for index in range(duplicates.MAX_CANDIDATES + 5):
+            create_test_patient(
+                self.user, f'PAT1{index:05d}', first_name='Resident', last_name=f'Home{index}',
+                date_of_birth=date(1940, 1, 1), phone_number='07700900999'
+            )
+        matches = duplicates.possible_duplicates(self.smyth)
+        self.assertEqual([patient.patient_id for patient, _, _ in matches], ['PAT000001'])
+
+    def test_batch_command_clusters_duplicates(self):
+        output = os.path.join(tempfile.mkdtemp(), 'duplicates.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('find_duplicate_patients', '--output', output, stdout=io.StringIO())
+        with open(output) as stream:
+            rows = list(csv.reader(stream))
+        self.assertEqual([row[:2] for row in rows[1:]], [['1', 'PAT000001'], ['1', 'PAT000002']])
+
+
+class PatientMergeTest(TestCase):
+    """Test set-based patient merging"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testadmin',
+            email='admin@test.com',
+            password='testpass123',
+            is_staff=True
+        )
+        self.client.force_authenticate(user=self.user)
+        self.survivor = create_test_patient(self.user, 'PAT000001')
+        self.duplicate = create_test_patient(self.user, 'PAT000002', first_name='Jon')
+        for _ in range(2):
+            PatientVisit.objects.create(
+                patient=self.duplicate, visit_type='consultation',
+                scheduled_date=timezone.now(), chief_complaint='Blurred vision'
+            )
+        VisualAcuityTest.objects.create(
+            patient=self.duplicate, performed_by=self.user, test_date=timezone.now(), status='completed'
+        )
+        amd = MedicalCondition.objects.create(code='AMD', name='Macular degeneration', category='retinal')
+        for patient in (self.survivor, self.duplicate):
+            # The same diagnosis on both records cannot be moved
+            PatientCondition.objects.create(
+                patient=patient, condition=amd, diagnosis_date=date(2024, 1, 10),
+                diagnosed_by=self.user, severity='mild', eye_affected='left'
+            )
+        self.url = f'/api/patients/{self.survivor.pk}/merge/'
+
+    def test_dry_run_reports_without_changes(self):
+        response = self.client.post(self.url, {'duplicate': str(self.duplicate.pk), 'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['moved']['patients.PatientVisit'], 2)
+        self.assertEqual(response.data['moved']['eye_tests.VisualAcuityTest'], 1)
+        self.assertEqual(response.data['conflicts'], {'conditions.PatientCondition': 1})
+        self.assertEqual(self.duplicate.visits.count(), 2)
+
+    def test_merge_moves_records_and_audits(self):
+        # An UPDATE and a leftover count per table, plus the archive check,
+        # savepoint, row locks, deactivation, token cleanup and the audit entry
+        with self.assertNumQueries(2 * len(merge.patient_references()) + 7):
+            merge.merge_patients(self.survivor, self.duplicate, user=self.user)
+
+        self.assertEqual(self.survivor.visits.count(), 2)
+        self.assertEqual(VisualAcuityTest.objects.get().patient, self.survivor)
+        self.assertEqual(PatientCondition.objects.filter(patient=self.duplicate).count(), 1)
+        self.duplicate.refresh_from_db()
+        self.assertFalse(self.duplicate.is_active)
+        self.assertFalse(PatientSearchToken.objects.filter(patient=self.duplicate).exists())
+        self.assertTrue(AuditLog.objects.filter(tags='patient-merge', resource_id=str(self.survivor.pk)).exists())
+
+    def test_merge_requires_staff(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.post(self.url, {'duplicate': str(self.duplicate.pk)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PatientTimelineTest(TestCase):
+    """Test the cursor-merged patient timeline"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.patient = create_test_patient(self.user)
+        self.url = f'/api/patients/{self.patient.pk}/timeline/'
+
+        now = timezone.now()
+        for days in (1, 4, 7):
+            PatientVisit.objects.create(
+                patient=self.patient, visit_type='consultation',
+                scheduled_date=now - timedelta(days=days), chief_complaint='Blurred vision'
+            )
+        VisualAcuityTest.objects.create(
+            patient=self.patient, performed_by=self.user, test_date=now - timedelta(days=2), status='completed'
+        )
+        GlaucomaAssessment.objects.create(
+            patient=self.patient, performed_by=self.user, test_date=now - timedelta(days=5), status='completed'
+        )
+        condition = PatientCondition.objects.create(
+            patient=self.patient,
+            condition=MedicalCondition.objects.create(code='POAG', name='Glaucoma', category='glaucoma'),
+            diagnosis_date=date(2020, 1, 1), diagnosed_by=self.user, severity='mild', eye_affected='both'
+        )
+        ConditionProgress.objects.create(
+            patient_condition=condition, assessed_by=self.user,
+            assessment_date=(now - timedelta(days=10)).date(), assessment_type='routine'
+        )
+        # Another patient's records never appear
+        other = create_test_patient(self.user, 'PAT000002')
+        PatientVisit.objects.create(patient=other, visit_type='consultation', scheduled_date=now)
+
+    def test_pages_merge_sources_newest_first(self):
+        seen = []
+        url = f'{self.url}?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(
+            [event['type'] for event in seen],
+            ['visit', 'eye_test', 'visit', 'eye_test', 'visit', 'condition_progress']
+        )
+        self.assertEqual(seen[1]['test'], 'visualacuitytest')
+        self.assertEqual(seen[5]['condition'], 'Glaucoma')
+        self.assertEqual(len({event['id'] for event in seen}), 6)
+
+    def test_exhausted_sources_are_not_queried_again(self):
+        events, cursor = timeline.page(self.patient, page_size=4)
+        self.assertEqual(len(events), 4)
+        positions = timeline.decode_cursor(cursor)
+        self.assertEqual(positions['eye_test'], timeline.EXHAUSTED)
+        self.assertEqual(positions['prescription'], timeline.EXHAUSTED)
+        self.assertNotEqual(positions['visit'], timeline.EXHAUSTED)
+
+        # Only the visit and condition progress streams are left to read
+        with self.assertNumQueries(2):
+            events, cursor = timeline.page(self.patient, cursor, page_size=4)
+        self.assertEqual([event['type'] for event in events], ['visit', 'condition_progress'])
+        self.assertIsNone(cursor)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'{self.url}?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        for position in (['bad', 'bad'], ['2026-01-01T00:00:00+00:00', 'bad'], [1, 2]):
+            cursor = timeline.encode_cursor({'visit': position})
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DayScheduleCacheTest(TestCase):
+    """Test the cached day schedules"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.patient = create_test_patient(self.user)
+        self.today = timezone.localdate()
+        self.visit = PatientVisit.objects.create(
+            patient=self.patient, visit_type='consultation', primary_doctor=self.user,
+            scheduled_date=timezone.make_aware(datetime.combine(self.today, time(10, 30)))
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_today_schedule_is_patched_on_check_in(self):
+        response = self.client.get('/api/visits/today_schedule/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['scheduled_time'], '10:30')
+        self.assertEqual(response.data[0]['status'], 'Scheduled')
+        etag = response['ETag']
+
+        response = self.client.get('/api/visits/today_schedule/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/visits/{self.visit.pk}/check_in/')
+        with self.assertNumQueries(0):
+            day = schedule.get_day(self.today)
+        self.assertEqual(day['visits'][0]['status'], 'Checked In')
+        self.assertNotEqual(day['etag'], etag)
+
+    def test_reschedule_moves_visit_between_cached_days(self):
+        tomorrow = self.today + timedelta(days=1)
+        schedule.get_days(self.today, tomorrow)
+        schedule.get_day(self.today, self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.visit.scheduled_date += timedelta(days=1)
+            self.visit.save()
+            PatientVisit.objects.create(
+                patient=self.patient, visit_type='follow_up',
+                scheduled_date=timezone.make_aware(datetime.combine(tomorrow, time(9, 0)))
+            )
+
+        with self.assertNumQueries(0):
+            days = schedule.get_days(self.today, tomorrow)
+            by_doctor = schedule.get_day(self.today, self.user.pk)
+        self.assertEqual(days[self.today]['visits'], [])
+        self.assertEqual(by_doctor['visits'], [])
+        self.assertEqual(
+            [visit['scheduled_time'] for visit in days[tomorrow]['visits']], ['09:00', '10:30']
+        )
+
+    def test_range_endpoint(self):
+        tomorrow = self.today + timedelta(days=1)
+        response = self.client.get(
+            '/api/visits/schedule/', {'date_from': self.today.isoformat(), 'date_to': tomorrow.isoformat()}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([len(day['visits']) for day in response.data['days']], [1, 0])
+
+        response = self.client.get(
+            '/api/visits/schedule/', {'date_from': tomorrow.isoformat(), 'date_to': self.today.isoformat()}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/visits/schedule/', {'date': 'tomorrow'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_doctor_param(self):
+        response = self.client.get('/api/visits/schedule/', {'doctor': str(self.user.pk).upper()})
+        self.assertEqual(len(response.data['days'][0]['visits']), 1)
+        self.assertIsNotNone(cache.get(schedule.cache_key(self.today, self.user.pk)))
+
+        for url in ('/api/visits/schedule/', '/api/visits/today_schedule/'):
+            response = self.client.get(url, {'doctor': 'abc'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PatientColdStorageTest(TestCase):
+    """Test archiving inactive patients to cold storage and restoring them"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testadmin',
+            email='admin@test.com',
+            password='testpass123',
+            is_staff=True
+        )
+        self.client.force_authenticate(user=self.user)
+        long_ago = timezone.now() - timedelta(days=365 * 10)
+
+        self.patient = create_test_patient(self.user, 'PAT000001', is_active=False)
+        self.visit = PatientVisit.objects.create(
+            patient=self.patient, visit_type='consultation', scheduled_date=long_ago
+        )
+        VisualAcuityTest.objects.create(
+            patient=self.patient, performed_by=self.user, test_date=long_ago, status='completed'
+        )
+        PatientCondition.objects.create(
+            patient=self.patient,
+            condition=MedicalCondition.objects.create(code='POAG', name='Glaucoma', category='glaucoma'),
+            diagnosis_date=long_ago.date(), diagnosed_by=self.user, severity='mild', eye_affected='both'
+        )
+        AppointmentAlert.objects.create(
+            patient=self.patient, visit=self.visit, alert_type='missed', status='resolved',
+            title='Missed', message='Did not attend', trigger_time=long_ago, resolved_at=long_ago
+        )
+        Patient.objects.filter(pk=self.patient.pk).update(updated_at=long_ago)
+        self.visit_created_at = PatientVisit.objects.get().created_at
+
+        # Inactive but seen recently, and active: both stay
+        recent = create_test_patient(self.user, 'PAT000002', is_active=False)
+        Patient.objects.filter(pk=recent.pk).update(updated_at=long_ago)
+        PatientVisit.objects.create(patient=recent, visit_type='follow_up', scheduled_date=timezone.now())
+        create_test_patient(self.user, 'PAT000003')
+
+    def test_archive_and_restore(self):
+        statistics = alert_statistics.get_statistics()
+        archived, moved, skipped = cold_storage.archive_patients(years=8)
+        self.assertEqual((archived, skipped), (1, []))
+        self.assertEqual(moved, 4)
+
+        archive = PatientArchive.objects.get()
+        self.assertEqual(archive.patient, self.patient)
+        self.assertFalse(PatientVisit.objects.filter(patient=self.patient).exists())
+        self.assertFalse(VisualAcuityTest.objects.exists())
+        self.assertFalse(AppointmentAlert.objects.exists())
+        self.assertFalse(PatientSearchToken.objects.filter(patient=self.patient).exists())
+        self.assertEqual(PatientVisit.objects.count(), 1)
+
+        response = self.client.post(f'/api/patient-archives/{archive.pk}/restore/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['restored']['patients.PatientVisit'], 1)
+        self.assertFalse(PatientArchive.objects.exists())
+        visit = PatientVisit.objects.get(pk=self.visit.pk)
+        self.assertEqual(visit.created_at, self.visit_created_at)
+        self.assertEqual(AppointmentAlert.objects.get().visit, visit)
+        self.assertEqual(PatientCondition.objects.get().patient, self.patient)
+        self.assertTrue(PatientSearchToken.objects.filter(patient=self.patient).exists())
+        self.assertEqual(alert_statistics.get_statistics(), statistics)
+        self.assertTrue(AuditLog.objects.filter(tags='patient-archive').exists())
+
+    def test_collector_internals_used_by_archiving(self):
+        # cold_storage reads these non-public Collector attributes
+        collector = cold_storage._collect(self.patient)
+        self.assertIn(VisualAcuityTest, [rows.model for rows in collector.fast_deletes])
+        self.assertIn(PatientVisit, collector.data)
+        for (field, value), batches in collector.field_updates.items():
+            self.assertIsNone(value)
+            self.assertTrue(all(isinstance(batch, (list, QuerySet)) for batch in batches))
+
+    def test_restore_relinks_hot_rows_and_fast_deleted_rows(self):
+        prescription = Prescription.objects.create(
+            prescription_number='RX000001', patient=self.patient, visit=self.visit,
+            prescribing_doctor=self.user, valid_until=date(2030, 1, 1)
+        )
+        medication = Medication.objects.create(name='Latanoprost', shelf_life_months=24, unit_price=10)
+        audit = MedicationAudit.objects.create(
+            patient=self.patient, medication=medication, prescription=prescription,
+            action='prescribed', performed_by=self.user
+        )
+        test_id = VisualAcuityTest.objects.get().pk
+
+        cold_storage.archive_patients(years=8)
+        audit.refresh_from_db()
+        self.assertIsNone(audit.prescription_id)
+        self.assertFalse(VisualAcuityTest.objects.exists())
+
+        cold_storage.restore_patient(PatientArchive.objects.get())
+        audit.refresh_from_db()
+        self.assertEqual(audit.prescription_id, prescription.pk)
+        self.assertEqual(VisualAcuityTest.objects.get().pk, test_id)
+
+    def test_archivable_patients_can_be_locked_without_outer_joins(self):
+        # PostgreSQL rejects FOR UPDATE on the nullable side of an outer join
+        self.assertNotIn('JOIN', str(cold_storage.archivable_patients(8).query))
+        self.assertEqual(list(cold_storage.archivable_patients(8)), [self.patient])
+
+    def test_command_dry_run_and_resume(self):
+        out = io.StringIO()
+        call_command('archive_patients', '--dry-run', stdout=out)
+        self.assertIn('1 patient(s)', out.getvalue())
+
+        call_command('archive_patients', '--batch-size', '1', '--max-batches', '1', stdout=io.StringIO())
+        call_command('archive_patients', stdout=io.StringIO())
+        self.assertEqual(PatientArchive.objects.count(), 1)
+
+    def test_archived_patients_cannot_be_merged(self):
+        cold_storage.archive_patients(years=8)
+        survivor = Patient.objects.get(patient_id='PAT000003')
+        response = self.client.post(
+            f'/api/patients/{survivor.pk}/merge/', {'duplicate': str(self.patient.pk)}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,202 @@
+"""
+Unified patient timeline for PreciseOptics.
+
+Visits, consultations, eye tests, prescriptions, treatments, condition
+progress and referrals are read as separate streams, each ordered newest
+first on (date, id) with a keyset condition and a limit of one page (plus
+one row to tell whether more follow). The streams are merged with a heap and
+the first page_size events are returned; nothing older than that is loaded.
+
+The cursor records where each stream stopped, so the next page continues
+every source from its own position with an indexed range scan, and streams
+that have run out are not queried again. The thirteen eye test tables are
+read as a single UNION query.
+"""
+import binascii
+import heapq
+import json
+import uuid
+from base64 import b64decode, b64encode
+from datetime import datetime, time
+
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from conditions.models import ConditionProgress
+from consultations.models import Consultation
+from eye_tests.models import BaseEyeTest
+from medications.models import Prescription
+from referrals.models import Referral
+from treatments.models import Treatment
+
+from .models import PatientVisit
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Stored in the cursor for streams with nothing left
+EXHAUSTED = 'done'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _eye_tests(patient):
+    return [
+        model.objects.filter(patient=patient)
+        .annotate(when=F('test_date'), test=Value(model._meta.model_name))
+        .values('id', 'when', 'test', 'eye_side', 'status')
+        for model in BaseEyeTest.__subclasses__()
+    ]
+
+
+# name: patient -> [querysets of rows with `id`, `when` and the event fields];
+# several querysets are read as one UNION
+SOURCES = {
+    'visit': lambda patient: [
+        PatientVisit.objects.filter(patient=patient).annotate(when=F('scheduled_date'))
+        .values('id', 'when', 'visit_type', 'status', 'chief_complaint')
+    ],
+    'consultation': lambda patient: [
+        Consultation.objects.filter(patient=patient).annotate(when=F('scheduled_time'))
+        .values('id', 'when', 'consultation_type', 'status')
+    ],
+    'eye_test': _eye_tests,
+    'prescription': lambda patient: [
+        Prescription.objects.filter(patient=patient).annotate(when=F('date_prescribed'))
+        .values('id', 'when', 'prescription_number', 'status')
+    ],
+    # Unscheduled treatments are placed at the time they were recorded
+    'treatment': lambda patient: [
+        Treatment.objects.filter(patient=patient)
+        .annotate(when=Coalesce('scheduled_date', 'created_at'), treatment=F('treatment_type__name'))
+        .values('id', 'when', 'treatment', 'eye_treated', 'status')
+    ],
+    'condition_progress': lambda patient: [
+        ConditionProgress.objects.filter(patient_condition__patient=patient)
+        .annotate(when=F('assessment_date'), condition=F('patient_condition__condition__name'))
+        .values('id', 'when', 'condition', 'assessment_type', 'status_change')
+    ],
+    'referral': lambda patient: [
+        Referral.objects.filter(patient=patient).annotate(when=F('referral_date'))
+        .values('id', 'when', 'referral_number', 'reason', 'urgency', 'current_status')
+    ],
+}
+
+# Sources whose `when` is a DateField rather than a DateTimeField
+DATE_SOURCES = {'condition_progress', 'referral'}
+
+
+def _position(name, position):
+    """[when, id] parsed into the types the source's columns hold"""
+    when, pk = position
+    try:
+        when = parse_date(when) if name in DATE_SOURCES else parse_datetime(when)
+        pk = uuid.UUID(pk)
+    except (TypeError, ValueError, AttributeError):
+        raise InvalidCursor('Invalid cursor')
+    if when is None:
+        raise InvalidCursor('Invalid cursor')
+    return [when, pk]
+
+
+def decode_cursor(encoded):
+    """{source: [when, id] | EXHAUSTED} from a cursor token"""
+    if not encoded:
+        return {}
+    try:
+        positions = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError, binascii.Error):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(positions, dict) or not set(positions) <= set(SOURCES):
+        raise InvalidCursor('Invalid cursor')
+    for name, position in positions.items():
+        if position == EXHAUSTED:
+            continue
+        if not (isinstance(position, list) and len(position) == 2):
+            raise InvalidCursor('Invalid cursor')
+        positions[name] = _position(name, position)
+    return positions
+
+
+def _dump_position(when, pk):
+    return [when.isoformat(), str(pk)]
+
+
+def encode_cursor(positions):
+    return b64encode(json.dumps(positions).encode('utf-8')).decode('ascii')
+
+
+def _sort_key(when):
+    """Dates and datetimes on one scale: a date sorts as the start of its day"""
+    if isinstance(when, datetime):
+        return when if timezone.is_aware(when) else timezone.make_aware(when)
+    return timezone.make_aware(datetime.combine(when, time.min))
+
+
+def _fetch(name, patient, position, limit):
+    """Up to `limit` rows of one stream, newest first, after `position`"""
+    parts = SOURCES[name](patient)
+    if position is not None:
+        when, pk = position
+        after = Q(when__lt=when) | Q(when=when, id__lt=pk)
+        parts = [part.filter(after) for part in parts]
+    queryset = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+    return list(queryset.order_by('-when', '-id')[:limit])
+
+
+def _events(name, rows):
+    for row in rows:
+        yield (_sort_key(row['when']), name, str(row['id'])), row
+
+
+def _serialize(name, row):
+    event = {'type': name, 'id': str(row['id']), 'date': row['when'].isoformat()}
+    event.update({field: value for field, value in row.items() if field not in ('id', 'when')})
+    return event
+
+
+def page(patient, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    (events, next cursor or None) for one page of a patient's timeline,
+    newest first. Raises InvalidCursor for a malformed cursor.
+    """
+    positions = decode_cursor(cursor)
+    fetched = {}
+    for name in SOURCES:
+        position = positions.get(name)
+        if position == EXHAUSTED:
+            continue
+        fetched[name] = _fetch(name, patient, position, page_size + 1)
+
+    streams = [_events(name, rows) for name, rows in fetched.items()]
+    merged = heapq.merge(*streams, key=lambda event: event[0], reverse=True)
+
+    events, consumed = [], {}
+    for (_, name, _), row in merged:
+        if len(events) == page_size:
+            break
+        consumed[name] = consumed.get(name, 0) + 1
+        events.append(_serialize(name, row))
+
+    next_positions = {
+        name: position if position == EXHAUSTED else _dump_position(*position)
+        for name, position in positions.items()
+    }
+    has_next = False
+    for name, rows in fetched.items():
+        taken = consumed.get(name, 0)
+        if taken < len(rows):
+            has_next = True
+        elif len(rows) <= page_size:
+            next_positions[name] = EXHAUSTED
+            continue
+        if taken:
+            last = rows[taken - 1]
+            next_positions[name] = _dump_position(last['when'], last['id'])
+
+    return events, encode_cursor(next_positions) if has_next else None
+
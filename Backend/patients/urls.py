@@ -9,7 +9,10 @@ router = DefaultRouter()
 router.register(r'patients', views.PatientViewSet)
 router.register(r'visits', views.PatientVisitViewSet)
 router.register(r'alerts', views.AppointmentAlertViewSet, basename='alert')
+router.register(r'alerts-archive', views.AppointmentAlertArchiveViewSet, basename='alert-archive')
 router.register(r'alert-config', views.AlertConfigurationViewSet, basename='alert-config')
+router.register(r'patient-imports', views.PatientImportViewSet)
+router.register(r'patient-archives', views.PatientArchiveViewSet)
 
 urlpatterns = [
     path('api/', include(router.urls)),
@@ -1,23 +1,59 @@
 """
 API views for PreciseOptics Eye Hospital Management System - Patients
 """
+import uuid
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date
 from django.utils import timezone
-from django.db import models
-from .models import Patient, PatientVisit, AppointmentAlert, AlertConfiguration
+from precise_optics.fieldsets import SparseFieldsetsMixin
+from .models import (
+    Patient, PatientVisit, AppointmentAlert, AppointmentAlertArchive, AlertConfiguration, PatientImport,
+    PatientArchive
+)
 from .serializers import (
     PatientSerializer, PatientVisitSerializer, PatientCreateSerializer,
     AppointmentAlertSerializer, AppointmentAlertListSerializer,
-    AppointmentAlertCreateSerializer, AlertConfigurationSerializer
+    AppointmentAlertCreateSerializer, AppointmentAlertArchiveSerializer,
+    AlertConfigurationSerializer, PatientImportSerializer, PatientArchiveSerializer
 )
 from .alert_service import AlertService
-from audit.utils import PatientAccessLoggingMixin
+from . import alert_feed, chart, cold_storage, duplicates, importer, schedule, search_index, timeline
+from .merge import merge_patients
+from audit.utils import PatientAccessLoggingMixin, ACCESS_VIEW_HISTORY, _get_client_ip, log_patient_access
+
+
+def _etag_matches(request, etag):
+    """Whether If-None-Match holds `etag` (weak or strong)"""
+    client_etags = [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]
+    return etag in client_etags
+
+
+def _parse_date_param(value):
+    """date from a YYYY-MM-DD query param, or None if missing or malformed"""
+    try:
+        return parse_date(value) if value else None
+    except ValueError:
+        return None
+
 
+def _parse_doctor_param(request):
+    """Primary doctor UUID from ?doctor=, or None; raises ValueError if malformed"""
+    value = request.query_params.get('doctor')
+    return uuid.UUID(value) if value else None
 
-class PatientViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
+
+class PatientViewSet(SparseFieldsetsMixin, PatientAccessLoggingMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing patients
     """
@@ -37,18 +73,153 @@ class PatientViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
         """Filter patients based on user permissions"""
         queryset = Patient.objects.select_related('registered_by').prefetch_related('visits')
         
-        # Add filters for search
+        # Add filters for search (prefix matches on the search token index)
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                models.Q(first_name__icontains=search) |
-                models.Q(last_name__icontains=search) |
-                models.Q(patient_id__icontains=search) |
-                models.Q(phone_number__icontains=search)
-            )
+            queryset = queryset.filter(id__in=search_index.matching_patient_ids(search))
         
         return queryset.order_by('-created_at')
     
+    @action(detail=False, methods=['get'], url_path='possible-duplicates')
+    def possible_duplicates(self, request):
+        """
+        Existing patients who may be the same person as a registration
+        Query params: patient (check an existing patient) or first_name,
+        last_name, date_of_birth (YYYY-MM-DD), phone_number, alternate_phone,
+        nhs_number, postal_code; min_score (default 40)
+        """
+        params = request.query_params
+        try:
+            min_score = int(params.get('min_score', duplicates.DEFAULT_MIN_SCORE))
+        except ValueError:
+            return Response({'error': 'min_score must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if params.get('patient'):
+            try:
+                patient = Patient.objects.get(pk=params['patient'])
+            except (Patient.DoesNotExist, ValidationError):
+                return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            date_of_birth = None
+            if params.get('date_of_birth'):
+                try:
+                    date_of_birth = parse_date(params['date_of_birth'])
+                except ValueError:
+                    date_of_birth = None
+                if date_of_birth is None:
+                    return Response(
+                        {'error': 'date_of_birth must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST
+                    )
+            patient = Patient(
+                first_name=params.get('first_name', ''),
+                last_name=params.get('last_name', ''),
+                date_of_birth=date_of_birth,
+                phone_number=params.get('phone_number', ''),
+                alternate_phone=params.get('alternate_phone', ''),
+                nhs_number=params.get('nhs_number', ''),
+                postal_code=params.get('postal_code', ''),
+            )
+        
+        results = []
+        for candidate, score, reasons in duplicates.possible_duplicates(patient, min_score):
+            data = PatientSerializer(candidate).data
+            data['duplicate_score'] = score
+            data['match_reasons'] = reasons
+            results.append(data)
+        return Response({'count': len(results), 'results': results})
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked prefix search over names (including sound-alike spellings),
+        phone numbers, NHS number and patient ID
+        Query params: q, limit (default 20, max 100)
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', search_index.DEFAULT_LIMIT)), search_index.MAX_LIMIT)
+        except (TypeError, ValueError):
+            limit = search_index.DEFAULT_LIMIT
+        
+        ranked = search_index.ranked_patient_ids(request.query_params.get('q', ''), max(limit, 1))
+        patients = Patient.objects.in_bulk([patient_id for patient_id, _ in ranked])
+        
+        results = []
+        for patient_id, score in ranked:
+            data = PatientSerializer(patients[patient_id]).data
+            data['search_score'] = score
+            results.append(data)
+        return Response({'count': len(results), 'results': results})
+    
+    @action(detail=True, methods=['get'])
+    def chart(self, request, pk=None):
+        """
+        Everything on the patient records page in one response: demographics,
+        recent visits, latest eye test results, active prescriptions,
+        conditions and protocols, and recent treatments
+        Answers 304 Not Modified when If-None-Match holds the current ETag
+        """
+        patient = self.get_object()
+        log_patient_access(request, patient, ACCESS_VIEW_HISTORY, 'Patient chart viewed')
+        
+        etag = chart.version(patient)
+        if _etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(chart.build_chart(patient), headers={'ETag': etag})
+    
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+        Visits, consultations, eye tests, prescriptions, treatments, condition
+        progress and referrals in one feed, newest first
+        Query params: page_size (default 50, max 200), cursor (from `next`)
+        """
+        patient = self.get_object()
+        try:
+            page_size = int(request.query_params.get('page_size', timeline.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            page_size = timeline.DEFAULT_PAGE_SIZE
+        page_size = max(1, min(page_size, timeline.MAX_PAGE_SIZE))
+    
+        try:
+            events, cursor = timeline.page(patient, request.query_params.get('cursor'), page_size)
+        except timeline.InvalidCursor as exc:
+            raise NotFound(str(exc))
+        log_patient_access(request, patient, ACCESS_VIEW_HISTORY, 'Patient timeline viewed')
+    
+        next_url = None
+        if cursor:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+        return Response({'next': next_url, 'page_size': page_size, 'results': events})
+    
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def merge(self, request, pk=None):
+        """
+        Merge a duplicate record into this patient: every record pointing at
+        the duplicate is moved here and the duplicate is deactivated
+        Body: duplicate (patient id), dry_run (report row counts only)
+        """
+        survivor = self.get_object()
+        try:
+            duplicate = Patient.objects.get(pk=request.data.get('duplicate'))
+        except (Patient.DoesNotExist, ValidationError):
+            return Response({'error': 'Duplicate patient not found'}, status=status.HTTP_400_BAD_REQUEST)
+        if duplicate.pk == survivor.pk:
+            return Response({'error': 'A patient cannot be merged into itself'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('true', '1')
+        try:
+            report = merge_patients(
+                survivor, duplicate, user=request.user, ip_address=_get_client_ip(request), dry_run=dry_run
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'survivor': survivor.patient_id,
+            'duplicate': duplicate.patient_id,
+            'dry_run': dry_run,
+            **report,
+        })
+    
     @action(detail=True, methods=['get'])
     def medical_history(self, request, pk=None):
         """Get patient's medical history"""
@@ -79,7 +250,7 @@ class PatientViewSet(PatientAccessLoggingMixin, viewsets.ModelViewSet):
         } for visit in upcoming_visits])
 
 
-class PatientVisitViewSet(viewsets.ModelViewSet):
+class PatientVisitViewSet(SparseFieldsetsMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing patient visits
     """
@@ -110,10 +281,19 @@ class PatientVisitViewSet(viewsets.ModelViewSet):
         date_from = self.request.query_params.get('date_from', None)
         date_to = self.request.query_params.get('date_to', None)
 
+        # As scheduled_date ranges so the schedule index is used
         if date_from:
-            queryset = queryset.filter(scheduled_date__date__gte=date_from)
+            first = _parse_date_param(date_from)
+            if first:
+                queryset = queryset.filter(scheduled_date__gte=schedule.day_bounds(first, first)[0])
+            else:
+                queryset = queryset.filter(scheduled_date__date__gte=date_from)
         if date_to:
-            queryset = queryset.filter(scheduled_date__date__lte=date_to)
+            last = _parse_date_param(date_to)
+            if last:
+                queryset = queryset.filter(scheduled_date__lt=schedule.day_bounds(last, last)[1])
+            else:
+                queryset = queryset.filter(scheduled_date__date__lte=date_to)
 
         # Filter by doctor
         doctor_id = self.request.query_params.get('doctor', None)
@@ -148,22 +328,54 @@ class PatientVisitViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def today_schedule(self, request):
-        """Get today's appointment schedule"""
-        today = timezone.now().date()
-        
-        visits = PatientVisit.objects.filter(
-            scheduled_date__date=today
-        ).select_related('patient', 'primary_doctor').order_by('scheduled_date')
+        """
+        Get today's appointment schedule
+        Query params: doctor (primary doctor id)
+        Answers 304 Not Modified when If-None-Match holds the current ETag
+        """
+        try:
+            doctor_id = _parse_doctor_param(request)
+        except ValueError:
+            return Response({'error': 'doctor must be a user id'}, status=status.HTTP_400_BAD_REQUEST)
+        day = schedule.get_day(timezone.localdate(), doctor_id)
+        if _etag_matches(request, day['etag']):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': day['etag']})
+        return Response(day['visits'], headers={'ETag': day['etag']})
+    
+    @action(detail=False, methods=['get'], url_path='schedule')
+    def day_schedule(self, request):
+        """
+        Appointment schedules for a day or a range of days (at most 31)
+        Query params: date, or date_from and date_to (YYYY-MM-DD, default
+        today); doctor (primary doctor id)
+        Answers 304 Not Modified when If-None-Match holds the current ETag
+        """
+        params = request.query_params
+        today = timezone.localdate()
+        first = _parse_date_param(params.get('date_from') or params.get('date')) or today
+        last = _parse_date_param(params.get('date_to') or params.get('date')) or first
+        for name in ('date', 'date_from', 'date_to'):
+            if params.get(name) and not _parse_date_param(params[name]):
+                return Response({'error': f'{name} must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            doctor_id = _parse_doctor_param(request)
+        except ValueError:
+            return Response({'error': 'doctor must be a user id'}, status=status.HTTP_400_BAD_REQUEST)
+        if last < first or (last - first).days >= schedule.MAX_RANGE_DAYS:
+            return Response(
+                {'error': f'date_to must be on or after date_from and within {schedule.MAX_RANGE_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response([{
-            'id': str(visit.id),
-            'patient_name': visit.patient.get_full_name(),
-            'patient_id': visit.patient.patient_id,
-            'scheduled_time': visit.scheduled_date.strftime('%H:%M'),
-            'visit_type': visit.get_visit_type_display(),
-            'status': visit.get_status_display(),
-            'doctor': visit.primary_doctor.get_full_name() if visit.primary_doctor else 'Not assigned'
-        } for visit in visits])
+        days = schedule.get_days(first, last, doctor_id)
+        etag = schedule.range_etag(days.values())
+        if _etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response({
+            'date_from': first,
+            'date_to': last,
+            'days': [{'date': day, 'visits': cached['visits']} for day, cached in days.items()],
+        }, headers={'ETag': etag})
 
 
 class AppointmentAlertViewSet(viewsets.ModelViewSet):
@@ -269,6 +481,42 @@ class AppointmentAlertViewSet(viewsets.ModelViewSet):
         else:
             return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(
+        detail=False,
+        methods=['get'],
+        renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [alert_feed.EventStreamRenderer]
+    )
+    def changes(self, request):
+        """
+        Alert changes after a sequence number.
+        ?since=<seq>  last sequence seen (omit to get the current head only)
+        ?limit=<n>    max changes per response (default/max 500)
+        ?wait=<sec>   long-poll up to this many seconds (max 25) when nothing is new
+        EventSource clients (Accept: text/event-stream) get Server-Sent Events
+        and may resume with the Last-Event-ID header.
+        """
+        since = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('since')
+        try:
+            limit = int(request.query_params.get('limit', alert_feed.MAX_CHANGES))
+            wait = float(request.query_params.get('wait', 0))
+            since = int(since) if since is not None else None
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'since, limit and wait must be numbers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, alert_feed.MAX_CHANGES))
+        wait = max(0, min(wait, alert_feed.MAX_WAIT_SECONDS))
+        
+        if since is None:
+            # Bootstrap: client loads the alert list, then follows from here
+            return Response(alert_feed.empty_payload(alert_feed.latest_sequence()))
+        
+        if request.accepted_renderer.media_type == alert_feed.EventStreamRenderer.media_type:
+            return alert_feed.event_stream_response(request._request, since, limit)
+        
+        return Response(alert_feed.wait_for_changes(since, limit, wait))
+    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """Get alert statistics"""
@@ -307,6 +555,47 @@ class AppointmentAlertViewSet(viewsets.ModelViewSet):
         })
 
 
+class AppointmentAlertArchiveViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only access to archived (old resolved/dismissed) alerts
+    """
+    queryset = AppointmentAlertArchive.objects.all()
+    serializer_class = AppointmentAlertArchiveSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        """Filter archived alerts based on query parameters"""
+        queryset = AppointmentAlertArchive.objects.select_related(
+            'patient', 'acknowledged_by', 'resolved_by'
+        )
+        
+        # Filter by patient
+        patient_id = self.request.query_params.get('patient', None)
+        if patient_id:
+            queryset = queryset.filter(patient_id=patient_id)
+        
+        # Filter by status
+        status_filter = self.request.query_params.get('status', None)
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        
+        # Filter by alert type
+        alert_type = self.request.query_params.get('alert_type', None)
+        if alert_type:
+            queryset = queryset.filter(alert_type=alert_type)
+        
+        # Filter by date range
+        date_from = self.request.query_params.get('date_from', None)
+        if date_from:
+            queryset = queryset.filter(trigger_time__gte=date_from)
+        
+        date_to = self.request.query_params.get('date_to', None)
+        if date_to:
+            queryset = queryset.filter(trigger_time__lte=date_to)
+        
+        return queryset.order_by('-trigger_time')
+
+
 class AlertConfigurationViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing alert configuration
@@ -343,3 +632,110 @@ class AlertConfigurationViewSet(viewsets.ModelViewSet):
         })
 
 
+class PatientImportViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Bulk patient imports: upload a CSV or NDJSON file to register its
+    patients in chunks, follow progress, download the rejected rows and
+    resume an interrupted import
+    """
+    queryset = PatientImport.objects.all()
+    serializer_class = PatientImportSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def create(self, request):
+        """
+        Upload and import a file of at most importer.MAX_REQUEST_ROWS rows
+        (the import runs within the request; use the import_patients command
+        for larger files)
+        Form fields: file, format (csv|ndjson, default from the file name),
+        chunk_size (default 500, max 5000)
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the patients as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            source_format = request.data.get('format') or importer.detect_format(upload.name)
+            chunk_size = int(request.data.get('chunk_size', importer.DEFAULT_CHUNK_SIZE))
+        except (TypeError, ValueError) as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if source_format not in dict(PatientImport.FORMAT_CHOICES):
+            return Response({'error': 'format must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= chunk_size <= importer.MAX_CHUNK_SIZE:
+            return Response(
+                {'error': f'chunk_size must be between 1 and {importer.MAX_CHUNK_SIZE}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        name = default_storage.save(f'patient_imports/{upload.name}', upload)
+        path = default_storage.path(name)
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            too_large = importer.count_rows(stream, source_format) > importer.MAX_REQUEST_ROWS
+        if too_large:
+            default_storage.delete(name)
+            return Response(
+                {'error': f'Files of more than {importer.MAX_REQUEST_ROWS} rows are imported with '
+                          f'"python manage.py import_patients"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        patient_import = PatientImport.objects.create(
+            source=path,
+            source_format=source_format,
+            chunk_size=chunk_size,
+            started_by=request.user,
+        )
+        importer.run_file(patient_import)
+        return Response(self.get_serializer(patient_import).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """Continue an interrupted or failed import after its last committed chunk"""
+        patient_import = self.get_object()
+        if patient_import.status == 'completed':
+            return Response({'error': 'Import has already completed'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            importer.run_file(patient_import)
+        except importer.ImportInProgress as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(patient_import).data)
+    
+    @action(detail=True, methods=['get'])
+    def errors(self, request, pk=None):
+        """Rejected rows as CSV: row, field, message"""
+        patient_import = self.get_object()
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="patient-import-{patient_import.pk}-errors.csv"'
+        importer.write_error_report(patient_import, response)
+        return response
+
+
+class PatientArchiveViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Inactive patients whose clinical history is in cold storage; restoring
+    one puts the history back into the live tables
+    """
+    queryset = PatientArchive.objects.all()
+    serializer_class = PatientArchiveSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        """Filter archives by patient ID or name"""
+        queryset = PatientArchive.objects.select_related('patient')
+        search = self.request.query_params.get('search', None)
+        if search:
+            queryset = queryset.filter(
+                Q(patient__patient_id__iexact=search) |
+                Q(patient__last_name__istartswith=search) |
+                Q(patient__first_name__istartswith=search)
+            )
+        return queryset.order_by('-archived_at')
+    
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def restore(self, request, pk=None):
+        """Move the archived history back into the live tables"""
+        archive = self.get_object()
+        patient = archive.patient
+        try:
+            restored = cold_storage.restore_patient(archive, user=request.user, ip_address=_get_client_ip(request))
+        except cold_storage.ArchiveError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response({'patient': str(patient.pk), 'patient_id': patient.patient_id, 'restored': restored})
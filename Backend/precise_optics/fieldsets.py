@@ -0,0 +1,184 @@
+"""
+Sparse fieldsets and expansion control for API views.
+
+Views that include SparseFieldsetsMixin accept:
+
+    ?fields=id,patient_name,items.dosage   render only these fields
+    ?omit=doctor_notes,items               render everything except these
+    ?expand=protocol_details               include fields the serializer lists in
+                                           Meta.expandable_fields (off by default)
+
+Dotted names reach into nested serializers. Fields are pruned before
+serialization, and when ?fields or ?omit is given the queryset's prefetches
+are rebuilt from the fields that are left: reverse and many-to-many
+relations those fields use are prefetched and the view's other prefetches
+are dropped. The view's select_related joins are kept (they cost no extra
+query, and SerializerMethodFields rely on them) and the forward foreign keys
+of nested serializers are joined on top. SerializerMethodFields that read
+reverse relations declare them in Meta.field_relations, e.g.
+{'total_items': ['items']}.
+
+Usage:
+    GET /api/prescriptions/?fields=id,prescription_number,patient_name
+    GET /api/treatments/42/?omit=documents,complications
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def requested(request, param):
+    """Comma-separated names from a query parameter, as a list"""
+    if request is None:
+        return []
+    value = request.query_params.get(param, '')
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def _tree(names):
+    """{'id': {}, 'items': {'dosage': {}}} from ['id', 'items.dosage']"""
+    tree = {}
+    for name in names:
+        node = tree
+        for part in name.split('.'):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def nested_serializer(field):
+    """The serializer rendering a nested field, or None for plain fields"""
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    return field if isinstance(field, serializers.Serializer) else None
+
+
+def is_sparse(request):
+    return bool(requested(request, 'fields') or requested(request, 'omit'))
+
+
+def prune(serializer, only=None, omit=None, expand=None):
+    """
+    Remove fields from a serializer (and its nested serializers) in place.
+    `only`, `omit` and `expand` are trees as built by _tree(); only=None keeps
+    every field.
+    """
+    omit = omit or {}
+    expand = expand or {}
+    expandable = getattr(getattr(serializer, 'Meta', None), 'expandable_fields', ())
+
+    for name in list(serializer.fields):
+        if name in expandable and name not in expand:
+            serializer.fields.pop(name)
+        elif only is not None and name not in only:
+            serializer.fields.pop(name)
+        elif name in omit and not omit[name]:
+            serializer.fields.pop(name)
+        else:
+            nested = nested_serializer(serializer.fields[name])
+            if nested is not None:
+                prune(nested, (only or {}).get(name) or None, omit.get(name), expand.get(name))
+
+
+def apply(serializer, request):
+    """Prune a (possibly many=True) serializer according to the request"""
+    target = nested_serializer(serializer)
+    if target is None:
+        return serializer
+    only = requested(request, 'fields')
+    prune(
+        target,
+        _tree(only) if only else None,
+        _tree(requested(request, 'omit')),
+        _tree(requested(request, 'expand')),
+    )
+    return serializer
+
+
+def _walk(model, attrs, prefix, in_prefetch, select, prefetch):
+    """
+    Follow a field source through model relations, recording the relation
+    paths it crosses. Returns (model, path, in_prefetch) at the point the
+    source leaves the relations, e.g. at a plain column or method.
+    """
+    path = prefix
+    for attr in attrs:
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or field.related_model is None:
+            break
+        path = f'{path}__{attr}' if path else attr
+        if field.many_to_many or field.one_to_many:
+            in_prefetch = True
+        (prefetch if in_prefetch else select).add(path)
+        model = field.related_model
+    return model, path, in_prefetch
+
+
+def relations(serializer, model, prefix='', in_prefetch=False, select=None, prefetch=None):
+    """(select_related paths, prefetch_related lookups) needed to render a serializer"""
+    select = set() if select is None else select
+    prefetch = set() if prefetch is None else prefetch
+    hints = getattr(getattr(serializer, 'Meta', None), 'field_relations', {})
+
+    for name, field in serializer.fields.items():
+        for hint in hints.get(name, ()):
+            if isinstance(hint, Prefetch):
+                if not prefix:
+                    prefetch.add(hint)
+            else:
+                _walk(model, hint.split('__'), prefix, in_prefetch, select, prefetch)
+
+        attrs = [] if field.source == '*' else field.source.split('.')
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and len(attrs) == 1:
+            # Rendered from the <fk>_id column, no join needed
+            continue
+        field_model, path, field_in_prefetch = _walk(model, attrs, prefix, in_prefetch, select, prefetch)
+
+        nested = nested_serializer(field)
+        if nested is not None and getattr(getattr(nested, 'Meta', None), 'model', None) is field_model:
+            relations(nested, field_model, path, field_in_prefetch, select, prefetch)
+    return select, prefetch
+
+
+def optimize_queryset(queryset, serializer):
+    """
+    Replace a queryset's prefetches with those the serializer needs and add
+    the joins it needs to the ones already selected
+    """
+    target = nested_serializer(serializer)
+    if target is None:
+        return queryset
+    select, prefetch = relations(target, queryset.model)
+    # A hinted Prefetch object replaces the plain lookup for the same relation
+    custom = {lookup.prefetch_to for lookup in prefetch if isinstance(lookup, Prefetch)}
+    prefetch = {lookup for lookup in prefetch if isinstance(lookup, Prefetch) or lookup not in custom}
+    queryset = queryset.prefetch_related(None)
+    if select:
+        queryset = queryset.select_related(*sorted(select))
+    if prefetch:
+        queryset = queryset.prefetch_related(*sorted(prefetch, key=str))
+    return queryset
+
+
+class SparseFieldsetsMixin:
+    """
+    View mixin applying ?fields, ?omit and ?expand to read requests, and
+    deriving prefetch_related from the rendered fields when ?fields or ?omit
+    narrows them
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.request.method in SAFE_METHODS:
+            apply(serializer, self.request)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        # filter_queryset rather than get_queryset, which views override
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS and is_sparse(self.request):
+            queryset = optimize_queryset(queryset, self.get_serializer())
+        return queryset
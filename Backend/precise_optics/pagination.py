@@ -1,5 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+import json
+from base64 import b64decode, b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class StandardResultsPagination(PageNumberPagination):
@@ -38,3 +46,97 @@ class StandardResultsPagination(PageNumberPagination):
                 'results': schema,
             },
         }
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a (field, id) keyset for large, append-mostly feeds.
+
+    Each page is a single indexed range scan (``WHERE (field, id) > cursor``)
+    however deep the client pages, and no COUNT query is run. Subclasses set
+    ``ordering_field``, which must be a non-null column (NULLs cannot be
+    compared in the range condition); ``descending`` walks the feed newest
+    first.
+
+    Usage:
+        GET /api/protocols/completions/overdue/?page_size=50
+        GET /api/protocols/completions/overdue/?cursor=<next cursor>
+    """
+
+    ordering_field = None
+    descending = False
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeDecodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def clean_cursor(self, queryset, cursor):
+        """Cursor values converted to the keyset columns' types; NotFound if they do not fit"""
+        value, pk = cursor
+        opts = queryset.model._meta
+        try:
+            value = opts.get_field(self.ordering_field).to_python(value)
+            pk = opts.pk.to_python(pk)
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def encode_cursor(self, item):
+        value = getattr(item, self.ordering_field)
+        position = [value.isoformat(), str(item.pk)]
+        encoded = b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size_value = self.get_page_size(request)
+
+        field = self.ordering_field
+        direction = 'lt' if self.descending else 'gt'
+        prefix = '-' if self.descending else ''
+        queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}pk')
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, pk = self.clean_cursor(queryset, cursor)
+            queryset = queryset.filter(
+                Q(**{f'{field}__{direction}': value}) | Q(**{field: value, f'pk__{direction}': pk})
+            )
+
+        results = list(queryset[:self.page_size_value + 1])
+        self.has_next = len(results) > self.page_size_value
+        self.page = results[:self.page_size_value]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'page_size': self.page_size_value,
+            'results': data,
+        })
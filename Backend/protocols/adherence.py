@@ -0,0 +1,160 @@
+"""
+Protocol adherence counters for PreciseOptics.
+
+Each PatientProtocol keeps running counts of its step completions
+(step_completion_count, total_steps_completed, on_time_step_count). Every
+completion insert, status/compliance change or deletion applies +1/-1
+deltas to its parent in the same transaction and re-derives
+adherence_percentage from the counters, so reports never read stale values.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import PatientProtocol, ProtocolStepCompletion
+from . import statistics
+
+# ProtocolStepCompletion fields the counters depend on
+TRACKED_FIELDS = ('patient_protocol_id', 'status', 'completed_within_window')
+
+COUNTER_FIELDS = ('step_completion_count', 'total_steps_completed', 'on_time_step_count')
+
+DEFAULT_BATCH_SIZE = 500
+
+PERCENTAGE = DecimalField(max_digits=5, decimal_places=2)
+
+
+def counter_values(values):
+    """Counter contributions of one completion, from a dict of TRACKED_FIELDS"""
+    return {
+        'step_completion_count': 1,
+        'total_steps_completed': 1 if values['status'] == 'completed' else 0,
+        'on_time_step_count': 1 if values['completed_within_window'] else 0,
+    }
+
+
+def tracked_values(completion):
+    return {name: getattr(completion, name) for name in TRACKED_FIELDS}
+
+
+def adherence_expression():
+    """adherence_percentage derived from the counters inside the UPDATE"""
+    return Case(
+        When(
+            step_completion_count__gt=0,
+            then=Cast(F('on_time_step_count') * Value(100.0) / F('step_completion_count'), PERCENTAGE)
+        ),
+        default=Value(Decimal('0.00')),
+        output_field=PERCENTAGE,
+    )
+
+
+def adherence_percentage(on_time, total):
+    """Python equivalent of adherence_expression()"""
+    if not total:
+        return Decimal('0.00')
+    return (Decimal(on_time) * 100 / Decimal(total)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def apply_deltas(deltas):
+    """Add signed counter deltas ({patient_protocol_id: Counter}) and refresh adherence"""
+    deltas = {pk: delta for pk, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    # Protocols moved by the same amounts (a cohort assignment) share one UPDATE
+    groups = defaultdict(list)
+    for pk, delta in deltas.items():
+        groups[tuple(delta[name] for name in COUNTER_FIELDS)].append(pk)
+
+    with transaction.atomic():
+        for amounts, pks in groups.items():
+            PatientProtocol.objects.filter(id__in=pks).update(**{
+                name: F(name) + amount for name, amount in zip(COUNTER_FIELDS, amounts) if amount
+            })
+        # updated_at is set by hand since update() skips auto_now; chart
+        # ETags are built from it
+        PatientProtocol.objects.filter(id__in=deltas.keys()).update(
+            adherence_percentage=adherence_expression(), updated_at=timezone.now()
+        )
+        statistics.invalidate()
+
+
+def record_changes(changes):
+    """
+    Apply completion changes to their protocols' counters. `changes` is an
+    iterable of (before, after) TRACKED_FIELDS dicts; use None for an insert
+    or a delete.
+    """
+    deltas = defaultdict(Counter)
+    for before, after in changes:
+        if before:
+            for name, value in counter_values(before).items():
+                deltas[before['patient_protocol_id']][name] -= value
+        if after:
+            for name, value in counter_values(after).items():
+                deltas[after['patient_protocol_id']][name] += value
+    apply_deltas(deltas)
+
+
+def record_created(completions):
+    """Count completions written with bulk_create (which skips signals)"""
+    record_changes((None, tracked_values(completion)) for completion in completions)
+
+
+def compute_counters(patient_protocol_ids):
+    """Recount the counters for the given protocols with one GROUP BY"""
+    rows = (
+        ProtocolStepCompletion.objects.filter(patient_protocol_id__in=patient_protocol_ids)
+        .order_by()
+        .values('patient_protocol_id')
+        .annotate(
+            step_completion_count=Count('id'),
+            total_steps_completed=Count('id', filter=Q(status='completed')),
+            on_time_step_count=Count('id', filter=Q(completed_within_window=True)),
+        )
+    )
+    counters = {pk: dict.fromkeys(COUNTER_FIELDS, 0) for pk in patient_protocol_ids}
+    for row in rows:
+        counters[row.pop('patient_protocol_id')] = row
+    return counters
+
+
+def recompute(batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Rebuild the counters and adherence of every patient protocol in batches.
+    Returns the number of protocols whose stored values were out of date.
+    """
+    changed_total = 0
+    last_id = None
+    while True:
+        batch = PatientProtocol.objects.order_by('id')
+        if last_id is not None:
+            batch = batch.filter(id__gt=last_id)
+        batch = list(batch.only('id', 'adherence_percentage', *COUNTER_FIELDS)[:batch_size])
+        if not batch:
+            return changed_total
+        last_id = batch[-1].id
+
+        with transaction.atomic():
+            counters = compute_counters([patient_protocol.id for patient_protocol in batch])
+            changed = []
+            for patient_protocol in batch:
+                values = counters[patient_protocol.id]
+                values['adherence_percentage'] = adherence_percentage(
+                    values['on_time_step_count'], values['step_completion_count']
+                )
+                if any(getattr(patient_protocol, name) != value for name, value in values.items()):
+                    for name, value in values.items():
+                        setattr(patient_protocol, name, value)
+                    changed.append(patient_protocol)
+            if changed and not dry_run:
+                PatientProtocol.objects.bulk_update(
+                    changed, [*COUNTER_FIELDS, 'adherence_percentage'], batch_size=batch_size
+                )
+                statistics.invalidate()
+        changed_total += len(changed)
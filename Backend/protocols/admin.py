@@ -127,7 +127,10 @@ class PatientProtocolAdmin(admin.ModelAdmin):
     list_display = ['patient', 'protocol', 'status', 'start_date', 'expected_end_date', 'adherence_percentage']
     list_filter = ['status', 'protocol__condition', 'start_date', 'assigned_date']
     search_fields = ['patient__first_name', 'patient__last_name', 'patient__patient_id', 'protocol__name']
-    readonly_fields = ['assigned_date', 'created_at', 'updated_at', 'adherence_percentage']
+    readonly_fields = [
+        'assigned_date', 'created_at', 'updated_at', 'step_completion_count',
+        'total_steps_completed', 'on_time_step_count', 'adherence_percentage'
+    ]
     date_hierarchy = 'start_date'
     
     fieldsets = (
@@ -157,7 +160,8 @@ class PatientProtocolAdmin(admin.ModelAdmin):
         ('Modifications & Tracking', {
             'fields': (
                 'protocol_modifications', 'current_step_number',
-                'total_steps_completed', 'adherence_percentage'
+                'step_completion_count', 'total_steps_completed',
+                'on_time_step_count', 'adherence_percentage'
             )
         }),
     )
@@ -5,3 +5,7 @@ class ProtocolsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'protocols'
     verbose_name = 'Treatment Protocols'
+    
+    def ready(self):
+        """Import signals when app is ready"""
+        from . import signals  # noqa: F401
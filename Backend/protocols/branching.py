@@ -0,0 +1,158 @@
+"""
+Branch logic evaluation for protocol steps.
+
+A step's branch_logic JSON is validated by the API and ProtocolStep.clean()
+and compiled once into a decision table of typed predicates. Compiled tables
+are cached per (step id, updated_at), so evaluating many results for the
+same step does no JSON walking or operator parsing, and editing a step
+(which bumps updated_at) naturally invalidates its entry. Rows that fail
+validation (saved before it existed) are treated as non-branching.
+"""
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+
+OPERATORS = ('equals', 'greater_than', 'less_than', 'between')
+
+# Compiled tables kept in memory; the cache is simply cleared when full
+MAX_CACHED_STEPS = 1024
+
+Rule = namedtuple('Rule', ['predicate', 'next_step', 'label'])
+DecisionTable = namedtuple('DecisionTable', ['rules', 'default_next_step'])
+
+_cache = {}
+
+
+def _is_number(value):
+    """Numbers and numeric strings ('21'), which rules stored before validation use"""
+    return not isinstance(value, bool) and _to_float(value) is not None
+
+
+def _is_step_number(value):
+    return value is None or (isinstance(value, int) and not isinstance(value, bool) and value > 0)
+
+
+def validate_branch_logic(logic):
+    """Raise ValidationError listing every problem with a branch_logic document"""
+    if logic in (None, {}):
+        return
+    if not isinstance(logic, dict):
+        raise ValidationError('Branch logic must be an object.')
+
+    errors = []
+    conditions = logic.get('conditions', [])
+    if not isinstance(conditions, list):
+        errors.append("'conditions' must be a list.")
+        conditions = []
+    if not _is_step_number(logic.get('default_next_step')):
+        errors.append("'default_next_step' must be a positive step number.")
+
+    for index, condition in enumerate(conditions, start=1):
+        prefix = f'Condition {index}'
+        if not isinstance(condition, dict):
+            errors.append(f'{prefix} must be an object.')
+            continue
+        operator = condition.get('operator', 'equals')
+        value = condition.get('result')
+        if operator not in OPERATORS:
+            errors.append(f"{prefix}: unknown operator '{operator}' (use one of {', '.join(OPERATORS)}).")
+        elif operator == 'equals' and value is None:
+            errors.append(f"{prefix}: 'result' is required.")
+        elif operator in ('greater_than', 'less_than') and not _is_number(value):
+            errors.append(f"{prefix}: '{operator}' needs a numeric 'result'.")
+        elif operator == 'between' and not (
+            isinstance(value, (list, tuple)) and len(value) == 2
+            and all(_is_number(v) for v in value) and _to_float(value[0]) <= _to_float(value[1])
+        ):
+            errors.append(f"{prefix}: 'between' needs 'result' as [min, max] numbers.")
+        if not _is_step_number(condition.get('next_step')):
+            errors.append(f"{prefix}: 'next_step' must be a positive step number.")
+
+    if errors:
+        raise ValidationError(errors)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compile_predicate(operator, expected):
+    """Build a predicate for one condition; non-numeric values never match numeric operators"""
+    if operator == 'equals':
+        expected = str(expected).lower()
+        return lambda value: str(value).lower() == expected
+
+    if operator == 'between':
+        low, high = float(expected[0]), float(expected[1])
+    elif operator == 'greater_than':
+        low, high = float(expected), None
+    else:
+        low, high = None, float(expected)
+
+    def predicate(value):
+        number = _to_float(value)
+        if number is None:
+            return False
+        if operator == 'between':
+            return low <= number <= high
+        if operator == 'greater_than':
+            return number > low
+        return number < high
+    return predicate
+
+
+def compile_branch_logic(logic):
+    """Compile a validated branch_logic document into a DecisionTable"""
+    return DecisionTable(
+        rules=tuple(
+            Rule(
+                predicate=_compile_predicate(condition.get('operator', 'equals'), condition.get('result')),
+                next_step=condition.get('next_step'),
+                label=condition.get('label', ''),
+            )
+            for condition in logic.get('conditions', [])
+        ),
+        default_next_step=logic.get('default_next_step'),
+    )
+
+
+def get_decision_table(step):
+    """Cached DecisionTable for a step, or None if the step does not branch"""
+    if not step.has_branches or not step.branch_logic or 'conditions' not in step.branch_logic:
+        return None
+
+    key = (step.pk, step.updated_at)
+    table = _cache.get(key)
+    if table is None:
+        try:
+            validate_branch_logic(step.branch_logic)
+        except ValidationError:
+            # Rows saved before validation existed; treat them as non-branching
+            return None
+        if len(_cache) >= MAX_CACHED_STEPS:
+            _cache.clear()
+        table = _cache[key] = compile_branch_logic(step.branch_logic)
+    return table
+
+
+def result_value(result):
+    """The value of a ProtocolStepResult that branch conditions compare against"""
+    if result.result_value_choice:
+        return result.result_value_choice
+    if result.result_value_numeric is not None:
+        return float(result.result_value_numeric)
+    if result.meets_criteria is not None:
+        return 'met' if result.meets_criteria else 'not_met'
+    return None
+
+
+def evaluate(table, value):
+    """Return (next_step, matched rule label or None) for a value"""
+    if value is not None:
+        for rule in table.rules:
+            if rule.predicate(value):
+                return rule.next_step, rule.label
+    return table.default_next_step, None
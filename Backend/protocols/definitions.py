@@ -0,0 +1,48 @@
+"""
+Versioned cache of serialized protocol definitions.
+
+TreatmentProtocol.definition_version is bumped whenever the protocol, one of
+its steps or a step's medications, treatments or tests change, so a cached
+serialization keyed by (protocol id, version) is never served after an edit.
+Counts that move with patient assignments are not part of the cached
+definition and are added to it per request; the ETag is a digest of the
+final representation, so it changes with either.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import TreatmentProtocol
+
+CACHE_KEY = 'protocols:definition'
+
+# Bounds how long names from related records (condition, medication, creator)
+# can lag behind, since editing those does not bump the protocol version
+CACHE_TIMEOUT = 60 * 60
+
+
+def cache_key(protocol_id, version):
+    return f'{CACHE_KEY}:{protocol_id}:{version}'
+
+
+def get_or_build(protocol, build):
+    """Cached definition of a protocol at its loaded version; `build` renders it on a miss"""
+    key = cache_key(protocol.pk, protocol.definition_version)
+    definition = cache.get(key)
+    if definition is None:
+        definition = build()
+        cache.set(key, definition, CACHE_TIMEOUT)
+    return definition
+
+
+def bump_version(**filters):
+    """Invalidate cached definitions of the protocols matching `filters`"""
+    TreatmentProtocol.objects.filter(**filters).update(definition_version=F('definition_version') + 1)
+
+
+def etag(data):
+    """Strong ETag for a rendered protocol definition"""
+    digest = hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
@@ -0,0 +1,136 @@
+"""
+Clinic workload forecast for PreciseOptics.
+
+Counts the step occurrences that active protocols will generate per day,
+step type and site over the coming weeks. Occurrences that already exist as
+scheduled ProtocolStepCompletion rows are counted with one GROUP BY; open-ended
+recurring steps (no recurrence_count), which only have their first occurrence
+materialized, are projected forward from their latest scheduled date. The
+site of a protocol is the department of the clinician who assigned it.
+
+Forecasts are cached per day and horizon.
+"""
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+
+from .models import ProtocolStepCompletion
+from .scheduling import ACTIVE_STATUSES
+
+DEFAULT_HORIZON_WEEKS = 12
+MAX_HORIZON_WEEKS = 26
+
+UNASSIGNED_SITE = 'unassigned'
+
+PENDING_STATUSES = ('scheduled', 'rescheduled')
+
+CACHE_KEY = 'protocols:workload-forecast'
+
+SITE_FIELD = 'patient_protocol__assigned_by__staff_profile__department'
+
+
+def _active_completions():
+    return ProtocolStepCompletion.objects.filter(
+        patient_protocol__status__in=ACTIVE_STATUSES
+    ).order_by()
+
+
+def _scheduled_counts(start, end):
+    """Materialized occurrences: {(date, step_type, site): count}"""
+    rows = (
+        _active_completions()
+        .filter(status__in=PENDING_STATUSES, scheduled_date__gte=start, scheduled_date__lte=end)
+        .values('scheduled_date', step_type=F('protocol_step__step_type'), site=F(SITE_FIELD))
+        .annotate(count=Count('id'))
+    )
+    return Counter({
+        (row['scheduled_date'], row['step_type'], row['site'] or UNASSIGNED_SITE): row['count']
+        for row in rows
+    })
+
+
+def _projected_counts(start, end):
+    """Open-ended recurring occurrences not yet materialized: {(date, step_type, site): count}"""
+    rows = (
+        _active_completions()
+        .filter(protocol_step__is_recurring=True, protocol_step__recurrence_count__isnull=True)
+        .values(
+            'patient_protocol_id', 'protocol_step_id',
+            step_type=F('protocol_step__step_type'),
+            timing_type=F('protocol_step__timing_type'),
+            timing_days=F('protocol_step__timing_days'),
+            end_date=F('patient_protocol__expected_end_date'),
+            site=F(SITE_FIELD),
+        )
+        .annotate(last_date=Max('scheduled_date'))
+    )
+    counts = Counter()
+    for row in rows:
+        if row['timing_type'] == 'weekly':
+            interval = 7
+        elif row['timing_type'] == 'monthly':
+            interval = 30
+        else:
+            interval = row['timing_days']
+        if interval <= 0:
+            continue
+
+        last_day = min(end, row['end_date']) if row['end_date'] else end
+        # First projected occurrence on or after the forecast start
+        occurrence = row['last_date'] + timedelta(days=interval)
+        if occurrence < start:
+            occurrence += timedelta(days=-(-(start - occurrence).days // interval) * interval)
+        site = row['site'] or UNASSIGNED_SITE
+        while occurrence <= last_day:
+            counts[(occurrence, row['step_type'], site)] += 1
+            occurrence += timedelta(days=interval)
+    return counts
+
+
+def build_forecast(start, weeks=DEFAULT_HORIZON_WEEKS):
+    """Workload from `start` for `weeks` weeks as a JSON-ready dict"""
+    end = start + timedelta(weeks=weeks) - timedelta(days=1)
+    scheduled = _scheduled_counts(start, end)
+    projected = _projected_counts(start, end)
+
+    rows = []
+    totals = Counter()
+    for key in sorted(scheduled.keys() | projected.keys()):
+        day, step_type, site = key
+        total = scheduled[key] + projected[key]
+        totals[step_type] += total
+        rows.append({
+            'date': day.isoformat(),
+            'step_type': step_type,
+            'site': site,
+            'scheduled': scheduled[key],
+            'projected': projected[key],
+            'total': total,
+        })
+
+    return {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'weeks': weeks,
+        'totals_by_step_type': dict(totals),
+        'rows': rows,
+    }
+
+
+def _seconds_until_midnight():
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), time.min)
+    return max(int((midnight - now).total_seconds()), 60)
+
+
+def get_forecast(weeks=DEFAULT_HORIZON_WEEKS):
+    """Today's forecast, computed at most once per day and horizon"""
+    today = date.today()
+    key = f'{CACHE_KEY}:{today.isoformat()}:{weeks}'
+    forecast = cache.get(key)
+    if forecast is None:
+        forecast = build_forecast(today, weeks)
+        cache.set(key, forecast, _seconds_until_midnight())
+    return forecast
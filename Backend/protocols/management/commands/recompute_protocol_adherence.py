@@ -0,0 +1,44 @@
+"""
+Management command to rebuild patient protocol adherence counters.
+The counters are maintained incrementally; run this after loading fixtures,
+after manual SQL changes to step completions, or periodically as a check.
+
+Usage:
+  python manage.py recompute_protocol_adherence                   # Rebuild counters
+  python manage.py recompute_protocol_adherence --batch-size 1000
+  python manage.py recompute_protocol_adherence --dry-run         # Report drift only
+"""
+from django.core.management.base import BaseCommand
+from protocols import adherence
+
+
+class Command(BaseCommand):
+    help = 'Recount step counters and adherence for every patient protocol'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=adherence.DEFAULT_BATCH_SIZE,
+            help='Patient protocols processed per transaction'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many protocols are out of date without changing them'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        changed = adherence.recompute(batch_size=options['batch_size'], dry_run=dry_run)
+
+        if not changed:
+            self.stdout.write(self.style.SUCCESS('✅ Protocol adherence counters are in sync.'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️  {changed} patient protocol(s) out of sync (dry run, nothing changed).'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ Recomputed adherence; corrected {changed} patient protocol(s).'
+            ))
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:13
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_counters(apps, schema_editor):
+    """Seed the step counters and adherence from the existing completions"""
+    PatientProtocol = apps.get_model('protocols', 'PatientProtocol')
+    ProtocolStepCompletion = apps.get_model('protocols', 'ProtocolStepCompletion')
+
+    rows = (
+        ProtocolStepCompletion.objects.order_by()
+        .values('patient_protocol_id')
+        .annotate(
+            total=Count('id'),
+            completed=Count('id', filter=Q(status='completed')),
+            on_time=Count('id', filter=Q(completed_within_window=True)),
+        )
+    )
+    counters = {row['patient_protocol_id']: row for row in rows}
+
+    patient_protocols = list(PatientProtocol.objects.filter(id__in=counters.keys()))
+    for patient_protocol in patient_protocols:
+        row = counters[patient_protocol.id]
+        patient_protocol.step_completion_count = row['total']
+        patient_protocol.total_steps_completed = row['completed']
+        patient_protocol.on_time_step_count = row['on_time']
+        patient_protocol.adherence_percentage = (
+            Decimal(row['on_time']) * 100 / Decimal(row['total'])
+        ).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    PatientProtocol.objects.bulk_update(
+        patient_protocols,
+        ['step_completion_count', 'total_steps_completed', 'on_time_step_count', 'adherence_percentage'],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocols', '0004_alter_consentform_consent_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientprotocol',
+            name='on_time_step_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of steps completed within their timing window'),
+        ),
+        migrations.AddField(
+            model_name='patientprotocol',
+            name='step_completion_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of scheduled step completions'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocols', '0005_patientprotocol_step_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='protocolstepcompletion',
+            index=models.Index(fields=['status', 'scheduled_date', 'id'], name='protocols_p_status_875331_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='protocolstepcompletion',
+            index=models.Index(fields=['adverse_event', 'scheduled_date', 'id'], name='protocols_p_adverse_59cc24_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocols', '0006_step_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treatmentprotocol',
+            name='definition_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
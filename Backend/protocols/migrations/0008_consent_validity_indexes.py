@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_alertnotification'),
+        ('protocols', '0007_treatmentprotocol_definition_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consentform',
+            index=models.Index(fields=['patient', 'protocol', 'status', 'expiry_date'], name='protocols_c_patient_409e49_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consentform',
+            index=models.Index(fields=['status', 'expiry_date'], name='protocols_c_status_bf4ac8_idx'),
+        ),
+    ]
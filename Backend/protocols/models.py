@@ -2,7 +2,8 @@
 Treatment Protocol models for PreciseOptics Eye Hospital Management System
 Manages treatment protocols, automated scheduling, and consent tracking
 """
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from datetime import timedelta
@@ -11,6 +12,7 @@ from accounts.models import CustomUser
 from precise_optics.file_validators import validate_document_extension, validate_file_size
 from conditions.models import MedicalCondition
 from medications.models import Medication
+from . import branching
 import uuid
 
 
@@ -81,6 +83,9 @@ class TreatmentProtocol(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Bumped on any change to the protocol or its steps; keys cached serializations
+    definition_version = models.PositiveIntegerField(default=1, editable=False)
+    
     class Meta:
         verbose_name = "Treatment Protocol"
         verbose_name_plural = "Treatment Protocols"
@@ -88,6 +93,19 @@ class TreatmentProtocol(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.condition.code})"
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        
+        # Increment in the database so bumps made by step changes since this
+        # instance was loaded are not overwritten with a stale version
+        self.definition_version = models.F('definition_version') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'definition_version'}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['definition_version'])
 
 
 class ProtocolStep(models.Model):
@@ -259,6 +277,14 @@ class ProtocolStep(models.Model):
     
     def __str__(self):
         return f"{self.protocol.name} - Step {self.step_number}: {self.title}"
+    
+    def clean(self):
+        super().clean()
+        try:
+            branching.validate_branch_logic(self.branch_logic)
+        except ValidationError as e:
+            raise ValidationError({'branch_logic': e.messages})
+
 
 
 class ProtocolStepMedication(models.Model):
@@ -527,9 +553,17 @@ class PatientProtocol(models.Model):
         help_text="Any modifications made to the standard protocol"
     )
     
-    # Tracking
+    # Tracking (step counters are maintained incrementally, see protocols/adherence.py)
     current_step_number = models.PositiveIntegerField(default=0)
+    step_completion_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of scheduled step completions"
+    )
     total_steps_completed = models.PositiveIntegerField(default=0)
+    on_time_step_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of steps completed within their timing window"
+    )
     adherence_percentage = models.DecimalField(
         max_digits=5,
         decimal_places=2,
@@ -661,10 +695,20 @@ class ProtocolStepCompletion(models.Model):
         verbose_name = "Protocol Step Completion"
         verbose_name_plural = "Protocol Step Completions"
         ordering = ['patient_protocol', 'scheduled_date']
+        indexes = [
+            models.Index(fields=['status', 'scheduled_date', 'id']),
+            models.Index(fields=['adverse_event', 'scheduled_date', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.patient_protocol.patient.get_full_name()} - {self.protocol_step.title} ({self.status})"
     
+    def save(self, *args, **kwargs):
+        # Atomic so the adherence counter update in the post_save signal
+        # commits or rolls back together with the row itself
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     def calculate_compliance(self):
         """Calculate if completed within acceptable window"""
         if self.completed_date and self.scheduled_date:
@@ -804,54 +848,48 @@ class ProtocolStepResult(models.Model):
             return self.result_value_text[:50]
         return "No result"
     
-    def evaluate_branching(self):
+    def evaluate_branching(self, step=None):
         """
         Evaluate if this result should trigger branching
         Returns next step number if branching applies
+        Pass the completion's protocol step when it is already loaded
         """
-        if not self.step_completion.protocol_step.has_branches:
+        step = step or self.step_completion.protocol_step
+        table = branching.get_decision_table(step)
+        if table is None:
             return None
         
-        branch_logic = self.step_completion.protocol_step.branch_logic
-        if not branch_logic or 'conditions' not in branch_logic:
-            return None
-        
-        # Get the result value to compare
-        if self.result_value_choice:
-            compare_value = self.result_value_choice
-        elif self.result_value_numeric is not None:
-            compare_value = float(self.result_value_numeric)
-        elif self.meets_criteria is not None:
-            compare_value = 'met' if self.meets_criteria else 'not_met'
-        else:
-            return branch_logic.get('default_next_step')
-        
-        # Evaluate conditions
-        for condition in branch_logic['conditions']:
-            if self._matches_condition(compare_value, condition):
-                self.triggers_branch = True
-                self.branch_taken = condition.get('label', '')
-                return condition.get('next_step')
-        
-        # No match, use default
-        return branch_logic.get('default_next_step')
+        next_step, label = branching.evaluate(table, branching.result_value(self))
+        if label is not None:
+            self.triggers_branch = True
+            self.branch_taken = label
+        return next_step
+
+
+class ConsentFormQuerySet(models.QuerySet):
+    """Consent validity evaluated in SQL, matching ConsentForm.is_valid()"""
+    
+    @staticmethod
+    def validity_q(on=None):
+        on = on or timezone.now().date()
+        return (
+            models.Q(status='obtained', withdrawal_date__isnull=True)
+            & (models.Q(expiry_date__isnull=True) | models.Q(expiry_date__gte=on))
+        )
     
-    def _matches_condition(self, value, condition):
-        """Check if value matches condition"""
-        condition_value = condition.get('result')
-        operator = condition.get('operator', 'equals')
-        
-        if operator == 'equals':
-            return str(value).lower() == str(condition_value).lower()
-        elif operator == 'greater_than':
-            return float(value) > float(condition_value)
-        elif operator == 'less_than':
-            return float(value) < float(condition_value)
-        elif operator == 'between':
-            min_val, max_val = condition_value
-            return min_val <= float(value) <= max_val
-        
-        return False
+    def valid(self, on=None):
+        return self.filter(self.validity_q(on))
+    
+    def with_validity(self):
+        """Annotate is_currently_valid"""
+        return self.annotate(is_currently_valid=models.ExpressionWrapper(
+            self.validity_q(), output_field=models.BooleanField()
+        ))
+    
+    def expiring(self, days):
+        """Valid consents whose expiry date falls within the next `days` days"""
+        today = timezone.now().date()
+        return self.valid(today).filter(expiry_date__lte=today + timedelta(days=days))
 
 
 class ConsentForm(models.Model):
@@ -959,17 +997,23 @@ class ConsentForm(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ConsentFormQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Consent Form"
         verbose_name_plural = "Consent Forms"
         ordering = ['-consent_given_date']
+        indexes = [
+            models.Index(fields=['patient', 'protocol', 'status', 'expiry_date']),
+            models.Index(fields=['status', 'expiry_date']),
+        ]
     
     def __str__(self):
         return f"{self.patient.get_full_name()} - {self.title} ({self.status})"
     
     def is_valid(self):
         """Check if consent is currently valid"""
-        if self.status != 'obtained':
+        if self.status != 'obtained' or self.withdrawal_date:
             return False
         if self.expiry_date and self.expiry_date < timezone.now().date():
             return False
@@ -0,0 +1,223 @@
+"""
+Protocol schedule builder for PreciseOptics.
+
+Expands a protocol's steps into dated ProtocolStepCompletion rows. The date
+arithmetic is a pure function of the steps and a start date, so the single
+assignment endpoint, the patient protocol serializer and cohort assignment
+all produce the same schedule, and each assignment is written with one
+bulk INSERT instead of one query per row.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ConsentForm, PatientProtocol, ProtocolStepCompletion
+from . import adherence, statistics
+
+RESCHEDULE_FIELDS = [
+    'original_scheduled_date', 'scheduled_date', 'reschedule_reason',
+    'rescheduled_by', 'status', 'updated_at'
+]
+
+ACTIVE_STATUSES = ('active', 'pending')
+
+# Maximum number of patients accepted by a single cohort assignment
+MAX_COHORT_SIZE = 1000
+
+
+def step_interval(step):
+    """Gap between occurrences of a recurring step"""
+    if step.timing_type == 'weekly':
+        return timedelta(weeks=1)
+    if step.timing_type == 'monthly':
+        return timedelta(days=30)
+    return timedelta(days=step.timing_days)
+
+
+def build_schedule(steps, start_date):
+    """
+    Return (step, scheduled_date) pairs for the given steps in step_number order.
+
+    - fixed: timing_days after the protocol start
+    - from_previous: timing_days after the previous step's first occurrence
+    - weekly / monthly: timing_days weeks / 30-day months after the start
+    Recurring steps with a recurrence_count are repeated that many times in total.
+    """
+    schedule = []
+    previous_date = start_date
+    for step in sorted(steps, key=lambda s: s.step_number):
+        if step.timing_type == 'from_previous':
+            first_date = previous_date + timedelta(days=step.timing_days)
+        elif step.timing_type == 'weekly':
+            first_date = start_date + timedelta(weeks=step.timing_days)
+        elif step.timing_type == 'monthly':
+            first_date = start_date + timedelta(days=step.timing_days * 30)
+        else:
+            first_date = start_date + timedelta(days=step.timing_days)
+
+        occurrences = step.recurrence_count if step.is_recurring and step.recurrence_count else 1
+        interval = step_interval(step)
+        schedule.extend((step, first_date + interval * i) for i in range(occurrences))
+        previous_date = first_date
+    return schedule
+
+
+def build_completions(patient_protocol, schedule):
+    """Unsaved ProtocolStepCompletion rows for one patient protocol"""
+    return [
+        ProtocolStepCompletion(
+            patient_protocol=patient_protocol,
+            protocol_step=step,
+            scheduled_date=scheduled_date,
+            status='scheduled'
+        )
+        for step, scheduled_date in schedule
+    ]
+
+
+def schedule_patient_protocol(patient_protocol, steps=None):
+    """Create the step schedule for a saved patient protocol. Returns the completions."""
+    if steps is None:
+        steps = patient_protocol.protocol.steps.all()
+    schedule = build_schedule(steps, patient_protocol.start_date)
+    with transaction.atomic():
+        completions = ProtocolStepCompletion.objects.bulk_create(
+            build_completions(patient_protocol, schedule), batch_size=500
+        )
+        adherence.record_created(completions)
+    return completions
+
+
+def assign_protocol_to_cohort(protocol, patients, start_date, assigned_by, assignment_reason=''):
+    """
+    Assign one protocol to many patients in a single transaction.
+
+    Patients who already have this protocol active or pending, or who lack a
+    valid consent when the protocol requires one, are skipped. Returns one
+    result dict per patient in the order given.
+    """
+    patients = list(patients)
+    patient_ids = [patient.id for patient in patients]
+
+    already_assigned = set(
+        PatientProtocol.objects.filter(
+            protocol=protocol, patient_id__in=patient_ids, status__in=ACTIVE_STATUSES
+        ).values_list('patient_id', flat=True)
+    )
+    consented = None
+    if protocol.requires_consent:
+        consented = set(
+            ConsentForm.objects.valid().filter(
+                protocol=protocol, patient_id__in=patient_ids
+            ).values_list('patient_id', flat=True)
+        )
+
+    schedule = build_schedule(protocol.steps.all(), start_date)
+    expected_end_date = (
+        start_date + timedelta(weeks=protocol.total_duration_weeks)
+        if protocol.total_duration_weeks else None
+    )
+
+    results = []
+    new_protocols = []
+    for patient in patients:
+        result = {'patient': str(patient.id), 'patient_id': patient.patient_id}
+        if patient.id in already_assigned:
+            result.update(status='skipped', error=f'Patient already has an active {protocol.name} protocol')
+        elif consented is not None and patient.id not in consented:
+            result.update(status='skipped', error=f'Valid consent required for {protocol.name} protocol')
+        else:
+            patient_protocol = PatientProtocol(
+                patient=patient,
+                protocol=protocol,
+                start_date=start_date,
+                expected_end_date=expected_end_date,
+                status='pending',
+                assigned_by=assigned_by,
+                assignment_reason=assignment_reason
+            )
+            # Guard against the same patient listed twice
+            already_assigned.add(patient.id)
+            new_protocols.append(patient_protocol)
+            result.update(
+                status='assigned',
+                patient_protocol=str(patient_protocol.id),
+                steps_scheduled=len(schedule)
+            )
+        results.append(result)
+
+    with transaction.atomic():
+        PatientProtocol.objects.bulk_create(new_protocols, batch_size=500)
+        completions = ProtocolStepCompletion.objects.bulk_create(
+            [
+                completion
+                for patient_protocol in new_protocols
+                for completion in build_completions(patient_protocol, schedule)
+            ],
+            batch_size=500
+        )
+        adherence.record_created(completions)
+        # bulk_create skips the post_save receivers
+        statistics.invalidate()
+    return results
+
+
+def _shift(completion, days, reason, user, now):
+    completion.original_scheduled_date = completion.scheduled_date
+    completion.scheduled_date = completion.scheduled_date + timedelta(days=days)
+    completion.reschedule_reason = reason
+    completion.rescheduled_by = user
+    completion.status = 'rescheduled'
+    completion.updated_at = now
+
+
+def reschedule_completions(completion_ids, days, reason, user, cascade=False):
+    """
+    Shift scheduled step completions by `days` in one bulk UPDATE.
+
+    With cascade, later scheduled steps of the same patient protocol whose
+    timing_type is 'from_previous' move too, as long as the step before them
+    moved (so a chain of from_previous steps follows its anchor). Returns
+    (rescheduled_ids, cascaded_ids).
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        targets = list(
+            ProtocolStepCompletion.objects.select_for_update()
+            .filter(id__in=completion_ids, status='scheduled')
+        )
+        target_ids = {completion.id for completion in targets}
+        cascaded = []
+
+        if cascade and targets:
+            by_protocol = defaultdict(lambda: defaultdict(list))
+            for completion in (
+                ProtocolStepCompletion.objects.select_for_update()
+                .filter(patient_protocol_id__in={c.patient_protocol_id for c in targets})
+                .select_related('protocol_step')
+            ):
+                by_protocol[completion.patient_protocol_id][completion.protocol_step.step_number].append(completion)
+
+            for by_step in by_protocol.values():
+                previous_moved = False
+                for step_number in sorted(by_step):
+                    completions = by_step[step_number]
+                    if any(c.id in target_ids for c in completions):
+                        previous_moved = True
+                    elif previous_moved and completions[0].protocol_step.timing_type == 'from_previous':
+                        movable = [c for c in completions if c.status == 'scheduled']
+                        cascaded.extend(movable)
+                        previous_moved = bool(movable)
+                    else:
+                        previous_moved = False
+
+        for completion in targets:
+            _shift(completion, days, reason, user, now)
+        for completion in cascaded:
+            _shift(completion, days, f'{reason} (follows earlier step)', user, now)
+
+        ProtocolStepCompletion.objects.bulk_update(targets + cascaded, RESCHEDULE_FIELDS, batch_size=500)
+
+    return [c.id for c in targets], [c.id for c in cascaded]
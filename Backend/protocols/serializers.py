@@ -2,18 +2,23 @@
 Serializers for protocols app
 """
 from rest_framework import serializers
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from datetime import timedelta
 from .models import (
     TreatmentProtocol, ProtocolStep, PatientProtocol,
     ProtocolStepCompletion, ConsentForm,
     ProtocolStepMedication, ProtocolStepTreatment, ProtocolStepTest
 )
+from conditions.models import MedicalCondition
 from conditions.serializers import MedicalConditionSerializer
 from medications.serializers import MedicationSerializer
 from patients.serializers import PatientSerializer
 from accounts.serializers import CustomUserSerializer
 from precise_optics.file_validators import validate_document_extension, validate_file_size
+from . import branching, definitions, scheduling
 from .serializers_enhanced import (
     ProtocolStepMedicationSerializer, ProtocolStepTreatmentSerializer,
     ProtocolStepTestSerializer
@@ -69,6 +74,14 @@ class ProtocolStepSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at']
     
+    def validate_branch_logic(self, value):
+        """Reject branch logic that could not be evaluated"""
+        try:
+            branching.validate_branch_logic(value)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return value
+    
     def get_timing_window_days(self, obj):
         """Return the total flexibility window"""
         return {
@@ -145,13 +158,29 @@ class TreatmentProtocolSerializer(serializers.ModelSerializer):
     
     def get_active_patient_count(self, obj):
         """Count of active patient protocol assignments"""
+        if hasattr(obj, 'active_assignment_count'):
+            return obj.active_assignment_count
         return obj.patient_assignments.filter(status='active').count()
     
     def get_total_assigned_count(self, obj):
         """Total count of all protocol assignments"""
+        if hasattr(obj, 'total_assignment_count'):
+            return obj.total_assignment_count
         return obj.patient_assignments.count()
 
 
+class TreatmentProtocolDefinitionSerializer(TreatmentProtocolSerializer):
+    """TreatmentProtocolSerializer without the assignment counts, for caching"""
+    active_patient_count = None
+    total_assigned_count = None
+    
+    class Meta(TreatmentProtocolSerializer.Meta):
+        fields = [
+            field for field in TreatmentProtocolSerializer.Meta.fields
+            if field not in ('active_patient_count', 'total_assigned_count')
+        ]
+
+
 class TreatmentProtocolCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating protocols"""
     
@@ -174,8 +203,140 @@ class TreatmentProtocolCreateSerializer(serializers.ModelSerializer):
 
 # ==================== Patient Protocol Serializers ====================
 
-class PatientProtocolListSerializer(serializers.ModelSerializer):
-    """Lightweight serializer for patient protocol lists"""
+UPCOMING_STEPS_LIMIT = 3
+
+
+def protocol_counts_queryset(queryset):
+    """
+    Annotate the assignment counts and the condition's active patient count
+    that are added to cached protocol definitions per request
+    """
+    return queryset.prefetch_related(
+        Prefetch(
+            'condition',
+            queryset=MedicalCondition.objects.select_related('created_by').annotate(
+                active_patient_count=Count('patient_cases', filter=Q(patient_cases__is_active=True))
+            )
+        ),
+    ).annotate(
+        active_assignment_count=Count('patient_assignments', filter=Q(patient_assignments__status='active')),
+        total_assignment_count=Count('patient_assignments'),
+    )
+
+
+def protocol_detail_queryset(queryset):
+    """
+    Load everything TreatmentProtocolSerializer renders: condition, creator,
+    steps with their legacy medication, and assignment counts as annotations
+    """
+    return protocol_counts_queryset(queryset).select_related('created_by').prefetch_related(
+        Prefetch('steps', queryset=ProtocolStep.objects.select_related('medication').order_by('step_number')),
+    )
+
+
+def protocol_definition(protocol):
+    """
+    TreatmentProtocolSerializer output for a protocol, served from the
+    versioned definition cache with the volatile counts filled in per call
+    """
+    def build():
+        full = protocol_detail_queryset(TreatmentProtocol.objects.filter(pk=protocol.pk)).get()
+        return dict(TreatmentProtocolDefinitionSerializer(full).data)
+    
+    definition = definitions.get_or_build(protocol, build)
+    if not hasattr(protocol, 'active_assignment_count'):
+        protocol = protocol_counts_queryset(TreatmentProtocol.objects.filter(pk=protocol.pk)).get()
+    return {
+        **definition,
+        'condition_details': {
+            **definition['condition_details'],
+            'patient_count': protocol.condition.active_patient_count,
+        },
+        'active_patient_count': protocol.active_assignment_count,
+        'total_assigned_count': protocol.total_assignment_count,
+    }
+
+
+def patient_protocol_queryset(queryset, expand_protocol=False):
+    """
+    Annotate step/completed/missed counts and prefetch the next upcoming
+    completions so patient protocol serializers run a fixed number of queries.
+    With expand_protocol the full protocol definition is prefetched as well.
+    """
+    step_count = ProtocolStep.objects.filter(
+        protocol=OuterRef('protocol_id')
+    ).order_by().values('protocol').annotate(count=Count('id')).values('count')
+
+    upcoming = ProtocolStepCompletion.objects.filter(
+        status='scheduled',
+        scheduled_date__gte=timezone.now().date()
+    ).select_related('protocol_step').order_by('scheduled_date', 'id')[:UPCOMING_STEPS_LIMIT]
+
+    queryset = queryset.select_related('patient', 'assigned_by', 'discontinued_by').annotate(
+        step_count=Coalesce(Subquery(step_count), 0),
+        completed_count=Count('step_completions', filter=Q(step_completions__status='completed')),
+        missed_count=Count('step_completions', filter=Q(step_completions__status='missed')),
+    ).prefetch_related(
+        Prefetch('step_completions', queryset=upcoming, to_attr='upcoming_completions')
+    )
+
+    if expand_protocol:
+        return queryset.prefetch_related(
+            Prefetch('protocol', queryset=protocol_counts_queryset(TreatmentProtocol.objects.all()))
+        )
+    return queryset.select_related('protocol')
+
+
+def wants_expanded_protocol(request):
+    """True when the request asks for ?expand=protocol"""
+    if request is None:
+        return False
+    return 'protocol' in request.query_params.get('expand', '').split(',')
+
+
+class CompletionProgressMixin:
+    """
+    completion_progress and upcoming_steps from patient_protocol_queryset()
+    annotations, falling back to queries for instances loaded without them,
+    and protocol_details from the versioned definition cache
+    """
+    
+    def get_protocol_details(self, obj):
+        """Full protocol definition"""
+        return protocol_definition(obj.protocol)
+    
+    def get_completion_progress(self, obj):
+        """Return completion statistics"""
+        if hasattr(obj, 'step_count'):
+            total_steps, completed, missed = obj.step_count, obj.completed_count, obj.missed_count
+        else:
+            total_steps = obj.protocol.steps.count()
+            completed = obj.step_completions.filter(status='completed').count()
+            missed = obj.step_completions.filter(status='missed').count()
+        
+        return {
+            'total_steps': total_steps,
+            'completed': completed,
+            'missed': missed,
+            'remaining': total_steps - completed - missed,
+            'completion_percentage': (completed / total_steps * 100) if total_steps > 0 else 0
+        }
+    
+    def get_upcoming_steps(self, obj):
+        """Return next 3 upcoming scheduled steps"""
+        if hasattr(obj, 'upcoming_completions'):
+            upcoming = obj.upcoming_completions
+        else:
+            upcoming = obj.step_completions.filter(
+                status='scheduled',
+                scheduled_date__gte=timezone.now().date()
+            ).select_related('protocol_step').order_by('scheduled_date')[:UPCOMING_STEPS_LIMIT]
+        
+        return ProtocolStepCompletionListSerializer(upcoming, many=True).data
+
+
+class PatientProtocolSummarySerializer(serializers.ModelSerializer):
+    """Minimal patient protocol representation for nesting in other serializers"""
     patient_name = serializers.CharField(source='patient.get_full_name', read_only=True)
     patient_id = serializers.CharField(source='patient.patient_id', read_only=True)
     protocol_name = serializers.CharField(source='protocol.name', read_only=True)
@@ -200,10 +361,30 @@ class PatientProtocolListSerializer(serializers.ModelSerializer):
         return None
 
 
-class PatientProtocolSerializer(serializers.ModelSerializer):
+class PatientProtocolListSerializer(CompletionProgressMixin, PatientProtocolSummarySerializer):
+    """
+    Lightweight serializer for patient protocol lists
+    The nested protocol definition is only included with ?expand=protocol
+    """
+    protocol_details = serializers.SerializerMethodField()
+    completion_progress = serializers.SerializerMethodField()
+    upcoming_steps = serializers.SerializerMethodField()
+    
+    class Meta(PatientProtocolSummarySerializer.Meta):
+        fields = PatientProtocolSummarySerializer.Meta.fields + [
+            'protocol_details', 'completion_progress', 'upcoming_steps'
+        ]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not wants_expanded_protocol(self.context.get('request')):
+            self.fields.pop('protocol_details')
+
+
+class PatientProtocolSerializer(CompletionProgressMixin, serializers.ModelSerializer):
     """Full serializer for patient protocol details"""
     patient_details = PatientSerializer(source='patient', read_only=True)
-    protocol_details = TreatmentProtocolSerializer(source='protocol', read_only=True)
+    protocol_details = serializers.SerializerMethodField()
     assigned_by_details = CustomUserSerializer(source='assigned_by', read_only=True)
     discontinued_by_details = CustomUserSerializer(source='discontinued_by', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
@@ -223,30 +404,10 @@ class PatientProtocolSerializer(serializers.ModelSerializer):
             'total_steps_completed', 'adherence_percentage',
             'completion_progress', 'upcoming_steps', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['assigned_date', 'created_at', 'updated_at', 'adherence_percentage']
-    
-    def get_completion_progress(self, obj):
-        """Return completion statistics"""
-        total_steps = obj.protocol.steps.count()
-        completed = obj.step_completions.filter(status='completed').count()
-        missed = obj.step_completions.filter(status='missed').count()
-        
-        return {
-            'total_steps': total_steps,
-            'completed': completed,
-            'missed': missed,
-            'remaining': total_steps - completed - missed,
-            'completion_percentage': (completed / total_steps * 100) if total_steps > 0 else 0
-        }
-    
-    def get_upcoming_steps(self, obj):
-        """Return next 3 upcoming scheduled steps"""
-        upcoming = obj.step_completions.filter(
-            status='scheduled',
-            scheduled_date__gte=timezone.now().date()
-        ).order_by('scheduled_date')[:3]
-        
-        return ProtocolStepCompletionListSerializer(upcoming, many=True).data
+        read_only_fields = [
+            'assigned_date', 'created_at', 'updated_at',
+            'total_steps_completed', 'adherence_percentage'
+        ]
 
 
 class PatientProtocolCreateSerializer(serializers.ModelSerializer):
@@ -278,10 +439,9 @@ class PatientProtocolCreateSerializer(serializers.ModelSerializer):
         
         # Check if protocol requires consent
         if protocol.requires_consent:
-            has_valid_consent = ConsentForm.objects.filter(
+            has_valid_consent = ConsentForm.objects.valid().filter(
                 patient=patient,
-                protocol=protocol,
-                status='obtained'
+                protocol=protocol
             ).exists()
             
             if not has_valid_consent:
@@ -293,21 +453,9 @@ class PatientProtocolCreateSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         """Create patient protocol and generate step schedule"""
-        patient_protocol = PatientProtocol.objects.create(**validated_data)
-        
-        # Auto-generate step completions based on protocol steps
-        protocol_steps = patient_protocol.protocol.steps.all().order_by('step_number')
-        start_date = patient_protocol.start_date
-        
-        for step in protocol_steps:
-            scheduled_date = start_date + timedelta(days=step.timing_days)
-            
-            ProtocolStepCompletion.objects.create(
-                patient_protocol=patient_protocol,
-                protocol_step=step,
-                scheduled_date=scheduled_date,
-                status='scheduled'
-            )
+        with transaction.atomic():
+            patient_protocol = PatientProtocol.objects.create(**validated_data)
+            scheduling.schedule_patient_protocol(patient_protocol)
         
         return patient_protocol
 
@@ -333,7 +481,7 @@ class ProtocolStepCompletionListSerializer(serializers.ModelSerializer):
 
 class ProtocolStepCompletionSerializer(serializers.ModelSerializer):
     """Full serializer for step completion details"""
-    patient_protocol_details = PatientProtocolListSerializer(source='patient_protocol', read_only=True)
+    patient_protocol_details = PatientProtocolSummarySerializer(source='patient_protocol', read_only=True)
     protocol_step_details = ProtocolStepSerializer(source='protocol_step', read_only=True)
     completed_by_details = CustomUserSerializer(source='completed_by', read_only=True)
     rescheduled_by_details = CustomUserSerializer(source='rescheduled_by', read_only=True)
@@ -378,25 +526,9 @@ class ProtocolStepCompletionCreateSerializer(serializers.ModelSerializer):
         instance = super().update(instance, validated_data)
         instance.status = 'completed'
         instance.calculate_compliance()
+        # Saving updates the patient protocol's adherence counters (protocols/signals.py)
         instance.save()
         
-        # Update patient protocol stats
-        patient_protocol = instance.patient_protocol
-        patient_protocol.total_steps_completed = patient_protocol.step_completions.filter(
-            status='completed'
-        ).count()
-        
-        # Calculate adherence percentage
-        total_steps = patient_protocol.step_completions.count()
-        on_time_steps = patient_protocol.step_completions.filter(
-            completed_within_window=True
-        ).count()
-        
-        if total_steps > 0:
-            patient_protocol.adherence_percentage = (on_time_steps / total_steps) * 100
-        
-        patient_protocol.save()
-        
         return instance
 
 
@@ -421,6 +553,8 @@ class ConsentFormListSerializer(serializers.ModelSerializer):
     
     def get_is_valid_consent(self, obj):
         """Check if consent is currently valid"""
+        if hasattr(obj, 'is_currently_valid'):
+            return obj.is_currently_valid
         return obj.is_valid()
 
 
@@ -428,7 +562,7 @@ class ConsentFormSerializer(serializers.ModelSerializer):
     """Full serializer for consent form details"""
     patient_details = PatientSerializer(source='patient', read_only=True)
     protocol_details = TreatmentProtocolListSerializer(source='protocol', read_only=True)
-    patient_protocol_details = PatientProtocolListSerializer(source='patient_protocol', read_only=True)
+    patient_protocol_details = PatientProtocolSummarySerializer(source='patient_protocol', read_only=True)
     obtained_by_details = CustomUserSerializer(source='obtained_by', read_only=True)
     witnessed_by_details = CustomUserSerializer(source='witnessed_by', read_only=True)
     consent_type_display = serializers.CharField(source='get_consent_type_display', read_only=True)
@@ -452,6 +586,8 @@ class ConsentFormSerializer(serializers.ModelSerializer):
     
     def get_is_valid_consent(self, obj):
         """Check if consent is currently valid"""
+        if hasattr(obj, 'is_currently_valid'):
+            return obj.is_currently_valid
         return obj.is_valid()
 
 
@@ -0,0 +1,80 @@
+"""
+Signal receivers for the protocols app
+"""
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import (
+    ConsentForm, PatientProtocol, ProtocolStep, ProtocolStepCompletion, ProtocolStepMedication,
+    ProtocolStepTest, ProtocolStepTreatment, TreatmentProtocol
+)
+from . import adherence, definitions, statistics
+
+
+def _persisted_counter_values(instance):
+    """Counter field values currently stored for this completion (locks the row)"""
+    return ProtocolStepCompletion.objects.select_for_update().filter(
+        pk=instance.pk
+    ).values(*adherence.TRACKED_FIELDS).first()
+
+
+@receiver(pre_save, sender=ProtocolStepCompletion)
+def capture_completion_before_save(sender, instance, raw=False, **kwargs):
+    """Read the stored row so post_save can apply the counter difference"""
+    instance._persisted_values = None
+    if not raw and not instance._state.adding:
+        instance._persisted_values = _persisted_counter_values(instance)
+
+
+@receiver(post_save, sender=ProtocolStepCompletion)
+def update_adherence_on_save(sender, instance, created, raw=False, **kwargs):
+    """Move the parent protocol's adherence counters with the completion"""
+    if raw:
+        # Fixture loading; run recompute_protocol_adherence afterwards
+        return
+    adherence.record_changes([(instance._persisted_values, adherence.tracked_values(instance))])
+
+
+def _deletes_parent(origin):
+    """
+    Whether a deletion that started at `origin` removes the completions'
+    protocols too: completions only cascade from their PatientProtocol
+    (Patient and ProtocolStep protect them), so any other origin does
+    """
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return origin is not None and model is not ProtocolStepCompletion
+
+
+@receiver(pre_delete, sender=ProtocolStepCompletion)
+def remove_completion_from_adherence(sender, instance, origin=None, **kwargs):
+    """Decrement the parent protocol's counters while the row still exists"""
+    if _deletes_parent(origin):
+        # No counters left to keep; skipping saves two queries per completion
+        return
+    before = _persisted_counter_values(instance)
+    if before:
+        adherence.record_changes([(before, None)])
+
+
+@receiver([post_save, post_delete], sender=TreatmentProtocol)
+@receiver([post_save, post_delete], sender=PatientProtocol)
+@receiver([post_save, post_delete], sender=ConsentForm)
+def invalidate_protocol_statistics(sender, **kwargs):
+    """Cached dashboard statistics are rebuilt on the next request"""
+    statistics.invalidate()
+
+
+@receiver([post_save, post_delete], sender=ProtocolStep)
+def bump_definition_on_step_change(sender, instance, raw=False, **kwargs):
+    """Steps are part of the cached protocol definition"""
+    if not raw:
+        definitions.bump_version(pk=instance.protocol_id)
+
+
+@receiver([post_save, post_delete], sender=ProtocolStepMedication)
+@receiver([post_save, post_delete], sender=ProtocolStepTreatment)
+@receiver([post_save, post_delete], sender=ProtocolStepTest)
+def bump_definition_on_step_detail_change(sender, instance, raw=False, **kwargs):
+    """Step medications, treatments and tests are part of the definition too"""
+    if not raw:
+        definitions.bump_version(steps=instance.protocol_step_id)
@@ -0,0 +1,97 @@
+"""
+Protocol statistics for PreciseOptics.
+
+The dashboard figures are computed with one conditional-aggregation query
+per table (protocols, patient protocols, consent forms) and cached. Writes to
+any of those tables, and adherence counter updates, drop the cached copy once
+their transaction commits. The cache key includes today's date because
+consent expiry changes without any write.
+"""
+import time
+from collections import Counter
+from datetime import date
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Q
+
+from .models import ConsentForm, PatientProtocol, TreatmentProtocol
+
+CACHE_KEY = 'protocols:statistics'
+
+CACHE_TIMEOUT = 300
+
+
+def _cache_key():
+    return f'{CACHE_KEY}:{date.today().isoformat()}'
+
+
+def _protocol_counts():
+    rows = (
+        TreatmentProtocol.objects.order_by()
+        .values('is_active', 'protocol_type', 'condition__name')
+        .annotate(count=Count('id'))
+    )
+    total = active = 0
+    by_type, by_condition = Counter(), Counter()
+    for row in rows:
+        total += row['count']
+        if row['is_active']:
+            active += row['count']
+            by_type[row['protocol_type']] += row['count']
+            by_condition[row['condition__name']] += row['count']
+    return {
+        'total_protocols': total,
+        'active_protocols': active,
+        'protocols_by_type': dict(by_type),
+        'protocols_by_condition': dict(by_condition),
+    }
+
+
+def _patient_protocol_counts():
+    counts = PatientProtocol.objects.aggregate(
+        active_patient_protocols=Count('id', filter=Q(status__in=['pending', 'active'])),
+        completed_patient_protocols=Count('id', filter=Q(status='completed')),
+        average_adherence=Avg('adherence_percentage', filter=Q(status__in=['active', 'completed'])),
+    )
+    counts['average_adherence'] = round(counts['average_adherence'] or 0, 2)
+    return counts
+
+
+def _consent_counts():
+    return ConsentForm.objects.aggregate(
+        pending_consents=Count('id', filter=Q(status='pending')),
+        expired_consents=Count('id', filter=Q(status='obtained', expiry_date__lt=date.today())),
+    )
+
+
+COMPONENTS = (
+    ('protocols', _protocol_counts),
+    ('patient_protocols', _patient_protocol_counts),
+    ('consents', _consent_counts),
+)
+
+
+def compute_statistics():
+    """Return (statistics, timings) where timings maps component to milliseconds"""
+    statistics, timings = {}, {}
+    for name, component in COMPONENTS:
+        started = time.perf_counter()
+        statistics.update(component())
+        timings[name] = round((time.perf_counter() - started) * 1000, 2)
+    return statistics, timings
+
+
+def get_statistics():
+    """Return (statistics, timings); timings is None when served from cache"""
+    statistics = cache.get(_cache_key())
+    if statistics is not None:
+        return statistics, None
+    statistics, timings = compute_statistics()
+    cache.set(_cache_key(), statistics, CACHE_TIMEOUT)
+    return statistics, timings
+
+
+def invalidate():
+    """Drop the cached statistics after the current transaction commits"""
+    transaction.on_commit(lambda: cache.delete(_cache_key()))
@@ -1,13 +1,29 @@
 """
 Tests for protocols app
 """
+import json
+from base64 import b64encode
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
+from accounts.models import StaffProfile
 from conditions.models import MedicalCondition
-from .models import TreatmentProtocol
-from datetime import date
+from patients.models import Patient
+from .models import (
+    TreatmentProtocol, ProtocolStep, PatientProtocol, ProtocolStepCompletion,
+    ProtocolStepResult, ConsentForm
+)
+from .serializers import PatientProtocolSerializer
+from . import adherence, branching, forecast, scheduling, statistics
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
 
 User = get_user_model()
 
@@ -28,6 +44,43 @@ def create_test_condition(user):
     )
 
 
+def create_test_protocol(user, **overrides):
+    """Helper to create a test protocol, with its own condition unless one is given."""
+    data = {
+        'name': 'Test Protocol',
+        'code': 'TEST-001',
+        'protocol_type': 'custom',
+        'description': 'Test protocol.',
+        'indications': 'Test indications.',
+        'requires_consent': False,
+        'created_by': user,
+    }
+    data.update(overrides)
+    if 'condition' not in data:
+        data['condition'] = create_test_condition(user)
+    return TreatmentProtocol.objects.create(**data)
+
+
+def create_test_patient(user, patient_id='PAT000001'):
+    """Helper to create a test patient with all required fields."""
+    return Patient.objects.create(
+        patient_id=patient_id,
+        first_name='John',
+        last_name='Doe',
+        date_of_birth=date(1960, 5, 1),
+        gender='M',
+        phone_number='+447700900000',
+        address_line_1='1 High Street',
+        city='London',
+        state='Greater London',
+        postal_code='SW1A 1AA',
+        emergency_contact_name='Jane Doe',
+        emergency_contact_phone='+447700900001',
+        emergency_contact_relationship='Spouse',
+        registered_by=user
+    )
+
+
 class TreatmentProtocolModelTest(TestCase):
     """Test TreatmentProtocol model"""
 
@@ -38,15 +91,9 @@ class TreatmentProtocolModelTest(TestCase):
             password='testpass123'
         )
         self.condition = create_test_condition(self.user)
-        self.protocol = TreatmentProtocol.objects.create(
-            name='AMD Loading Dose',
-            code='AMD-LD-001',
-            protocol_type='loading_dose',
-            condition=self.condition,
-            description='Standard AMD loading dose protocol.',
-            indications='New AMD diagnosis.',
-            requires_consent=True,
-            created_by=self.user
+        self.protocol = create_test_protocol(
+            self.user, name='AMD Loading Dose', code='AMD-LD-001', protocol_type='loading_dose',
+            condition=self.condition, requires_consent=True
         )
 
     def test_protocol_creation(self):
@@ -75,16 +122,7 @@ class ProtocolAPITest(TestCase):
         )
         self.client.force_authenticate(user=self.user)
         self.condition = create_test_condition(self.user)
-        self.protocol = TreatmentProtocol.objects.create(
-            name='Test Protocol',
-            code='TEST-001',
-            protocol_type='maintenance',
-            condition=self.condition,
-            description='Test maintenance protocol.',
-            indications='Stable AMD.',
-            requires_consent=False,
-            created_by=self.user
-        )
+        self.protocol = create_test_protocol(self.user, protocol_type='maintenance', condition=self.condition)
 
     def test_list_protocols(self):
         response = self.client.get('/api/protocols/protocols/')
@@ -107,3 +145,761 @@ class ProtocolAPITest(TestCase):
         }
         response = self.client.post('/api/protocols/protocols/', payload, format='json')
         self.assertIn(response.status_code, [status.HTTP_200_OK, status.HTTP_201_CREATED])
+
+
+class ProtocolSchedulingTest(TestCase):
+    """Test schedule building and cohort assignment"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.condition = create_test_condition(self.user)
+        self.protocol = create_test_protocol(
+            self.user, name='AMD Loading Dose', code='AMD-LD-001', protocol_type='loading_dose',
+            condition=self.condition, total_duration_weeks=12
+        )
+        self.create_step(1, 'fixed', 0, title='Baseline assessment')
+        self.create_step(2, 'monthly', 1, title='Loading injection', is_recurring=True, recurrence_count=3)
+        self.create_step(3, 'from_previous', 14, title='Review')
+        self.start = date(2026, 1, 5)
+
+    def create_step(self, number, timing_type, timing_days, **extra):
+        return ProtocolStep.objects.create(
+            protocol=self.protocol,
+            step_number=number,
+            step_type='injection',
+            description='Step',
+            timing_type=timing_type,
+            timing_days=timing_days,
+            **extra
+        )
+
+    def test_build_schedule_expands_timing_types(self):
+        schedule = scheduling.build_schedule(self.protocol.steps.all(), self.start)
+        self.assertEqual(
+            [(step.step_number, scheduled) for step, scheduled in schedule],
+            [
+                (1, self.start),
+                (2, self.start + timedelta(days=30)),
+                (2, self.start + timedelta(days=60)),
+                (2, self.start + timedelta(days=90)),
+                (3, self.start + timedelta(days=44)),
+            ]
+        )
+
+    def test_serializer_and_view_paths_share_schedule(self):
+        patient = create_test_patient(self.user)
+        response = self.client.post('/api/protocols/assign-to-patient/', {
+            'patient': str(patient.id),
+            'protocol': str(self.protocol.id),
+            'start_date': self.start.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            ProtocolStepCompletion.objects.filter(patient_protocol_id=response.data['id']).count(), 5
+        )
+
+    def test_cohort_assignment_reports_per_patient_results(self):
+        patients = [create_test_patient(self.user, patient_id=f'PAT00000{i}') for i in range(3)]
+        PatientProtocol.objects.create(
+            patient=patients[0], protocol=self.protocol, start_date=self.start,
+            assigned_by=self.user, assignment_reason='Existing'
+        )
+
+        response = self.client.post('/api/protocols/assign-to-cohort/', {
+            'patients': [str(p.id) for p in patients],
+            'protocol': str(self.protocol.id),
+            'start_date': self.start.isoformat(),
+            'assignment_reason': 'Clinic cohort',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['assigned_count'], 2)
+        self.assertEqual(
+            [r['status'] for r in response.data['results']], ['skipped', 'assigned', 'assigned']
+        )
+        assigned = PatientProtocol.objects.get(id=response.data['results'][1]['patient_protocol'])
+        self.assertEqual(assigned.expected_end_date, self.start + timedelta(weeks=12))
+        self.assertEqual(assigned.step_completions.count(), 5)
+
+    def test_cohort_assignment_requires_consent(self):
+        self.protocol.requires_consent = True
+        self.protocol.save()
+        consenting, other = (create_test_patient(self.user, patient_id=f'PAT00001{i}') for i in range(2))
+        ConsentForm.objects.create(
+            patient=consenting, protocol=self.protocol, consent_type='protocol',
+            title='Consent', description='Consent', status='obtained', obtained_by=self.user
+        )
+        results = scheduling.assign_protocol_to_cohort(self.protocol, [consenting, other], self.start, self.user)
+        self.assertEqual([r['status'] for r in results], ['assigned', 'skipped'])
+
+    def test_single_assignment_requires_consent(self):
+        self.protocol.requires_consent = True
+        self.protocol.save()
+        patient = create_test_patient(self.user, patient_id='PAT000020')
+        data = {'patient': str(patient.id), 'protocol': str(self.protocol.id), 'start_date': self.start.isoformat()}
+
+        response = self.client.post('/api/protocols/assign-to-patient/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PatientProtocol.objects.filter(patient=patient).exists())
+
+        ConsentForm.objects.create(
+            patient=patient, protocol=self.protocol, consent_type='protocol',
+            title='Consent', description='Consent', status='obtained', obtained_by=self.user
+        )
+        response = self.client.post('/api/protocols/assign-to-patient/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_cohort_assignment_rejects_unknown_patients(self):
+        response = self.client.post('/api/protocols/assign-to-cohort/', {
+            'patients': ['00000000-0000-0000-0000-000000000000'],
+            'protocol': str(self.protocol.id),
+            'start_date': self.start.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cohort_assignment_rejects_non_string_start_date(self):
+        patient = create_test_patient(self.user, patient_id='PAT000030')
+        response = self.client.post('/api/protocols/assign-to-cohort/', {
+            'patients': [str(patient.id)],
+            'protocol': str(self.protocol.id),
+            'start_date': 20260101,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkRescheduleTest(TestCase):
+    """Test set-based bulk rescheduling with dependent step cascade"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        protocol = create_test_protocol(self.user, name='Post-op Review', code='POST-OP-001', protocol_type='post_op')
+        for number, timing_type, timing_days in [
+            (1, 'fixed', 1), (2, 'from_previous', 7), (3, 'from_previous', 21), (4, 'fixed', 90)
+        ]:
+            ProtocolStep.objects.create(
+                protocol=protocol, step_number=number, step_type='follow_up', title=f'Review {number}',
+                description='Review', timing_type=timing_type, timing_days=timing_days
+            )
+        patient_protocol = PatientProtocol.objects.create(
+            patient=create_test_patient(self.user), protocol=protocol, start_date=date(2026, 3, 2),
+            assigned_by=self.user, assignment_reason='Surgery'
+        )
+        scheduling.schedule_patient_protocol(patient_protocol)
+        self.completions = list(
+            patient_protocol.step_completions.order_by('protocol_step__step_number')
+        )
+
+    def reschedule(self, **extra):
+        return self.client.post('/api/protocols/completions/bulk-reschedule/', {
+            'step_ids': [str(self.completions[0].id)],
+            'days_to_add': 3,
+            'reason': 'Clinic closed',
+            **extra
+        }, format='json')
+
+    def scheduled_dates(self):
+        return [
+            ProtocolStepCompletion.objects.get(id=c.id).scheduled_date for c in self.completions
+        ]
+
+    def test_reschedule_without_cascade(self):
+        original = self.scheduled_dates()
+        response = self.reschedule()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated_count'], 1)
+        self.assertEqual(response.data['cascaded_count'], 0)
+        dates = self.scheduled_dates()
+        self.assertEqual(dates[0], original[0] + timedelta(days=3))
+        self.assertEqual(dates[1:], original[1:])
+        moved = ProtocolStepCompletion.objects.get(id=self.completions[0].id)
+        self.assertEqual((moved.status, moved.original_scheduled_date), ('rescheduled', original[0]))
+
+    def test_cascade_follows_from_previous_chain(self):
+        original = self.scheduled_dates()
+        response = self.reschedule(cascade=True)
+        self.assertEqual(
+            set(response.data['cascaded_ids']), {str(self.completions[1].id), str(self.completions[2].id)}
+        )
+        dates = self.scheduled_dates()
+        self.assertEqual(dates[:3], [d + timedelta(days=3) for d in original[:3]])
+        # Fixed-timing step is not dependent on the moved steps
+        self.assertEqual(dates[3], original[3])
+
+    def test_cascade_stops_at_completed_step(self):
+        ProtocolStepCompletion.objects.filter(id=self.completions[1].id).update(status='completed')
+        response = self.reschedule(cascade=True)
+        self.assertEqual(response.data['cascaded_count'], 0)
+
+    def test_invalid_days_rejected(self):
+        response = self.reschedule(days_to_add='soon')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BranchLogicTest(TestCase):
+    """Test branch logic validation, compilation and batch evaluation"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.protocol = create_test_protocol(self.user, name='Glaucoma Review', code='GLA-001')
+        self.step = ProtocolStep.objects.create(
+            protocol=self.protocol, step_number=1, step_type='test', title='IOP check',
+            description='Measure IOP', timing_days=0, has_branches=True,
+            branch_logic={
+                'conditions': [
+                    {'result': 21, 'operator': 'greater_than', 'next_step': 2, 'label': 'Raised'},
+                    {'result': [10, 21], 'operator': 'between', 'next_step': 3, 'label': 'Normal'},
+                ],
+                'default_next_step': 4
+            }
+        )
+        self.patient_protocol = PatientProtocol.objects.create(
+            patient=create_test_patient(self.user), protocol=self.protocol, start_date=date(2026, 3, 2),
+            assigned_by=self.user, assignment_reason='Review'
+        )
+
+    def create_completion_with_result(self, **result_values):
+        completion = ProtocolStepCompletion.objects.create(
+            patient_protocol=self.patient_protocol, protocol_step=self.step, scheduled_date=date(2026, 3, 2)
+        )
+        ProtocolStepResult.objects.create(
+            step_completion=completion, result_type='numeric', result_label='IOP',
+            evaluated_by=self.user, **result_values
+        )
+        return completion
+
+    def test_invalid_branch_logic_rejected_by_clean(self):
+        self.step.branch_logic = {'conditions': [{'result': 'high', 'operator': 'greater_than', 'next_step': 2}]}
+        with self.assertRaises(ValidationError):
+            self.step.full_clean()
+        # Legacy rows still save; they evaluate as non-branching
+        self.step.save()
+        self.assertIsNone(branching.get_decision_table(self.step))
+
+    def test_numeric_string_thresholds_still_branch(self):
+        ProtocolStep.objects.filter(pk=self.step.pk).update(branch_logic={
+            'conditions': [{'result': '21', 'operator': 'greater_than', 'next_step': 2}],
+            'default_next_step': 4
+        })
+        self.step.refresh_from_db()
+        table = branching.get_decision_table(self.step)
+        self.assertIsNotNone(table)
+        self.assertTrue(table.rules[0].predicate('24'))
+        self.assertFalse(table.rules[0].predicate(18))
+
+    def test_invalid_branch_logic_rejected_by_api(self):
+        response = self.client.patch(f'/api/protocols/steps/{self.step.id}/', {
+            'branch_logic': {'conditions': [{'result': 1, 'operator': 'roughly', 'next_step': 2}]}
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('branch_logic', response.data)
+
+    def test_decision_table_is_cached_until_step_changes(self):
+        table = branching.get_decision_table(self.step)
+        self.assertIs(branching.get_decision_table(self.step), table)
+        self.step.title = 'IOP check (edited)'
+        self.step.save()
+        self.assertIsNot(branching.get_decision_table(self.step), table)
+
+    def test_evaluation_uses_typed_predicates(self):
+        table = branching.get_decision_table(self.step)
+        self.assertEqual(branching.evaluate(table, 25.0), (2, 'Raised'))
+        self.assertEqual(branching.evaluate(table, 15.0), (3, 'Normal'))
+        self.assertEqual(branching.evaluate(table, 'not a number'), (4, None))
+        self.assertEqual(branching.evaluate(table, None), (4, None))
+
+    def test_batch_evaluation_endpoint(self):
+        raised = self.create_completion_with_result(result_value_numeric=30)
+        normal = self.create_completion_with_result(result_value_numeric=15)
+        missing = '00000000-0000-0000-0000-000000000000'
+
+        response = self.client.post('/api/protocols/completions/evaluate-branching/', {
+            'completion_ids': [str(raised.id), str(normal.id), missing]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [e['recommended_next_step'] for e in response.data['evaluations']], [2, 3]
+        )
+        self.assertEqual(response.data['not_found'], [missing])
+
+
+class PatientProtocolQueryCountTest(TestCase):
+    """Test that patient protocol lists run a fixed number of queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.protocol = create_test_protocol(
+            self.user, name='AMD Maintenance', code='AMD-M-001', protocol_type='maintenance'
+        )
+        for number in range(1, 5):
+            ProtocolStep.objects.create(
+                protocol=self.protocol, step_number=number, step_type='injection', title=f'Injection {number}',
+                description='Injection', timing_days=28 * number
+            )
+        self.patient = create_test_patient(self.user)
+        self.start = date.today() - timedelta(days=30)
+
+    def assign(self, count):
+        for i in range(count):
+            patient_protocol = PatientProtocol.objects.create(
+                patient=self.patient, protocol=self.protocol, start_date=self.start,
+                assigned_by=self.user, assignment_reason='Maintenance', status='completed'
+            )
+            scheduling.schedule_patient_protocol(patient_protocol)
+        return patient_protocol
+
+    def list_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        url = f'/api/protocols/patient/{self.patient.id}/protocols/'
+        self.assign(1)
+        single, _ = self.list_query_count(url)
+        self.assign(4)
+        many, response = self.list_query_count(url)
+        self.assertEqual(single, many)
+        first = response.data['results'][0] if 'results' in response.data else response.data[0]
+        self.assertEqual(first['completion_progress']['total_steps'], 4)
+        self.assertEqual(len(first['upcoming_steps']), 3)
+        self.assertNotIn('protocol_details', first)
+
+    def test_expand_protocol_includes_definition(self):
+        url = f'/api/protocols/patient/{self.patient.id}/protocols/?expand=protocol'
+        self.assign(1)
+        # Build the cached protocol definition first
+        self.list_query_count(url)
+        single, _ = self.list_query_count(url)
+        self.assign(4)
+        many, response = self.list_query_count(url)
+        self.assertEqual(single, many)
+        first = response.data['results'][0] if 'results' in response.data else response.data[0]
+        self.assertEqual(len(first['protocol_details']['steps']), 4)
+        self.assertEqual(first['protocol_details']['total_assigned_count'], 5)
+
+    def test_detail_matches_unannotated_progress(self):
+        patient_protocol = self.assign(1)
+        ProtocolStepCompletion.objects.filter(
+            id=patient_protocol.step_completions.order_by('scheduled_date').first().id
+        ).update(status='completed')
+        response = self.client.get(f'/api/protocols/patient-protocols/{patient_protocol.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['completion_progress'],
+            PatientProtocolSerializer(PatientProtocol.objects.get(id=patient_protocol.id)).data['completion_progress']
+        )
+
+
+class AdherenceCountersTest(TestCase):
+    """Test incrementally maintained adherence counters"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.protocol = create_test_protocol(self.user, name='Dry Eye', code='DRY-001', protocol_type='fixed_interval')
+        for number in range(1, 5):
+            ProtocolStep.objects.create(
+                protocol=self.protocol, step_number=number, step_type='follow_up', title=f'Review {number}',
+                description='Review', timing_days=7 * (number - 1), timing_window_after=2
+            )
+        self.start = date.today() - timedelta(days=30)
+        self.patient_protocol = PatientProtocol.objects.create(
+            patient=create_test_patient(self.user), protocol=self.protocol, start_date=self.start,
+            assigned_by=self.user, assignment_reason='Dry eye'
+        )
+        scheduling.schedule_patient_protocol(self.patient_protocol)
+        self.completions = list(self.patient_protocol.step_completions.order_by('scheduled_date'))
+
+    def complete(self, completion, days_late=0):
+        response = self.client.post(
+            f'/api/protocols/patient-protocols/{self.patient_protocol.id}/complete-step/{completion.id}/',
+            {'completed_date': (completion.scheduled_date + timedelta(days=days_late)).isoformat()},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def counters(self):
+        self.patient_protocol.refresh_from_db()
+        return (
+            self.patient_protocol.step_completion_count,
+            self.patient_protocol.total_steps_completed,
+            self.patient_protocol.on_time_step_count,
+            self.patient_protocol.adherence_percentage,
+        )
+
+    def test_counters_follow_completions(self):
+        self.assertEqual(self.counters()[:3], (4, 0, 0))
+        self.complete(self.completions[0])
+        self.complete(self.completions[1], days_late=5)
+        self.assertEqual(self.counters(), (4, 2, 1, Decimal('25.00')))
+
+        # Re-saving without a change leaves the counters alone
+        self.completions[0].refresh_from_db()
+        self.completions[0].save()
+        self.assertEqual(self.counters(), (4, 2, 1, Decimal('25.00')))
+
+        self.completions[1].refresh_from_db()
+        self.completions[1].delete()
+        self.assertEqual(self.counters(), (3, 1, 1, Decimal('33.33')))
+
+    def test_equal_deltas_share_one_update(self):
+        protocols = [self.patient_protocol] + [
+            PatientProtocol.objects.create(
+                patient=create_test_patient(self.user, f'PAT00010{i}'), protocol=self.protocol,
+                start_date=self.start, assigned_by=self.user, assignment_reason='Dry eye'
+            )
+            for i in range(3)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            adherence.apply_deltas({pp.id: Counter(step_completion_count=2) for pp in protocols})
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        # One for the counters, one for adherence_percentage
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.counters()[0], 6)
+
+    def test_deleting_a_protocol_skips_per_completion_counter_updates(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.patient_protocol.delete()
+        self.assertFalse([q for q in queries if 'UPDATE "protocols_patientprotocol"' in q['sql']])
+        self.assertFalse(ProtocolStepCompletion.objects.exists())
+
+    def test_recompute_repairs_drift(self):
+        self.complete(self.completions[0])
+        PatientProtocol.objects.filter(id=self.patient_protocol.id).update(
+            total_steps_completed=0, adherence_percentage=0
+        )
+        self.assertEqual(adherence.recompute(dry_run=True), 1)
+        self.assertEqual(adherence.recompute(batch_size=1), 1)
+        self.assertEqual(self.counters(), (4, 1, 1, Decimal('25.00')))
+        self.assertEqual(adherence.recompute(), 0)
+
+    def test_adherence_report_reads_counters(self):
+        self.complete(self.completions[0])
+        response = self.client.get('/api/protocols/adherence-report/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.data['by_protocol'][0]
+        self.assertEqual((row['scheduled_steps'], row['on_time_steps']), (4, 1))
+        self.assertEqual(row['overall_adherence'], 25.0)
+
+
+class StepFeedTest(TestCase):
+    """Test the keyset-paginated upcoming/overdue step feeds"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.protocol = create_test_protocol(self.user, name='Post-op Drops', code='POD-001', protocol_type='post_op')
+        for number in range(1, 4):
+            ProtocolStep.objects.create(
+                protocol=self.protocol, step_number=number, step_type='assessment', title=f'Check {number}',
+                description='Check', timing_days=number
+            )
+        self.patients = [create_test_patient(self.user, f'PAT00000{i}') for i in range(1, 4)]
+        for patient in self.patients:
+            patient_protocol = PatientProtocol.objects.create(
+                patient=patient, protocol=self.protocol, start_date=date.today() - timedelta(days=10),
+                assigned_by=self.user, assignment_reason='Post-op', status='active'
+            )
+            scheduling.schedule_patient_protocol(patient_protocol)
+
+    def test_cursor_walks_every_row_once_in_date_order(self):
+        url = '/api/protocols/completions/overdue/?page_size=4'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 4)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(len(seen), 9)
+        self.assertEqual(len({row['id'] for row in seen}), 9)
+        keys = [(row['scheduled_date'], row['id']) for row in seen]
+        self.assertEqual(keys, sorted(keys))
+
+    def test_count_only_and_filters(self):
+        response = self.client.get('/api/protocols/completions/overdue/?count_only=true')
+        self.assertEqual(response.data, {'count': 9})
+
+        response = self.client.get(f'/api/protocols/completions/overdue/?count_only=true&patient={self.patients[0].id}')
+        self.assertEqual(response.data, {'count': 3})
+
+        response = self.client.get(f'/api/protocols/completions/overdue/?clinician={self.user.id}&protocol={self.protocol.id}')
+        self.assertEqual(len(response.data['results']), 9)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_filter_and_cursor_are_rejected(self):
+        response = self.client.get('/api/protocols/completions/overdue/?patient=not-a-uuid')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get('/api/protocols/completions/overdue/?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        for position in (['bad', 'bad'], [date.today().isoformat(), 'bad'], [1, 2], [None, 'bad'],
+                         [None, '00000000-0000-0000-0000-000000000000']):
+            cursor = b64encode(json.dumps(position).encode()).decode()
+            response = self.client.get('/api/protocols/completions/overdue/', {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(str(response.data['detail']), 'Invalid cursor')
+
+
+class ProtocolStatisticsCacheTest(TestCase):
+    """Test protocol statistics aggregation, caching and invalidation"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        condition = create_test_condition(self.user)
+        self.protocol = create_test_protocol(
+            self.user, name='AMD Loading', code='AMD-L-001', protocol_type='loading_dose', condition=condition
+        )
+        create_test_protocol(self.user, name='Retired', code='RET-001', condition=condition, is_active=False)
+        self.patient = create_test_patient(self.user)
+
+    def test_statistics_use_one_query_per_table_and_are_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            data, timings = statistics.get_statistics()
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(set(timings), {'protocols', 'patient_protocols', 'consents'})
+        self.assertEqual(data['total_protocols'], 2)
+        self.assertEqual(data['active_protocols'], 1)
+        self.assertEqual(data['protocols_by_type'], {'loading_dose': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            cached, timings = statistics.get_statistics()
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(timings)
+        self.assertEqual(cached, data)
+
+    def test_patient_protocol_write_invalidates_cache(self):
+        response = self.client.get('/api/protocols/statistics/')
+        self.assertEqual(response.data['active_patient_protocols'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PatientProtocol.objects.create(
+                patient=self.patient, protocol=self.protocol, start_date=date.today(),
+                assigned_by=self.user, assignment_reason='Loading', status='active'
+            )
+
+        response = self.client.get('/api/protocols/statistics/')
+        self.assertEqual(response.data['active_patient_protocols'], 1)
+
+
+class WorkloadForecastTest(TestCase):
+    """Test the projected workload forecast"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        StaffProfile.objects.create(user=self.user, department='ophthalmology')
+        self.client.force_authenticate(user=self.user)
+        protocol = create_test_protocol(
+            self.user, name='Glaucoma Drops', code='GLA-001', protocol_type='fixed_interval'
+        )
+        ProtocolStep.objects.create(
+            protocol=protocol, step_number=1, step_type='injection', title='Injection',
+            description='Injection', timing_days=7
+        )
+        ProtocolStep.objects.create(
+            protocol=protocol, step_number=2, step_type='follow_up', title='Weekly review',
+            description='Review', timing_type='weekly', timing_days=1, is_recurring=True
+        )
+        self.patient_protocol = PatientProtocol.objects.create(
+            patient=create_test_patient(self.user), protocol=protocol, start_date=date.today(),
+            assigned_by=self.user, assignment_reason='Glaucoma', status='active'
+        )
+        scheduling.schedule_patient_protocol(self.patient_protocol)
+
+    def test_open_ended_recurrences_are_projected(self):
+        data = forecast.build_forecast(date.today(), weeks=12)
+
+        # One materialized review on day 7, then weekly projections up to day 77
+        self.assertEqual(data['totals_by_step_type'], {'injection': 1, 'follow_up': 11})
+        reviews = [row for row in data['rows'] if row['step_type'] == 'follow_up']
+        self.assertEqual(reviews[0]['scheduled'], 1)
+        self.assertTrue(all(row['projected'] == 1 for row in reviews[1:]))
+        self.assertEqual({row['site'] for row in data['rows']}, {'ophthalmology'})
+
+    def test_endpoint_is_cached_and_validates_weeks(self):
+        response = self.client.get('/api/protocols/forecast/workload/?weeks=4')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals_by_step_type'], {'injection': 1, 'follow_up': 3})
+
+        self.patient_protocol.status = 'completed'
+        self.patient_protocol.save()
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get('/api/protocols/forecast/workload/?weeks=4')
+        self.assertEqual(cached.data, response.data)
+        self.assertFalse(any('protocols_protocolstepcompletion' in q['sql'] for q in queries))
+
+        response = self.client.get('/api/protocols/forecast/workload/?weeks=52')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProtocolDefinitionCacheTest(TestCase):
+    """Test versioned caching of protocol definitions and ETags"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.protocol = create_test_protocol(
+            self.user, name='AMD Loading', code='AMD-L-001', protocol_type='loading_dose'
+        )
+        self.step = ProtocolStep.objects.create(
+            protocol=self.protocol, step_number=1, step_type='injection', title='Injection 1',
+            description='Injection', timing_days=0
+        )
+        self.url = f'/api/protocols/{self.protocol.id}/'
+
+    def version(self):
+        return TreatmentProtocol.objects.values_list('definition_version', flat=True).get(pk=self.protocol.pk)
+
+    def test_step_and_protocol_changes_bump_version(self):
+        start = self.version()
+        self.step.title = 'Loading injection'
+        self.step.save()
+        self.assertEqual(self.version(), start + 1)
+
+        # A stale protocol instance still moves the version forward
+        self.protocol.description = 'Three loading doses.'
+        self.protocol.save()
+        self.assertEqual(self.protocol.definition_version, start + 2)
+
+    def test_cached_definition_and_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertEqual(response.data['steps'][0]['title'], 'Injection 1')
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(self.url)
+        self.assertFalse(any('protocols_protocolstep"' in q['sql'] for q in queries))
+        self.assertEqual(cached.data, response.data)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.step.title = 'Loading injection'
+        self.step.save()
+        response = self.client.get(f'/api/protocols/code/{self.protocol.code}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['steps'][0]['title'], 'Loading injection')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_assignment_counts_are_not_cached(self):
+        self.client.get(self.url)
+        PatientProtocol.objects.create(
+            patient=create_test_patient(self.user), protocol=self.protocol, start_date=date.today(),
+            assigned_by=self.user, assignment_reason='Loading', status='active'
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['active_patient_count'], 1)
+
+
+class ConsentValidityTest(TestCase):
+    """Test SQL consent validity and the expiring consents endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testdoctor',
+            email='doctor@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.protocol = create_test_protocol(self.user, name='Research Protocol', code='RES-001', requires_consent=True)
+        self.patient = create_test_patient(self.user)
+        today = date.today()
+        self.consents = {
+            name: ConsentForm.objects.create(
+                patient=self.patient, protocol=self.protocol, consent_type='research',
+                title=name, description='Consent', obtained_by=self.user, **fields
+            )
+            for name, fields in {
+                'open_ended': {'status': 'obtained'},
+                'expiring': {'status': 'obtained', 'expiry_date': today + timedelta(days=5)},
+                'later': {'status': 'obtained', 'expiry_date': today + timedelta(days=60)},
+                'expired': {'status': 'obtained', 'expiry_date': today - timedelta(days=1)},
+                'withdrawn': {'status': 'obtained', 'withdrawal_date': today},
+                'pending': {'status': 'pending'},
+            }.items()
+        }
+
+    def test_sql_validity_matches_is_valid(self):
+        annotated = {c.title: c.is_currently_valid for c in ConsentForm.objects.with_validity()}
+        self.assertEqual(annotated, {name: c.is_valid() for name, c in self.consents.items()})
+        self.assertEqual(
+            set(ConsentForm.objects.valid().values_list('title', flat=True)),
+            {'open_ended', 'expiring', 'later'}
+        )
+
+    def test_expiring_endpoint(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/protocols/consent-forms/expiring/?days=30')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c['title'] for c in response.data['results']], ['expiring'])
+        self.assertEqual(len([q for q in queries if 'protocols_consentform' in q['sql']]), 1)
+
+        response = self.client.get('/api/protocols/consent-forms/expiring/?days=90')
+        self.assertEqual([c['title'] for c in response.data['results']], ['expiring', 'later'])
+
+        response = self.client.get('/api/protocols/consent-forms/expiring/?days=0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_consent_does_not_allow_cohort_assignment(self):
+        ConsentForm.objects.filter(title__in=['open_ended', 'expiring', 'later']).update(status='declined')
+        results = scheduling.assign_protocol_to_cohort(
+            self.protocol, [self.patient], date.today(), self.user
+        )
+        self.assertEqual(results[0]['status'], 'skipped')
@@ -12,6 +12,7 @@ urlpatterns = [
     path('code/<str:code>/', views.protocol_by_code, name='protocol-by-code'),
     path('<uuid:protocol_id>/steps/', views.ProtocolStepsView.as_view(), name='protocol-steps'),
     path('statistics/', views.protocol_statistics, name='protocol-statistics'),
+    path('forecast/workload/', views.workload_forecast, name='workload-forecast'),
     path('adherence-report/', views.protocol_adherence_report, name='protocol-adherence-report'),
     
     # Protocol Step endpoints
@@ -37,6 +38,7 @@ urlpatterns = [
     
     # Consent Form endpoints
     path('consent-forms/', views.ConsentFormListCreateView.as_view(), name='consent-form-list'),
+    path('consent-forms/expiring/', views.expiring_consents, name='expiring-consents'),
     path('consent-forms/<uuid:pk>/', views.ConsentFormDetailView.as_view(), name='consent-form-detail'),
     path('consent-forms/<uuid:consent_id>/withdraw/', views.withdraw_consent, name='withdraw-consent'),
     path('patient/<uuid:patient_id>/consent-forms/', views.PatientConsentFormsView.as_view(), name='patient-consent-forms'),
@@ -55,7 +57,9 @@ urlpatterns = [
     path('completions/<uuid:completion_id>/results/', views.get_step_results, name='get-step-results'),
     path('completions/<uuid:completion_id>/record-results/', views.record_step_results, name='record-step-results'),
     path('completions/<uuid:completion_id>/evaluate-branching/', views.evaluate_branching, name='evaluate-branching'),
+    path('completions/evaluate-branching/', views.evaluate_branching_batch, name='evaluate-branching-batch'),
     
     # Patient assignment
     path('assign-to-patient/', views.assign_protocol_to_patient, name='assign-to-patient'),
+    path('assign-to-cohort/', views.assign_protocol_to_cohort, name='assign-to-cohort'),
 ]
@@ -6,11 +6,16 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count, Avg, Q
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Avg, Sum
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import date, timedelta
 
+from precise_optics.pagination import KeysetPagination
 from .models import (
     TreatmentProtocol, ProtocolStep, PatientProtocol,
     ProtocolStepCompletion, ConsentForm, ProtocolStepMedication,
@@ -24,8 +29,10 @@ from .serializers import (
     ProtocolStepCompletionSerializer, ProtocolStepCompletionListSerializer,
     ProtocolStepCompletionCreateSerializer, ConsentFormSerializer,
     ConsentFormListSerializer, ConsentFormCreateSerializer,
-    ProtocolStatisticsSerializer
+    ProtocolStatisticsSerializer, patient_protocol_queryset, protocol_counts_queryset,
+    protocol_definition, protocol_detail_queryset, wants_expanded_protocol
 )
+from . import adherence, definitions, forecast, scheduling, statistics
 from .serializers_enhanced import (
     ProtocolStepMedicationSerializer, ProtocolStepMedicationCreateSerializer,
     ProtocolStepTreatmentSerializer, ProtocolStepTreatmentCreateSerializer,
@@ -33,6 +40,13 @@ from .serializers_enhanced import (
 )
 
 
+# Maximum step completions accepted by the batch branching endpoint
+MAX_BATCH_EVALUATIONS = 500
+
+DEFAULT_EXPIRING_DAYS = 30
+MAX_EXPIRING_DAYS = 365
+
+
 # ==================== Treatment Protocol Views ====================
 
 class TreatmentProtocolListCreateView(generics.ListCreateAPIView):
@@ -56,16 +70,36 @@ class TreatmentProtocolListCreateView(generics.ListCreateAPIView):
         serializer.save(created_by=self.request.user)
 
 
+def _protocol_definition_response(request, protocol):
+    """
+    Cached protocol definition with an ETag; answers 304 Not Modified when
+    the client already holds the same representation
+    """
+    data = protocol_definition(protocol)
+    etag = definitions.etag(data)
+    client_etags = [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]
+    if etag in client_etags:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(data, headers={'ETag': etag})
+
+
 class TreatmentProtocolDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a treatment protocol
     """
-    queryset = TreatmentProtocol.objects.all().select_related(
-        'condition', 'created_by'
-    ).prefetch_related('steps', 'patient_assignments')
+    queryset = protocol_detail_queryset(TreatmentProtocol.objects.all())
     serializer_class = TreatmentProtocolSerializer
     permission_classes = [IsAuthenticated]
     
+    def get_queryset(self):
+        if self.request.method == 'GET':
+            # The definition itself comes from the versioned cache
+            return protocol_counts_queryset(TreatmentProtocol.objects.all())
+        return super().get_queryset()
+    
+    def retrieve(self, request, *args, **kwargs):
+        return _protocol_definition_response(request, self.get_object())
+    
     def perform_destroy(self, instance):
         # Soft delete
         instance.is_active = False
@@ -117,9 +151,7 @@ class PatientProtocolListCreateView(generics.ListCreateAPIView):
     """
     List all patient protocols or assign a new one
     """
-    queryset = PatientProtocol.objects.all().select_related(
-        'patient', 'protocol', 'assigned_by'
-    )
+    queryset = PatientProtocol.objects.all()
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['patient', 'protocol', 'status', 'assigned_by'
@@ -158,18 +190,18 @@ class PatientProtocolListCreateView(generics.ListCreateAPIView):
         if date_to:
             queryset = queryset.filter(start_date__lte=date_to)
         
-        return queryset
+        return patient_protocol_queryset(queryset, wants_expanded_protocol(self.request))
 
 
 class PatientProtocolDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a patient protocol
     """
-    queryset = PatientProtocol.objects.all().select_related(
-        'patient', 'protocol', 'assigned_by', 'discontinued_by'
-    ).prefetch_related('step_completions', 'consent_forms')
     serializer_class = PatientProtocolSerializer
     permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return patient_protocol_queryset(PatientProtocol.objects.all(), expand_protocol=True)
 
 
 class PatientProtocolsView(generics.ListAPIView):
@@ -184,9 +216,10 @@ class PatientProtocolsView(generics.ListAPIView):
     
     def get_queryset(self):
         patient_id = self.kwargs['patient_id']
-        return PatientProtocol.objects.filter(
-            patient_id=patient_id
-        ).select_related('protocol', 'assigned_by')
+        return patient_protocol_queryset(
+            PatientProtocol.objects.filter(patient_id=patient_id),
+            wants_expanded_protocol(self.request)
+        )
 
 
 # ==================== Protocol Step Completion Views ====================
@@ -300,23 +333,14 @@ class ConsentFormListCreateView(generics.ListCreateAPIView):
         # Filter by valid consents
         valid_only = self.request.query_params.get('valid_only')
         if valid_only == 'true':
-            queryset = queryset.filter(
-                status='obtained'
-            ).filter(
-                Q(expiry_date__isnull=True) | Q(expiry_date__gte=date.today())
-            )
+            queryset = queryset.valid()
         
         # Filter by expiring soon
         expiring_days = self.request.query_params.get('expiring_days')
         if expiring_days:
-            future_date = date.today() + timedelta(days=int(expiring_days))
-            queryset = queryset.filter(
-                status='obtained',
-                expiry_date__lte=future_date,
-                expiry_date__gte=date.today()
-            )
+            queryset = queryset.expiring(int(expiring_days))
         
-        return queryset
+        return queryset.with_validity()
     
     def perform_create(self, serializer):
         serializer.save()
@@ -347,7 +371,7 @@ class PatientConsentFormsView(generics.ListAPIView):
         patient_id = self.kwargs['patient_id']
         return ConsentForm.objects.filter(
             patient_id=patient_id
-        ).select_related('protocol', 'obtained_by')
+        ).select_related('patient', 'protocol', 'obtained_by').with_validity()
 
 
 # ==================== API Function Views ====================
@@ -446,68 +470,74 @@ def withdraw_consent(request, consent_id):
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def expiring_consents(request):
+    """
+    Valid consents expiring within the next N days, soonest first
+    Query params: days (1-365, default 30), protocol
+    """
+    try:
+        days = int(request.query_params.get('days', DEFAULT_EXPIRING_DAYS))
+    except (TypeError, ValueError):
+        days = 0
+    if not 1 <= days <= MAX_EXPIRING_DAYS:
+        return Response(
+            {'error': f'days must be an integer between 1 and {MAX_EXPIRING_DAYS}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    consents = ConsentForm.objects.expiring(days).select_related(
+        'patient', 'protocol'
+    ).order_by('expiry_date', 'id')
+    
+    protocol_id = request.query_params.get('protocol')
+    if protocol_id:
+        try:
+            consents = consents.filter(protocol_id=protocol_id)
+        except ValidationError:
+            return Response({'error': 'protocol must be a valid ID'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = ConsentFormListSerializer(consents, many=True)
+    return Response({'days': days, 'count': len(serializer.data), 'results': serializer.data})
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def protocol_statistics(request):
     """
     Get overall protocol statistics
     """
-    # Total protocols
-    total_protocols = TreatmentProtocol.objects.count()
-    active_protocols = TreatmentProtocol.objects.filter(is_active=True).count()
-    
-    # Protocols by type
-    protocols_by_type = dict(
-        TreatmentProtocol.objects.filter(is_active=True)
-        .values('protocol_type')
-        .annotate(count=Count('id'))
-        .values_list('protocol_type', 'count')
-    )
+    statistics_data, timings = statistics.get_statistics()
     
-    # Protocols by condition
-    protocols_by_condition = dict(
-        TreatmentProtocol.objects.filter(is_active=True)
-        .values('condition__name')
-        .annotate(count=Count('id'))
-        .values_list('condition__name', 'count')
-    )
+    serializer = ProtocolStatisticsSerializer(statistics_data)
+    if not settings.DEBUG:
+        return Response(serializer.data)
     
-    # Patient protocols
-    active_patient_protocols = PatientProtocol.objects.filter(
-        status__in=['pending', 'active']
-    ).count()
-    
-    completed_patient_protocols = PatientProtocol.objects.filter(
-        status='completed'
-    ).count()
-    
-    # Average adherence
-    avg_adherence = PatientProtocol.objects.filter(
-        status__in=['active', 'completed']
-    ).aggregate(Avg('adherence_percentage'))['adherence_percentage__avg'] or 0
-    
-    # Consent forms
-    pending_consents = ConsentForm.objects.filter(status='pending').count()
-    
-    expired_consents = ConsentForm.objects.filter(
-        status='obtained',
-        expiry_date__lt=date.today()
-    ).count()
-    
-    statistics = {
-        'total_protocols': total_protocols,
-        'active_protocols': active_protocols,
-        'protocols_by_type': protocols_by_type,
-        'protocols_by_condition': protocols_by_condition,
-        'active_patient_protocols': active_patient_protocols,
-        'completed_patient_protocols': completed_patient_protocols,
-        'average_adherence': round(avg_adherence, 2),
-        'pending_consents': pending_consents,
-        'expired_consents': expired_consents
-    }
+    data = dict(serializer.data)
+    data['cached'] = timings is None
+    data['timings_ms'] = timings
+    return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def workload_forecast(request):
+    """
+    Projected daily workload from active protocols by step type and site
+    Query params: weeks (1-26, default 12)
+    """
+    try:
+        weeks = int(request.query_params.get('weeks', forecast.DEFAULT_HORIZON_WEEKS))
+    except (TypeError, ValueError):
+        weeks = 0
+    if not 1 <= weeks <= forecast.MAX_HORIZON_WEEKS:
+        return Response(
+            {'error': f'weeks must be an integer between 1 and {forecast.MAX_HORIZON_WEEKS}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    serializer = ProtocolStatisticsSerializer(statistics)
-    return Response(serializer.data)
+    return Response(forecast.get_forecast(weeks))
 
 
 @api_view(['GET'])
@@ -517,12 +547,53 @@ def protocol_by_code(request, code):
     Get a protocol by its code
     """
     protocol = get_object_or_404(
-        TreatmentProtocol,
+        protocol_counts_queryset(TreatmentProtocol.objects.all()),
         code=code.upper(),
         is_active=True
     )
-    serializer = TreatmentProtocolSerializer(protocol)
-    return Response(serializer.data)
+    return _protocol_definition_response(request, protocol)
+
+
+class StepFeedPagination(KeysetPagination):
+    """Protocol step feeds, oldest scheduled date first"""
+    ordering_field = 'scheduled_date'
+
+
+class RecentStepFeedPagination(StepFeedPagination):
+    """Protocol step feeds, most recent scheduled date first"""
+    descending = True
+
+
+def _step_feed_response(request, queryset, serializer_class, pagination_class=StepFeedPagination):
+    """
+    Shared handling for step completion feeds: optional ?protocol=, ?clinician=
+    (assigning clinician) and ?patient= filters, ?count_only=true for dashboard
+    badges, otherwise a keyset-paginated page of results
+    """
+    filters_map = {
+        'protocol': 'patient_protocol__protocol_id',
+        'clinician': 'patient_protocol__assigned_by_id',
+        'patient': 'patient_protocol__patient_id',
+    }
+    try:
+        for param, lookup in filters_map.items():
+            value = request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        
+        if request.query_params.get('count_only') == 'true':
+            return Response({'count': queryset.count()})
+        
+        paginator = pagination_class()
+        page = paginator.paginate_queryset(queryset, request)
+    except ValidationError:
+        return Response(
+            {'error': 'protocol, clinician and patient must be valid IDs'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    serializer = serializer_class(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -540,10 +611,9 @@ def upcoming_protocol_steps(request):
         scheduled_date__lte=two_weeks_ahead
     ).select_related(
         'patient_protocol__patient', 'protocol_step', 'patient_protocol__protocol'
-    ).order_by('scheduled_date')
+    )
     
-    serializer = ProtocolStepCompletionListSerializer(upcoming, many=True)
-    return Response(serializer.data)
+    return _step_feed_response(request, upcoming, ProtocolStepCompletionListSerializer)
 
 
 @api_view(['GET'])
@@ -557,10 +627,9 @@ def overdue_protocol_steps(request):
         scheduled_date__lt=date.today()
     ).select_related(
         'patient_protocol__patient', 'protocol_step', 'patient_protocol__protocol'
-    ).order_by('scheduled_date')
+    )
     
-    serializer = ProtocolStepCompletionListSerializer(overdue, many=True)
-    return Response(serializer.data)
+    return _step_feed_response(request, overdue, ProtocolStepCompletionListSerializer)
 
 
 @api_view(['GET'])
@@ -568,27 +637,41 @@ def overdue_protocol_steps(request):
 def protocol_adherence_report(request):
     """
     Get protocol adherence metrics
+    Reads the incrementally maintained step counters on each patient protocol;
+    overall_adherence pools steps across all assignments
     """
+    counters = {
+        'avg_adherence': Avg('patient_assignments__adherence_percentage'),
+        'total_assignments': Count('patient_assignments'),
+        'scheduled_steps': Coalesce(Sum('patient_assignments__step_completion_count'), 0),
+        'completed_steps': Coalesce(Sum('patient_assignments__total_steps_completed'), 0),
+        'on_time_steps': Coalesce(Sum('patient_assignments__on_time_step_count'), 0),
+    }
+    
     # Adherence by protocol
     adherence_by_protocol = TreatmentProtocol.objects.filter(
         is_active=True
-    ).annotate(
-        avg_adherence=Avg('patient_assignments__adherence_percentage'),
-        total_assignments=Count('patient_assignments')
-    ).values('id', 'name', 'code', 'avg_adherence', 'total_assignments')
+    ).annotate(**counters).values('id', 'name', 'code', *counters)
     
     # Adherence by condition
     adherence_by_condition = TreatmentProtocol.objects.filter(
         is_active=True
     ).values('condition__name').annotate(
-        avg_adherence=Avg('patient_assignments__adherence_percentage'),
         total_protocols=Count('id', distinct=True),
-        total_assignments=Count('patient_assignments')
+        **counters
     )
     
+    def with_overall(rows):
+        rows = list(rows)
+        for row in rows:
+            row['overall_adherence'] = float(
+                adherence.adherence_percentage(row['on_time_steps'], row['scheduled_steps'])
+            )
+        return rows
+    
     return Response({
-        'by_protocol': list(adherence_by_protocol),
-        'by_condition': list(adherence_by_condition)
+        'by_protocol': with_overall(adherence_by_protocol),
+        'by_condition': with_overall(adherence_by_condition)
     })
 
 
@@ -602,13 +685,23 @@ def adverse_events_report(request):
         adverse_event=True
     ).select_related(
         'patient_protocol__patient',
-        'protocol_step',
         'patient_protocol__protocol',
-        'completed_by'
-    ).order_by('-completed_date')
+        'patient_protocol__assigned_by',
+        'protocol_step__protocol',
+        'protocol_step__medication',
+        'protocol_step__parent_step',
+        'completed_by',
+        'rescheduled_by'
+    ).prefetch_related(
+        'protocol_step__medications__medication',
+        'protocol_step__treatments',
+        'protocol_step__tests',
+        'protocol_step__child_branches'
+    )
     
-    serializer = ProtocolStepCompletionSerializer(adverse_events, many=True)
-    return Response(serializer.data)
+    return _step_feed_response(
+        request, adverse_events, ProtocolStepCompletionSerializer, RecentStepFeedPagination
+    )
 
 
 @api_view(['POST'])
@@ -616,10 +709,13 @@ def adverse_events_report(request):
 def bulk_reschedule_steps(request):
     """
     Bulk reschedule multiple protocol steps
+    With cascade=true, dependent 'from_previous' steps later in the same
+    patient protocol are shifted by the same number of days
     """
     step_ids = request.data.get('step_ids', [])
     days_to_add = request.data.get('days_to_add', 0)
     reason = request.data.get('reason', 'Bulk rescheduling')
+    cascade = str(request.data.get('cascade', False)).lower() == 'true'
     
     if not step_ids:
         return Response(
@@ -627,24 +723,31 @@ def bulk_reschedule_steps(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    steps = ProtocolStepCompletion.objects.filter(
-        id__in=step_ids,
-        status='scheduled'
-    )
+    try:
+        days_to_add = int(days_to_add)
+    except (TypeError, ValueError):
+        return Response(
+            {'error': 'days_to_add must be an integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    updated_count = 0
-    for step in steps:
-        step.original_scheduled_date = step.scheduled_date
-        step.scheduled_date = step.scheduled_date + timedelta(days=days_to_add)
-        step.reschedule_reason = reason
-        step.rescheduled_by = request.user
-        step.status = 'rescheduled'
-        step.save()
-        updated_count += 1
+    try:
+        rescheduled_ids, cascaded_ids = scheduling.reschedule_completions(
+            step_ids, days_to_add, reason, request.user, cascade=cascade
+        )
+    except ValidationError:
+        return Response(
+            {'error': 'step_ids must be valid step completion IDs'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
+    updated_count = len(rescheduled_ids)
     return Response({
         'message': f'Successfully rescheduled {updated_count} steps',
-        'updated_count': updated_count
+        'updated_count': updated_count,
+        'updated_ids': [str(step_id) for step_id in rescheduled_ids],
+        'cascaded_count': len(cascaded_ids),
+        'cascaded_ids': [str(step_id) for step_id in cascaded_ids]
     })
 
 
@@ -768,64 +871,100 @@ def assign_protocol_to_patient(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Create patient protocol
-    patient_protocol = PatientProtocol.objects.create(
-        patient=patient,
-        protocol=protocol,
-        start_date=start_date,
-        status='pending',
-        assigned_by=request.user,
-        assignment_reason=assignment_reason
-    )
+    if protocol.requires_consent and not ConsentForm.objects.valid().filter(
+        patient=patient, protocol=protocol
+    ).exists():
+        return Response(
+            {'error': f'Valid consent required for {protocol.name} protocol'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    # Generate step completions for all protocol steps
-    steps = protocol.steps.all().order_by('step_number')
-    
-    for step in steps:
-        # Calculate scheduled date based on timing type
-        if step.timing_type == 'fixed':
-            scheduled_date = start_date + timedelta(days=step.timing_days)
-        elif step.timing_type == 'from_previous':
-            # For now, treat same as fixed (will be updated based on actual completion)
-            scheduled_date = start_date + timedelta(days=step.timing_days)
-        elif step.timing_type == 'weekly':
-            # Weekly recurring
-            scheduled_date = start_date + timedelta(weeks=step.timing_days)
-        elif step.timing_type == 'monthly':
-            # Monthly recurring
-            scheduled_date = start_date + timedelta(days=step.timing_days * 30)
-        else:
-            scheduled_date = start_date + timedelta(days=step.timing_days)
-        
-        # Create main step completion
-        step_completion = ProtocolStepCompletion.objects.create(
-            patient_protocol=patient_protocol,
-            protocol_step=step,
-            scheduled_date=scheduled_date,
-            status='scheduled'
+    # Create patient protocol and its full step schedule
+    with transaction.atomic():
+        patient_protocol = PatientProtocol.objects.create(
+            patient=patient,
+            protocol=protocol,
+            start_date=start_date,
+            status='pending',
+            assigned_by=request.user,
+            assignment_reason=assignment_reason
         )
-        
-        # If step is recurring, create additional completions
-        if step.is_recurring and step.recurrence_count:
-            for i in range(1, step.recurrence_count):
-                if step.timing_type == 'weekly':
-                    next_date = scheduled_date + timedelta(weeks=i)
-                elif step.timing_type == 'monthly':
-                    next_date = scheduled_date + timedelta(days=i * 30)
-                else:
-                    next_date = scheduled_date + timedelta(days=step.timing_days * i)
-                
-                ProtocolStepCompletion.objects.create(
-                    patient_protocol=patient_protocol,
-                    protocol_step=step,
-                    scheduled_date=next_date,
-                    status='scheduled'
-                )
+        scheduling.schedule_patient_protocol(patient_protocol)
     
     serializer = PatientProtocolSerializer(patient_protocol)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def assign_protocol_to_cohort(request):
+    """
+    Assign a protocol to a list of patients (e.g. a clinic cohort) in one request
+    Returns a result per patient; patients that cannot be assigned are skipped
+    """
+    patient_ids = request.data.get('patients', [])
+    protocol_id = request.data.get('protocol')
+    start_date_str = request.data.get('start_date')
+    assignment_reason = request.data.get('assignment_reason', '')
+    
+    if not all([patient_ids, protocol_id, start_date_str]) or not isinstance(patient_ids, list):
+        return Response(
+            {'error': 'patients (list), protocol, and start_date are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if len(patient_ids) > scheduling.MAX_COHORT_SIZE:
+        return Response(
+            {'error': f'At most {scheduling.MAX_COHORT_SIZE} patients can be assigned per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        start_date = date.fromisoformat(start_date_str)
+    except (TypeError, ValueError):
+        return Response(
+            {'error': 'Invalid start_date format. Use YYYY-MM-DD'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    from patients.models import Patient
+    
+    try:
+        protocol = TreatmentProtocol.objects.get(id=protocol_id)
+        patients_by_id = {
+            str(patient.id): patient
+            for patient in Patient.objects.filter(id__in=patient_ids)
+        }
+    except (TreatmentProtocol.DoesNotExist, ValidationError):
+        return Response(
+            {'error': 'Protocol not found or invalid patient IDs'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    missing = [str(pid) for pid in patient_ids if str(pid) not in patients_by_id]
+    if missing:
+        return Response(
+            {'error': 'Patients not found', 'missing_patients': missing},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    results = scheduling.assign_protocol_to_cohort(
+        protocol,
+        [patients_by_id[str(pid)] for pid in patient_ids],
+        start_date,
+        assigned_by=request.user,
+        assignment_reason=assignment_reason
+    )
+    assigned_count = sum(1 for result in results if result['status'] == 'assigned')
+    
+    return Response({
+        'protocol': str(protocol.id),
+        'assigned_count': assigned_count,
+        'skipped_count': len(results) - assigned_count,
+        'results': results
+    }, status=status.HTTP_201_CREATED if assigned_count else status.HTTP_200_OK)
+
+
 # ==================== Protocol Step Result Views ====================
 
 class ProtocolStepResultListCreateView(generics.ListCreateAPIView):
@@ -934,6 +1073,31 @@ def get_step_results(request, completion_id):
     return Response(serializer.data)
 
 
+def _branching_summary(step_completion):
+    """
+    Evaluate every result of a step completion against its step's compiled
+    branch logic; expects results and protocol_step to be loaded already
+    """
+    step = step_completion.protocol_step
+    next_steps = []
+    for result in step_completion.results.all():
+        next_step = result.evaluate_branching(step)
+        if next_step:
+            next_steps.append({
+                'result_label': result.result_label,
+                'result_value': result.get_result_display(),
+                'next_step': next_step,
+                'branch_taken': result.branch_taken
+            })
+    
+    return {
+        'step_completion_id': str(step_completion.id),
+        'current_step': step.step_number,
+        'branching_evaluations': next_steps,
+        'recommended_next_step': next_steps[0]['next_step'] if next_steps else None
+    }
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def evaluate_branching(request, completion_id):
@@ -941,31 +1105,61 @@ def evaluate_branching(request, completion_id):
     Manually trigger branching logic evaluation
     Returns suggested next step based on results
     """
-    from .models import ProtocolStepCompletion, ProtocolStepResult
-    
-    step_completion = get_object_or_404(ProtocolStepCompletion, id=completion_id)
-    results = step_completion.results.all()
+    step_completion = get_object_or_404(
+        ProtocolStepCompletion.objects.select_related('protocol_step').prefetch_related('results'),
+        id=completion_id
+    )
     
-    if not results.exists():
+    if not step_completion.results.all():
         return Response({
             'error': 'No results recorded for this step'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Evaluate each result
-    next_steps = []
-    for result in results:
-        next_step = result.evaluate_branching()
-        if next_step:
-            next_steps.append({
-                'result_label': result.result_label,
-                'result_value': result.get_result_display(),
-                'next_step': next_step,
-                'branch_taken': result.branch_taken
-            })
+    return Response(_branching_summary(step_completion))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def evaluate_branching_batch(request):
+    """
+    Evaluate branching for many step completions in one call
+    Completions without results are reported with no recommendation
+    """
+    completion_ids = request.data.get('completion_ids', [])
+    
+    if not completion_ids or not isinstance(completion_ids, list):
+        return Response(
+            {'error': 'completion_ids (list) required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if len(completion_ids) > MAX_BATCH_EVALUATIONS:
+        return Response(
+            {'error': f'At most {MAX_BATCH_EVALUATIONS} completions can be evaluated per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        completions = {
+            str(completion.id): completion
+            for completion in ProtocolStepCompletion.objects.filter(
+                id__in=completion_ids
+            ).select_related('protocol_step').prefetch_related('results')
+        }
+    except ValidationError:
+        return Response(
+            {'error': 'completion_ids must be valid step completion IDs'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     return Response({
-        'step_completion_id': completion_id,
-        'current_step': step_completion.protocol_step.step_number,
-        'branching_evaluations': next_steps,
-        'recommended_next_step': next_steps[0]['next_step'] if next_steps else None
+        'evaluations': [
+            _branching_summary(completions[str(completion_id)])
+            for completion_id in completion_ids
+            if str(completion_id) in completions
+        ],
+        'not_found': [
+            str(completion_id) for completion_id in completion_ids
+            if str(completion_id) not in completions
+        ]
     })
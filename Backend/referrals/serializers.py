@@ -204,6 +204,7 @@ class ReferralListSerializer(serializers.ModelSerializer):
             'sent_date', 'appointment_date', 'referred_by_name', 'is_active',
             'days_since_referral', 'is_overdue', 'responses_count', 'documents_count'
         ]
+        field_relations = {'responses_count': ['responses'], 'documents_count': ['documents']}
     
     def get_days_since_referral(self, obj):
         if obj.referral_date:
@@ -10,6 +10,7 @@ from django.db.models import Count, Q, Avg
 from django.shortcuts import get_object_or_404
 from datetime import date, timedelta
 
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import ReferralSource, Referral, ReferralDocument, ReferralResponse
 from .serializers import (
     ReferralSourceSerializer, ReferralSourceListSerializer,
@@ -57,7 +58,7 @@ class ReferralSourceDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 # ==================== Referral Views ====================
 
-class ReferralListCreateView(generics.ListCreateAPIView):
+class ReferralListCreateView(SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     List all referrals or create a new one
     """
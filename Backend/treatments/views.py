@@ -7,6 +7,7 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 from django.db.models import Q, Count, Avg
+from precise_optics.fieldsets import SparseFieldsetsMixin
 from .models import (
     TreatmentCategory, TreatmentType, Treatment, TreatmentMedication,
     TreatmentDocument, TreatmentFollowUp, TreatmentComplication
@@ -57,7 +58,7 @@ class TreatmentTypeViewSet(viewsets.ModelViewSet):
         return Response(result)
 
 
-class TreatmentViewSet(viewsets.ModelViewSet):
+class TreatmentViewSet(SparseFieldsetsMixin, viewsets.ModelViewSet):
     queryset = Treatment.objects.select_related(
         'patient', 'consultation', 'treatment_type', 'treatment_type__category',
         'primary_surgeon', 'consent_obtained_by'